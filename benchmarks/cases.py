@@ -0,0 +1,209 @@
+"""Synthetic inputs and benchmark cases for the client hot paths."""
+
+import collections
+import glob
+import os
+import random
+import sys
+import types
+import weakref
+
+import numpy as np
+import pygame
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import carla
+
+from src.camera import CameraManager
+from src.conversion import ImageConverter
+from src.dynamics import DynamicsTables, VehicleParameters
+from src.interface import HUD, FadingText
+from src.latency import LatencyTracker
+from src.localization import GeoReference, Localizer
+from src.occupancy import OccupancyGrid
+from src.pointcloud import decode_lidar, remove_ground, voxel_downsample
+from src.sensors import CollisionSensor, RadarSensor
+from src.utils import get_actor_display_name
+
+FRAME_SIZES = [(1280, 720), (1920, 1080)]
+RADAR_POINTS = 1500
+COLLISION_HISTORY = 4000
+ROLLOUTS = (4000, 30)
+LIDAR_POINTS = 28800
+HORIZON = 30
+CAMERA_MODES = ["raw", "depth", "log_depth", "cityscapes"]
+
+
+def _ns(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+def fake_image(width, height, frame=0):
+    raw = np.random.randint(0, 255, size=(height, width, 4), dtype=np.uint8).tobytes()
+    return _ns(raw_data=raw, width=width, height=height, frame=frame, convert=lambda _: None)
+
+
+def fake_radar(points):
+    detections = [
+        _ns(
+            azimuth=random.uniform(-0.3, 0.3),
+            altitude=random.uniform(-0.17, 0.17),
+            depth=random.uniform(1.0, 100.0),
+            velocity=random.uniform(-10.0, 10.0),
+        )
+        for _ in range(points)
+    ]
+    return _FakeRadarMeasurement(detections, carla.Transform(carla.Location(x=2.8, z=1.0)))
+
+
+class _FakeRadarMeasurement(list):
+    def __init__(self, detections, transform, frame=0):
+        super().__init__(detections)
+        self.transform = transform
+        self.frame = frame
+
+
+def fake_actor(type_id="vehicle.tesla.model3"):
+    return _ns(type_id=type_id)
+
+
+def fake_world(hud, history):
+    control = _ns(throttle=0.5, steer=-0.1, brake=0.0, reverse=False, hand_brake=False, manual_gear_shift=False, gear=3)
+    player = _ns(
+        type_id="vehicle.tesla.model3",
+        get_transform=lambda: _ns(location=_ns(x=12.0, y=-240.0, z=0.3), rotation=_ns(pitch=0.0, yaw=21.7, roll=0.0)),
+        get_velocity=lambda: _ns(x=5.0, y=1.0, z=0.0),
+        get_control=lambda: control,
+    )
+    collision_sensor = object.__new__(CollisionSensor)
+    collision_sensor.history = history
+    collision_sensor.hud = hud
+    return _ns(
+        player=player,
+        map=_ns(name="Town04"),
+        imu_sensor=_ns(compass=42.0, accelerometer=(0.1, 0.2, 9.8), gyroscope=(0.0, 0.0, 1.0)),
+        gnss_sensor=_ns(lat=0.001, lon=0.002),
+        lidar_sensor=None,
+        localizer=None,
+        vehicle_parameters=None,
+        camera_manager=_ns(convert_ms=[2.0]),
+        collision_sensor=collision_sensor,
+        actor_index=_ns(count=lambda _: 50),
+    )
+
+
+def fake_history(entries, frame=10000):
+    return [(frame - random.randint(0, 400), random.uniform(0.0, 5000.0)) for _ in range(entries)]
+
+
+def _camera_manager(hud, mode):
+    manager = object.__new__(CameraManager)
+    manager.hud = hud
+    manager.surface = None
+    manager.recording = False
+    manager.sensors = [["sensor.camera.rgb", mode, "Camera", {}]]
+    manager.index = 0
+    manager.converter = ImageConverter()
+    manager.convert_ms = collections.deque(maxlen=100)
+    return manager
+
+
+def build_cases():
+    """Return a list of (name, callable) benchmark cases."""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    pygame.init()
+    pygame.font.init()
+    cases = []
+
+    for width, height in FRAME_SIZES:
+        hud = HUD(width, height)
+        image = fake_image(width, height)
+        for mode in CAMERA_MODES:
+            manager = _camera_manager(hud, mode)
+            # The lambdas hold the sensor objects alive, the callbacks only see weak references.
+            cases.append(
+                (
+                    "camera_parse_image_%s_%dx%d" % (mode, width, height),
+                    lambda m=manager, i=image: CameraManager._parse_image(weakref.ref(m), i),
+                )
+            )
+
+    radar = object.__new__(RadarSensor)
+    radar.velocity_range = 7.5
+    radar.debug = _ns(draw_point=lambda *args, **kwargs: None)
+    radar._latency = LatencyTracker()
+    radar.occupancy = None
+    radar_data = fake_radar(RADAR_POINTS)
+    cases.append(
+        ("radar_callback_%d" % RADAR_POINTS, lambda r=radar: RadarSensor._Radar_callback(weakref.ref(r), radar_data))
+    )
+
+    grid = OccupancyGrid()
+    sweep = np.random.rand(RADAR_POINTS, 4).astype(np.float32) * (15.0, 0.35, 0.6, 100.0) - (7.5, 0.17, 0.3, 0.0)
+    cases.append(("occupancy_fuse_%d" % RADAR_POINTS, lambda: grid.fuse_radar(sweep, np.eye(4))))
+    rollouts = np.random.rand(*ROLLOUTS, 2) * 60.0 - 30.0
+    cases.append(("occupancy_cost_%dx%d" % ROLLOUTS, lambda: grid.cost(rollouts)))
+
+    cloud = np.random.rand(LIDAR_POINTS, 4) * (100.0, 100.0, 3.0, 1.0) - (50.0, 50.0, 2.4, 0.0)
+    raw_cloud = cloud.astype(np.float32).tobytes()
+    cases.append(
+        ("lidar_sweep_%d" % LIDAR_POINTS, lambda: remove_ground(voxel_downsample(decode_lidar(raw_cloud), 0.2)))
+    )
+
+    localizer = Localizer(GeoReference(0.0, 0.0))
+    localizer.update_gnss(0.0, 0.0)
+    localizer.predict(0.0, 0.0, 0.0, 0.0)
+    imu_clock = [0.0]
+
+    def ekf_predict():
+        imu_clock[0] += 0.01
+        localizer.predict(imu_clock[0], 1.0, 0.1, 0.05)
+        localizer.update_yaw(0.3)
+
+    cases.append(("ekf_imu_predict", ekf_predict))
+    cases.append(("ekf_gnss_update", lambda: localizer.update_gnss(1e-5, 2e-5)))
+
+    parameters = VehicleParameters("vehicle.tesla.model3", 1845.0, 1.4, 1.475, np.radians(70.0), 17.0, 3.5)
+    dynamics = DynamicsTables.build(parameters, speeds=np.linspace(0.5, 40.0, 10), frictions=np.linspace(0.05, 1.2, 4))
+    cases.append(("dynamics_lookup", lambda: dynamics.lookup(12.3, 0.04, 0.3)))
+    horizon = (np.linspace(5.0, 20.0, HORIZON), np.linspace(-0.1, 0.1, HORIZON), np.full(HORIZON, 0.3))
+    cases.append(("dynamics_lookup_batch_%d" % HORIZON, lambda: dynamics.lookup_batch(*horizon)))
+
+    hud = HUD(*FRAME_SIZES[0])
+    world = fake_world(hud, fake_history(COLLISION_HISTORY))
+    cases.append(("collision_history_%d" % COLLISION_HISTORY, world.collision_sensor.get_collision_history))
+
+    hud.frame = 10000
+    clock = pygame.time.Clock()
+    display = pygame.Surface(hud.dim)
+    cases.append(("hud_tick", lambda: hud.tick(world, clock)))
+    hud.tick(world, clock)
+    cases.append(("hud_render", lambda: hud.render(display)))
+
+    plots = hud.plots
+    samples = plots.dim[0]
+    for step in range(samples):
+        plots.append(plots.seconds * step / samples, (50.0, 3.0, 2.5, 1.0, 0.1, 0.5, 0.0))
+    cases.append(("plot_panel_draw_%d" % samples, plots._draw))
+
+    font = pygame.font.Font(pygame.font.get_default_font(), 20)
+    fading = FadingText(font, (FRAME_SIZES[0][0], 40), (0, FRAME_SIZES[0][1] - 40))
+    cases.append(("fading_text_set_text", lambda: fading.set_text("Collision with 'Guardrail'")))
+    frame_clock = _ns(get_time=lambda: 16)
+
+    def notification_burst():
+        for _ in range(20):
+            fading.set_text("Collision with 'Guardrail'")
+        fading.tick(None, frame_clock)
+
+    cases.append(("fading_text_burst_20", notification_burst))
+
+    actor = fake_actor("vehicle.mercedes_benz.coupe_2020")
+    cases.append(("get_actor_display_name", lambda: get_actor_display_name(actor, truncate=20)))
+    return cases
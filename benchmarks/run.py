@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+"""
+Run the client hot path micro-benchmarks and compare them against a JSON baseline.
+
+    env PYTHONPATH=. python benchmarks/run.py                  # run and compare
+    env PYTHONPATH=. python benchmarks/run.py --save-baseline  # run and store as the new baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from benchmarks.cases import build_cases
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(fn, min_time, repeat):
+    """Return per-call timings in microseconds over `repeat` rounds of at least `min_time` seconds."""
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+    rounds = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        rounds.append((time.perf_counter() - start) / loops)
+    return {"min_us": 1e6 * min(rounds), "median_us": 1e6 * statistics.median(rounds), "loops": loops}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print("%-32s %12s %12s %8s" % ("case", "median us", "baseline us", "ratio"))
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            print("%-32s %12.1f %12s %8s" % (name, result["median_us"], "-", "new"))
+            continue
+        ratio = result["median_us"] / reference["median_us"]
+        flag = " <-- regression" if ratio > threshold else ""
+        print("%-32s %12.1f %12.1f %7.2fx%s" % (name, result["median_us"], reference["median_us"], ratio, flag))
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument(
+        "--baseline", metavar="PATH", default=os.path.join(HERE, "baseline.json"), help="baseline JSON file"
+    )
+    argparser.add_argument(
+        "--output", metavar="PATH", default=os.path.join(HERE, "results", "latest.json"), help="results JSON file"
+    )
+    argparser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    argparser.add_argument(
+        "--threshold", metavar="R", default=1.25, type=float, help="slowdown ratio reported as regression (1.25)"
+    )
+    argparser.add_argument("--min-time", metavar="S", default=0.2, type=float, help="minimum seconds per round")
+    argparser.add_argument("--repeat", metavar="N", default=5, type=int, help="rounds per case (default: 5)")
+    argparser.add_argument("-k", metavar="PATTERN", default="", help="only run cases containing PATTERN")
+    args = argparser.parse_args()
+
+    results = {}
+    for name, fn in build_cases():
+        if args.k in name:
+            results[name] = measure(fn, args.min_time, args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as out:
+        json.dump(report, out, indent=2, sort_keys=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as base:
+            baseline = json.load(base)["results"]
+    regressions = compare(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+        print("baseline saved to %s" % args.baseline)
+    elif regressions:
+        print("%d regression(s): %s" % (len(regressions), ", ".join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+
+    main()
@@ -29,12 +29,21 @@ except IndexError:
 
 import argparse
 import datetime
+import hashlib
+import json
 import re
 import socket
 import textwrap
+import threading
+import time
 
 import carla
 
+from src.profiles import PROFILES, apply_profile, measure_server_fps
+from src.utils import cache_path, get_actor_categories, get_actor_category
+
+ACTOR_CATEGORIES = ("spectator", "static", "traffic", "vehicle", "walker")
+
 
 def get_ip(host):
     if host in ["localhost", "127.0.0.1"]:
@@ -65,6 +74,8 @@ def list_options(client):
     print(wrap(", ".join(x for _, x in find_weather_presets())) + ".\n")
     print("available maps:\n")
     print(wrap(", ".join(sorted(maps))) + ".\n")
+    print("performance profiles:\n")
+    print(wrap(", ".join(sorted(PROFILES))) + ".\n")
 
 
 def list_blueprints(world, bp_filter):
@@ -76,15 +87,20 @@ def list_blueprints(world, bp_filter):
     print("")
 
 
-def inspect(args, client):
-    address = "%s:%d" % (get_ip(args.host), args.port)
+def categorize_actors(actors):
+    """Count the actors of every category in a single pass over their type ids."""
+    counts = dict.fromkeys(ACTOR_CATEGORIES, 0)
+    for actor in actors:
+        category = get_actor_category(actor)
+        if category in counts:
+            counts[category] += 1
+    return counts
 
-    world = client.get_world()
-    elapsed_time = world.get_snapshot().timestamp.elapsed_seconds
-    elapsed_time = datetime.timedelta(seconds=int(elapsed_time))
 
-    actors = world.get_actors()
-    s = world.get_settings()
+def inspect_info(client, host, port):
+    world = client.get_world()
+    snapshot = world.get_snapshot()
+    settings = world.get_settings()
 
     weather = "Custom"
     current_weather = world.get_weather()
@@ -92,29 +108,358 @@ def inspect(args, client):
         if current_weather == preset:
             weather = name
 
-    if s.fixed_delta_seconds is None:
+    if settings.fixed_delta_seconds is None:
         frame_rate = "variable"
     else:
-        frame_rate = "%.2f ms (%d FPS)" % (1000.0 * s.fixed_delta_seconds, 1.0 / s.fixed_delta_seconds)
+        frame_rate = "%.2f ms (%d FPS)" % (1000.0 * settings.fixed_delta_seconds, 1.0 / settings.fixed_delta_seconds)
 
+    actors = world.get_actors()
+    return {
+        "address": "%s:%d" % (get_ip(host), port),
+        "version": client.get_server_version(),
+        "map": world.get_map().name,
+        "weather": weather,
+        "time": str(datetime.timedelta(seconds=int(snapshot.timestamp.elapsed_seconds))),
+        "frame rate": frame_rate,
+        "rendering": "disabled" if settings.no_rendering_mode else "enabled",
+        "sync mode": "disabled" if not settings.synchronous_mode else "enabled",
+        "actors": len(actors),
+        "categories": categorize_actors(actors),
+    }
+
+
+def inspect(args, client):
+    info = inspect_info(client, args.host, args.port)
+    categories = info["categories"]
     print("-" * 34)
-    print("address:% 26s" % address)
-    print("version:% 26s\n" % client.get_server_version())
-    print("map:        % 22s" % world.get_map().name)
-    print("weather:    % 22s\n" % weather)
-    print("time:       % 22s\n" % elapsed_time)
-    print("frame rate: % 22s" % frame_rate)
-    print("rendering:  % 22s" % ("disabled" if s.no_rendering_mode else "enabled"))
-    print("sync mode:  % 22s\n" % ("disabled" if not s.synchronous_mode else "enabled"))
-    print("actors:     % 22d" % len(actors))
-    print("  * spectator:% 20d" % len(actors.filter("spectator")))
-    print("  * static:   % 20d" % len(actors.filter("static.*")))
-    print("  * traffic:  % 20d" % len(actors.filter("traffic.*")))
-    print("  * vehicles: % 20d" % len(actors.filter("vehicle.*")))
-    print("  * walkers:  % 20d" % len(actors.filter("walker.*")))
+    print("address:% 26s" % info["address"])
+    print("version:% 26s\n" % info["version"])
+    print("map:        % 22s" % info["map"])
+    print("weather:    % 22s\n" % info["weather"])
+    print("time:       % 22s\n" % info["time"])
+    print("frame rate: % 22s" % info["frame rate"])
+    print("rendering:  % 22s" % info["rendering"])
+    print("sync mode:  % 22s\n" % info["sync mode"])
+    print("actors:     % 22d" % info["actors"])
+    print("  * spectator:% 20d" % categories["spectator"])
+    print("  * static:   % 20d" % categories["static"])
+    print("  * traffic:  % 20d" % categories["traffic"])
+    print("  * vehicles: % 20d" % categories["vehicle"])
+    print("  * walkers:  % 20d" % categories["walker"])
     print("-" * 34)
 
 
+class ActorCensus:
+    """Actor counts per category, updated from the actor ids of each snapshot.
+
+    Only the ids that appeared since the previous update are requested from the server, ids it does not return
+    are kept as unknown so that they are not requested again.
+    """
+
+    def __init__(self, world):
+        self._world = world
+        self._categories = {}
+        self.counts = dict.fromkeys(ACTOR_CATEGORIES, 0)
+        self.added = 0
+        self.removed = 0
+
+    def update(self, actor_ids):
+        new = actor_ids.difference(self._categories)
+        gone = set(self._categories).difference(actor_ids)
+        for actor_id in gone:
+            category = self._categories.pop(actor_id)
+            if category in self.counts:
+                self.counts[category] -= 1
+        if new:
+            for actor_id, category in get_actor_categories(self._world, new).items():
+                self._categories[actor_id] = category
+                if category in self.counts:
+                    self.counts[category] += 1
+        self.added, self.removed = len(new), len(gone)
+
+
+def watch(args, client):
+    """Print server health every --interval seconds from a single connection until interrupted."""
+    world = client.get_world()
+    address = "%s:%d" % (get_ip(args.host), args.port)
+    lock = threading.Lock()
+    latest = {"snapshot": world.get_snapshot(), "ticks": 0}
+
+    def on_tick(snapshot):
+        # Only keep the snapshot, its actors are read at the refresh interval.
+        with lock:
+            latest["snapshot"] = snapshot
+            latest["ticks"] += 1
+
+    census = ActorCensus(world)
+    census.update(set(actor.id for actor in latest["snapshot"]))
+    callback_id = world.on_tick(on_tick)
+    interactive = args.watch == "table" and sys.stdout.isatty()
+    last_time, last_ticks = time.time(), 0
+    try:
+        while True:
+            time.sleep(args.interval)
+            now = time.time()
+            with lock:
+                snapshot, ticks = latest["snapshot"], latest["ticks"]
+            frame, elapsed = snapshot.frame, snapshot.timestamp.elapsed_seconds
+            if ticks != last_ticks:
+                census.update(set(actor.id for actor in snapshot))
+            fps = (ticks - last_ticks) / (now - last_time)
+            last_time, last_ticks = now, ticks
+            record = {
+                "time": round(now, 3),
+                "address": address,
+                "frame": frame,
+                "elapsed": round(elapsed, 3),
+                "fps": round(fps, 1),
+                "actors": sum(census.counts.values()),
+                "added": census.added,
+                "removed": census.removed,
+            }
+            record.update(census.counts)
+            if args.watch == "ndjson":
+                print(json.dumps(record), flush=True)
+                continue
+            lines = [
+                "-" * 34,
+                "address:% 26s" % address,
+                "frame:      % 22d" % frame,
+                "time:       % 22s" % datetime.timedelta(seconds=int(elapsed)),
+                "server:     % 18.1f FPS" % fps,
+                "actors:     % 22d" % record["actors"],
+                "  * spectator:% 20d" % record["spectator"],
+                "  * static:   % 20d" % record["static"],
+                "  * traffic:  % 20d" % record["traffic"],
+                "  * vehicles: % 20d" % record["vehicle"],
+                "  * walkers:  % 20d" % record["walker"],
+                "  (+%d / -%d since last refresh)" % (census.added, census.removed),
+                "-" * 34,
+            ]
+            # Redraw in place on a terminal, append otherwise.
+            print(("\x1b[H\x1b[2J" if interactive else "") + "\n".join(lines), flush=True)
+    finally:
+        world.remove_on_tick(callback_id)
+
+
+def parse_hosts(text, default_port):
+    """Parse a comma separated list of HOST or HOST:PORT."""
+    hosts = []
+    for entry in text.split(","):
+        host, _, port = entry.strip().partition(":")
+        if host:
+            hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+def configure_host(args, host, port):
+    start = time.time()
+    messages = []
+    client = carla.Client(host, port, worker_threads=1)
+    client.set_timeout(min(args.timeout, args.host_timeout))
+    configure(args, client, messages.append, "%s_%d" % (host, port))
+    info = inspect_info(client, host, port)
+    info["log"] = messages
+    info["seconds"] = round(time.time() - start, 2)
+    return info
+
+
+def fleet(args):
+    """Configure and inspect every host of `--hosts` concurrently, then print one aggregated report."""
+    hosts = parse_hosts(args.hosts, args.port)
+    outcomes = [{} for _ in hosts]
+
+    def run(outcome, host, port):
+        try:
+            outcome["info"] = configure_host(args, host, port)
+        except Exception as error:
+            outcome["error"] = error
+
+    # Daemon threads, a host that does not answer in time must not keep the process alive until its client
+    # timeout once the report is printed.
+    threads = [
+        threading.Thread(target=run, args=(outcome, host, port), daemon=True)
+        for outcome, (host, port) in zip(outcomes, hosts)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + args.host_timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.time()))
+    results = []
+    for (host, port), outcome in zip(hosts, outcomes):
+        info = {"address": "%s:%d" % (host, port)}
+        if "info" in outcome:
+            info.update(outcome["info"])
+            info["status"] = "ok"
+        elif "error" in outcome:
+            info["status"] = "error: %s" % outcome["error"]
+        else:
+            info["status"] = "timed out after %.0f s" % args.host_timeout
+        results.append(info)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    columns = [
+        ("address", "%-21s"),
+        ("map", "%-22s"),
+        ("weather", "%-14s"),
+        ("frame rate", "%-18s"),
+        ("rendering", "%-9s"),
+        ("sync mode", "%-9s"),
+        ("actors", "%6s"),
+        ("vehicle", "%8s"),
+        ("walker", "%7s"),
+        ("seconds", "%7s"),
+    ]
+    for info in results:
+        for message in info.get("log", []):
+            print("%s: %s" % (info["address"], message))
+    header = " ".join(fmt % name for name, fmt in columns) + " status"
+    print(header)
+    print("-" * len(header))
+    for info in results:
+        values = dict(info, **info.get("categories", {}))
+        if "map" in values:
+            values["map"] = values["map"].split("/")[-1]
+        print(" ".join(fmt % values.get(name, "-") for name, fmt in columns) + " " + info["status"])
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def generation_parameters(args):
+    wall_height = args.wall_height
+    if wall_height is None:
+        wall_height = 0.0 if args.osm_path is not None else 1.0
+    return {
+        "vertex_distance": args.vertex_distance,
+        "max_road_length": args.max_road_length,
+        "wall_height": wall_height,
+        "additional_width": args.additional_width,
+        "smooth_junctions": not args.no_smooth_junctions,
+        "enable_mesh_visibility": not args.no_mesh_visibility,
+    }
+
+
+def load_opendrive(args, log=print):
+    """Return the OpenDRIVE of --xodr-path or --osm-path, OSM conversions are cached by the hash of the OSM file."""
+    path = args.xodr_path if args.xodr_path is not None else args.osm_path
+    if args.xodr_path is not None:
+        with open(path, encoding="utf-8") as od_file:
+            return od_file.read()
+    start = time.time()
+    cached = cache_path("opendrive", "osm-%s.xodr" % file_digest(path))
+    if os.path.exists(cached):
+        with open(cached, encoding="utf-8") as od_file:
+            xodr_data = od_file.read()
+        log("load cached opendrive conversion in %.2f seconds." % (time.time() - start))
+        return xodr_data
+    with open(path, encoding="utf-8") as od_file:
+        data = od_file.read()
+    log("Converting OSM data to opendrive")
+    xodr_data = carla.Osm2Odr.convert(data)
+    with open(cached + ".tmp", "w", encoding="utf-8") as out:
+        out.write(xodr_data)
+    os.replace(cached + ".tmp", cached)
+    log("converted OSM data in %.2f seconds." % (time.time() - start))
+    return xodr_data
+
+
+def generate_world(args, client, xodr_data, address, log=print):
+    """Generate a world from `xodr_data`, unless the server already runs it with the same generation parameters."""
+    parameters = generation_parameters(args)
+    key = hashlib.sha1((xodr_data + json.dumps(parameters, sort_keys=True)).encode("utf-8")).hexdigest()
+    stamp = cache_path("worlds", "%s.json" % address)
+    start = time.time()
+    if not args.regenerate and os.path.exists(stamp):
+        with open(stamp, encoding="utf-8") as cached:
+            loaded_key = json.load(cached).get("key")
+        world = client.get_world()
+        if loaded_key == key and world.get_map().to_opendrive() == xodr_data:
+            log("opendrive map already loaded, checked in %.2f seconds." % (time.time() - start))
+            return world
+    name = os.path.basename(args.xodr_path if args.xodr_path is not None else args.osm_path)
+    log("load opendrive map %r." % name)
+    world = client.generate_opendrive_world(xodr_data, carla.OpendriveGenerationParameters(**parameters))
+    with open(stamp, "w", encoding="utf-8") as out:
+        json.dump({"key": key, "map": name}, out)
+    log("generated opendrive world in %.2f seconds." % (time.time() - start))
+    return world
+
+
+def configure(args, client, log=print, address=None):
+    """Apply the map, weather, settings and profile options, report every step through `log`."""
+    if args.map is not None:
+        log("load map %r." % args.map)
+        world = client.load_world(args.map)
+    elif args.reload_map:
+        log("reload map.")
+        world = client.reload_world()
+    elif args.opendrive is not None:
+        world = generate_world(args, client, args.opendrive, address or "%s_%d" % (args.host, args.port), log)
+    else:
+        world = client.get_world()
+
+    settings = world.get_settings()
+
+    if args.no_rendering:
+        log("disable rendering.")
+        settings.no_rendering_mode = True
+    elif args.rendering:
+        log("enable rendering.")
+        settings.no_rendering_mode = False
+
+    if args.no_sync:
+        log("disable synchronous mode.")
+        settings.synchronous_mode = False
+
+    if args.delta_seconds is not None:
+        settings.fixed_delta_seconds = args.delta_seconds
+    elif args.fps is not None:
+        settings.fixed_delta_seconds = (1.0 / args.fps) if args.fps > 0.0 else 0.0
+
+    if args.delta_seconds is not None or args.fps is not None:
+        if settings.fixed_delta_seconds > 0.0:
+            log(
+                "set fixed frame rate %.2f milliseconds (%d FPS)"
+                % (1000.0 * settings.fixed_delta_seconds, 1.0 / settings.fixed_delta_seconds)
+            )
+        else:
+            log("set variable frame rate.")
+            settings.fixed_delta_seconds = None
+
+    world.apply_settings(settings)
+
+    if args.weather is not None:
+        if not hasattr(carla.WeatherParameters, args.weather):
+            log("ERROR: weather preset %r not found." % args.weather)
+        else:
+            log("set weather preset %r." % args.weather)
+            world.set_weather(getattr(carla.WeatherParameters, args.weather))
+
+    if args.profile is not None:
+        profile = apply_profile(world, args.profile)
+        log(
+            "apply profile %r: %d map layers unloaded, rendering %s, %s frame rate."
+            % (
+                args.profile,
+                len(profile["unload"]),
+                "disabled" if profile["no_rendering"] else "enabled",
+                "unchanged" if profile["delta"] is None else "%.2f ms" % (1000.0 * profile["delta"]),
+            )
+        )
+        fps, real_time_factor = measure_server_fps(world, args.profile_seconds)
+        log("server FPS: %.1f (%.2fx real time)" % (fps, real_time_factor))
+    return world
+
+
 def main():
     argparser = argparse.ArgumentParser(description=__doc__)
     argparser.add_argument(
@@ -136,7 +481,30 @@ def main():
     argparser.add_argument("--no-rendering", action="store_true", help="disable rendering")
     argparser.add_argument("--no-sync", action="store_true", help="disable synchronous mode")
     argparser.add_argument("--weather", help="set weather preset, use --list to see available presets")
+    argparser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        help="apply a performance profile of map layers, rendering and fixed delta, then measure the server FPS",
+    )
+    argparser.add_argument(
+        "--profile-seconds",
+        metavar="S",
+        default=3.0,
+        type=float,
+        help="seconds of world ticks measured after applying --profile (default: 3.0)",
+    )
     argparser.add_argument("-i", "--inspect", action="store_true", help="inspect simulation")
+    argparser.add_argument(
+        "-w",
+        "--watch",
+        nargs="?",
+        const="table",
+        choices=["table", "ndjson"],
+        help="keep inspecting the simulation as a refreshed table or an NDJSON stream until interrupted",
+    )
+    argparser.add_argument(
+        "--interval", metavar="S", default=1.0, type=float, help="refresh interval of --watch (default: 1.0)"
+    )
     argparser.add_argument("-l", "--list", action="store_true", help="list available options")
     argparser.add_argument(
         "-b",
@@ -155,121 +523,89 @@ def main():
         metavar="OSM_FILE_PATH",
         help="load a new map with a minimum physical road representation of the provided OpenStreetMaps",
     )
+    argparser.add_argument(
+        "--vertex-distance",
+        metavar="M",
+        default=2.0,
+        type=float,
+        help="opendrive generation: distance between mesh vertices in meters (default: 2.0)",
+    )
+    argparser.add_argument(
+        "--max-road-length",
+        metavar="M",
+        default=500.0,
+        type=float,
+        help="opendrive generation: maximum length of a road mesh piece in meters (default: 500.0)",
+    )
+    argparser.add_argument(
+        "--wall-height",
+        metavar="M",
+        default=None,
+        type=float,
+        help="opendrive generation: height of the road side walls in meters (default: 1.0, 0.0 for OSM)",
+    )
+    argparser.add_argument(
+        "--additional-width",
+        metavar="M",
+        default=0.6,
+        type=float,
+        help="opendrive generation: extra width of the junction lanes in meters (default: 0.6)",
+    )
+    argparser.add_argument(
+        "--no-smooth-junctions", action="store_true", help="opendrive generation: do not smooth the junctions"
+    )
+    argparser.add_argument(
+        "--no-mesh-visibility", action="store_true", help="opendrive generation: make the road mesh invisible"
+    )
+    argparser.add_argument(
+        "--regenerate",
+        action="store_true",
+        help="generate the opendrive world even if the server already runs it with the same parameters",
+    )
+    argparser.add_argument(
+        "--hosts",
+        metavar="H[:P],...",
+        help="fleet mode: apply the options to every host concurrently and print one table of inspect results",
+    )
+    argparser.add_argument("--json", action="store_true", help="print the fleet mode results as JSON")
+    argparser.add_argument(
+        "--timeout", metavar="S", default=10.0, type=float, help="timeout of each server call (default: 10.0)"
+    )
+    argparser.add_argument(
+        "--host-timeout",
+        metavar="S",
+        default=120.0,
+        type=float,
+        help="fleet mode: time given to every host to apply the options and report (default: 120.0)",
+    )
     if len(sys.argv) < 2:
         argparser.print_help()
         return
 
     args = argparser.parse_args()
 
-    client = carla.Client(args.host, args.port, worker_threads=1)
-    client.set_timeout(10.0)
-
     if args.default:
         args.rendering = True
         args.delta_seconds = 0.0
         args.weather = "Default"
         args.no_sync = True
 
-    if args.map is not None:
-        print("load map %r." % args.map)
-        world = client.load_world(args.map)
-    elif args.reload_map:
-        print("reload map.")
-        world = client.reload_world()
-    elif args.xodr_path is not None:
-        if os.path.exists(args.xodr_path):
-            with open(args.xodr_path, encoding="utf-8") as od_file:
-                try:
-                    data = od_file.read()
-                except OSError:
-                    print("file could not be readed.")
-                    sys.exit()
-            print("load opendrive map %r." % os.path.basename(args.xodr_path))
-            vertex_distance = 2.0  # in meters
-            max_road_length = 500.0  # in meters
-            wall_height = 1.0  # in meters
-            extra_width = 0.6  # in meters
-            world = client.generate_opendrive_world(
-                data,
-                carla.OpendriveGenerationParameters(
-                    vertex_distance=vertex_distance,
-                    max_road_length=max_road_length,
-                    wall_height=wall_height,
-                    additional_width=extra_width,
-                    smooth_junctions=True,
-                    enable_mesh_visibility=True,
-                ),
-            )
-        else:
-            print("file not found.")
-    elif args.osm_path is not None:
-        if os.path.exists(args.osm_path):
-            with open(args.osm_path) as od_file:
-                try:
-                    data = od_file.read()
-                except OSError:
-                    print("file could not be readed.")
-                    sys.exit()
-            print("Converting OSM data to opendrive")
-            xodr_data = carla.Osm2Odr.convert(data)
-            print("load opendrive map.")
-            vertex_distance = 2.0  # in meters
-            max_road_length = 500.0  # in meters
-            wall_height = 0.0  # in meters
-            extra_width = 0.6  # in meters
-            world = client.generate_opendrive_world(
-                xodr_data,
-                carla.OpendriveGenerationParameters(
-                    vertex_distance=vertex_distance,
-                    max_road_length=max_road_length,
-                    wall_height=wall_height,
-                    additional_width=extra_width,
-                    smooth_junctions=True,
-                    enable_mesh_visibility=True,
-                ),
-            )
-        else:
-            print("file not found.")
+    # Read or convert the OpenDRIVE once, also in fleet mode.
+    args.opendrive = None
+    if args.map is None and not args.reload_map and (args.xodr_path is not None or args.osm_path is not None):
+        path = args.xodr_path if args.xodr_path is not None else args.osm_path
+        if not os.path.exists(path):
+            argparser.error("file not found: %s" % path)
+        args.opendrive = load_opendrive(args)
 
-    else:
-        world = client.get_world()
-
-    settings = world.get_settings()
-
-    if args.no_rendering:
-        print("disable rendering.")
-        settings.no_rendering_mode = True
-    elif args.rendering:
-        print("enable rendering.")
-        settings.no_rendering_mode = False
-
-    if args.no_sync:
-        print("disable synchronous mode.")
-        settings.synchronous_mode = False
-
-    if args.delta_seconds is not None:
-        settings.fixed_delta_seconds = args.delta_seconds
-    elif args.fps is not None:
-        settings.fixed_delta_seconds = (1.0 / args.fps) if args.fps > 0.0 else 0.0
-
-    if args.delta_seconds is not None or args.fps is not None:
-        if settings.fixed_delta_seconds > 0.0:
-            print(
-                "set fixed frame rate %.2f milliseconds (%d FPS)"
-                % (1000.0 * settings.fixed_delta_seconds, 1.0 / settings.fixed_delta_seconds)
-            )
-        else:
-            print("set variable frame rate.")
-            settings.fixed_delta_seconds = None
+    if args.hosts:
+        fleet(args)
+        return
 
-    world.apply_settings(settings)
+    client = carla.Client(args.host, args.port, worker_threads=1)
+    client.set_timeout(args.timeout)
 
-    if args.weather is not None:
-        if not hasattr(carla.WeatherParameters, args.weather):
-            print("ERROR: weather preset %r not found." % args.weather)
-        else:
-            print("set weather preset %r." % args.weather)
-            world.set_weather(getattr(carla.WeatherParameters, args.weather))
+    world = configure(args, client)
 
     if args.inspect:
         inspect(args, client)
@@ -277,6 +613,8 @@ def main():
         list_options(client)
     if args.list_blueprints:
         list_blueprints(world, args.list_blueprints)
+    if args.watch:
+        watch(args, client)
 
     # world.unload_map_layer(carla.MapLayer.All)
 
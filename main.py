@@ -13,6 +13,7 @@ import argparse
 import logging
 
 from src.agent import Agent
+from src.profiles import PROFILES
 
 
 def main():
@@ -33,9 +34,138 @@ def main():
     )
     argparser.add_argument("--rolename", metavar="NAME", default="hero", help='actor role name (default: "hero")')
     argparser.add_argument("--gamma", default=2.2, type=float, help="Gamma correction of the camera (default: 2.2)")
+    argparser.add_argument(
+        "--tire-friction",
+        metavar="F",
+        default=None,
+        type=float,
+        help="tire friction of every wheel of the player, e.g. 0.5 for ice (default: vehicle setting)",
+    )
+    argparser.add_argument(
+        "--wheel-damping",
+        metavar="D",
+        default=None,
+        type=float,
+        help="damping rate of every wheel of the player (default: vehicle setting)",
+    )
+    argparser.add_argument(
+        "--profile",
+        choices=sorted(PROFILES),
+        default=None,
+        help="apply a server performance profile of map layers and render settings and report the server FPS",
+    )
+    argparser.add_argument(
+        "--profile-seconds",
+        metavar="S",
+        default=3.0,
+        type=float,
+        help="seconds of world ticks measured after applying --profile (default: 3.0)",
+    )
+    argparser.add_argument(
+        "--render-scale",
+        metavar="F",
+        default=1.0,
+        type=float,
+        help="render the camera at F times the window resolution and scale it up (default: 1.0)",
+    )
+    argparser.add_argument(
+        "--dirty-rects", action="store_true", help="present only the changed regions of the window instead of flipping"
+    )
+    argparser.add_argument(
+        "--camera-pool",
+        metavar="N",
+        default=0,
+        type=int,
+        help="keep up to N cameras spawned for instant switching, least recently used evicted (default: 0, off)",
+    )
+    argparser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="lower the camera, radar and LiDAR rate and resolution when the client or server falls behind",
+    )
+    argparser.add_argument(
+        "--target-fps",
+        metavar="F",
+        default=30.0,
+        type=float,
+        help="client and server FPS kept by --adaptive (default: 30)",
+    )
+    argparser.add_argument(
+        "--min-render-scale",
+        metavar="F",
+        default=0.5,
+        type=float,
+        help="lowest camera render scale used by --adaptive (default: 0.5)",
+    )
+    argparser.add_argument(
+        "--max-sensor-tick",
+        metavar="S",
+        default=0.2,
+        type=float,
+        help="longest display sensor tick in seconds used by --adaptive (default: 0.2)",
+    )
+    argparser.add_argument(
+        "--waypoint-spacing",
+        metavar="M",
+        default=2.0,
+        type=float,
+        help="spacing of the cached map waypoint index in metres (default: 2.0)",
+    )
+    argparser.add_argument(
+        "--recording",
+        metavar="NAME",
+        default="manual_recording.rec",
+        help="recorder file written by CTRL+R and replayed by CTRL+P (default: manual_recording.rec)",
+    )
+    argparser.add_argument(
+        "--telemetry", metavar="PATH", default=None, help="append latency telemetry as NDJSON to PATH (default: off)"
+    )
+    argparser.add_argument(
+        "--input",
+        choices=["keyboard", "wheel", "joystick"],
+        default="keyboard",
+        help="vehicle control device, wheel pedals rest at +1 and gamepad triggers at -1 (default: keyboard)",
+    )
+    argparser.add_argument(
+        "--joystick", metavar="N", default=0, type=int, help="index of the wheel or joystick device (default: 0)"
+    )
+    argparser.add_argument(
+        "--plot-seconds", metavar="S", default=10.0, type=float, help="time span of the F2 plots (default: 10)"
+    )
+    argparser.add_argument(
+        "--plot-fps", metavar="N", default=15.0, type=float, help="maximum redraw rate of the F2 plots (default: 15)"
+    )
+    argparser.add_argument(
+        "--traffic", metavar="N", default=0, type=int, help="spawn N autopilot vehicles (default: 0)"
+    )
+    argparser.add_argument("--walkers", metavar="N", default=0, type=int, help="spawn N AI walkers (default: 0)")
+    argparser.add_argument(
+        "--traffic-ramp",
+        metavar="LIST",
+        default=None,
+        help="step through comma separated actor counts and log client frame time and server FPS at each",
+    )
+    argparser.add_argument(
+        "--traffic-ramp-seconds", metavar="S", default=10.0, type=float, help="seconds per ramp step (default: 10)"
+    )
+    argparser.add_argument(
+        "--walker-share",
+        metavar="F",
+        default=0.3,
+        type=float,
+        help="share of walkers in the ramp actor counts (default: 0.3)",
+    )
+    argparser.add_argument(
+        "--tm-port", metavar="P", default=8000, type=int, help="traffic manager port (default: 8000)"
+    )
+    argparser.add_argument(
+        "--seed", metavar="S", default=None, type=int, help="random seed of the traffic (default: none)"
+    )
     args = argparser.parse_args()
 
     args.width, args.height = [int(x) for x in args.res.split("x")]
+    if args.traffic_ramp:
+        args.traffic_ramp = [int(x) for x in args.traffic_ramp.split(",")]
 
     log_level = logging.DEBUG if args.debug else logging.INFO
     logging.basicConfig(format="%(levelname)s: %(message)s", level=log_level)
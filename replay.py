@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""
+Replay a CARLA recording headless and faster than real time, extracting sensor data into columnar files.
+
+The server runs in synchronous mode with rendering disabled unless a camera is requested, only the requested
+sensors are attached to the replayed hero vehicle. Every table is written as one raw file per column next to a
+schema.json, see src/columnar.py.
+"""
+
+import glob
+import os
+import sys
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import argparse
+import logging
+import time
+
+import carla
+import numpy as np
+
+from src.columnar import ColumnarWriter
+from src.recording import RecordingIndex
+
+SENSORS = ("imu", "gnss", "collision", "lane_invasion", "radar", "lidar", "camera")
+
+
+def _header(data):
+    return {"frame": data.frame, "timestamp": data.timestamp}
+
+
+def attach_sensors(world, hero, names, writer, delta, camera_size):
+    """Spawn the requested sensors on `hero`, each streaming into its own table."""
+    library = world.get_blueprint_library()
+    sensors = []
+
+    def spawn(blueprint, transform, table, columns, callback):
+        writer.table(table, [("frame", "i8"), ("timestamp", "f8")] + columns)
+        sensor = world.spawn_actor(blueprint, transform, attach_to=hero)
+        sensor.listen(callback)
+        sensors.append(sensor)
+
+    if "imu" in names:
+        spawn(
+            library.find("sensor.other.imu"),
+            carla.Transform(),
+            "imu",
+            [("accelerometer", "f4", (3,)), ("gyroscope", "f4", (3,)), ("compass", "f4")],
+            lambda data: writer.append(
+                "imu",
+                accelerometer=(data.accelerometer.x, data.accelerometer.y, data.accelerometer.z),
+                gyroscope=(data.gyroscope.x, data.gyroscope.y, data.gyroscope.z),
+                compass=data.compass,
+                **_header(data)
+            ),
+        )
+    if "gnss" in names:
+        spawn(
+            library.find("sensor.other.gnss"),
+            carla.Transform(carla.Location(x=1.0, z=2.8)),
+            "gnss",
+            [("latitude", "f8"), ("longitude", "f8"), ("altitude", "f8")],
+            lambda data: writer.append(
+                "gnss", latitude=data.latitude, longitude=data.longitude, altitude=data.altitude, **_header(data)
+            ),
+        )
+    if "collision" in names:
+        spawn(
+            library.find("sensor.other.collision"),
+            carla.Transform(),
+            "collision",
+            [("other_id", "i8"), ("impulse", "f4", (3,))],
+            lambda data: writer.append(
+                "collision",
+                other_id=data.other_actor.id,
+                impulse=(data.normal_impulse.x, data.normal_impulse.y, data.normal_impulse.z),
+                **_header(data)
+            ),
+        )
+    if "lane_invasion" in names:
+        spawn(
+            library.find("sensor.other.lane_invasion"),
+            carla.Transform(),
+            "lane_invasion",
+            [("markings", "i4")],
+            lambda data: writer.append("lane_invasion", markings=len(data.crossed_lane_markings), **_header(data)),
+        )
+
+    def point_table(name, width):
+        # One row per point, the frame column relates the points to their sweep.
+        def callback(data):
+            points = np.frombuffer(data.raw_data, dtype=np.dtype("f4")).reshape(-1, width)
+            writer.append(name, rows=len(points), frame=data.frame, timestamp=data.timestamp, point=points)
+
+        return callback
+
+    if "radar" in names:
+        bp = library.find("sensor.other.radar")
+        bp.set_attribute("horizontal_fov", str(35))
+        bp.set_attribute("vertical_fov", str(20))
+        transform = carla.Transform(carla.Location(x=2.8, z=1.0), carla.Rotation(pitch=5))
+        # [velocity, altitude, azimuth, depth] per detection.
+        spawn(bp, transform, "radar", [("point", "f4", (4,))], point_table("radar", 4))
+    if "lidar" in names:
+        bp = library.find("sensor.lidar.ray_cast")
+        bp.set_attribute("range", "50")
+        bp.set_attribute("channels", "32")
+        bp.set_attribute("points_per_second", str(32 * 18000))
+        # One full sweep per simulation step.
+        bp.set_attribute("rotation_frequency", str(1.0 / delta))
+        spawn(bp, carla.Transform(carla.Location(z=2.4)), "lidar", [("point", "f4", (4,))], point_table("lidar", 4))
+    if "camera" in names:
+        bp = library.find("sensor.camera.rgb")
+        bp.set_attribute("image_size_x", str(camera_size[0]))
+        bp.set_attribute("image_size_y", str(camera_size[1]))
+        spawn(
+            bp,
+            carla.Transform(carla.Location(x=1.6, z=1.7)),
+            "camera",
+            [("bgra", "u1", (camera_size[1], camera_size[0], 4))],
+            lambda data: writer.append("camera", bgra=np.frombuffer(data.raw_data, dtype=np.uint8), **_header(data)),
+        )
+    return sensors
+
+
+def find_hero(world, role_name):
+    vehicles = world.get_actors().filter("vehicle.*")
+    for vehicle in vehicles:
+        if vehicle.attributes.get("role_name") == role_name:
+            return vehicle
+    return vehicles[0] if len(vehicles) else None
+
+
+def replay(args, client):
+    index = RecordingIndex.load_or_build(client, args.recording)
+    duration = args.duration if args.duration > 0.0 else max(0.0, index.duration - args.start)
+    world = client.get_world()
+    original_settings = world.get_settings()
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = args.delta
+    settings.no_rendering_mode = "camera" not in args.sensors
+    world.apply_settings(settings)
+
+    writer = ColumnarWriter(args.output)
+    writer.table("pose", [("frame", "i8"), ("timestamp", "f8"), ("location", "f4", (3,)), ("yaw", "f4")])
+    sensors = []
+    try:
+        client.set_replayer_time_factor(args.time_factor)
+        logging.info(client.replay_file(args.recording, args.start, duration, 0))
+        world.tick()
+        hero = find_hero(world, args.rolename)
+        if hero is None:
+            logging.error("no vehicle in %s", args.recording)
+            return
+        sensors = attach_sensors(world, hero, args.sensors, writer, args.delta, args.camera_size)
+
+        steps = int(np.ceil(duration / (args.delta * args.time_factor)))
+        start = time.time()
+        for _ in range(steps):
+            world.tick()
+            snapshot = world.get_snapshot()
+            hero_snapshot = snapshot.find(hero.id)
+            if hero_snapshot is None:
+                break
+            transform = hero_snapshot.get_transform()
+            writer.append(
+                "pose",
+                frame=snapshot.frame,
+                timestamp=snapshot.timestamp.elapsed_seconds,
+                location=(transform.location.x, transform.location.y, transform.location.z),
+                yaw=transform.rotation.yaw,
+            )
+        wall = time.time() - start
+        replayed = min(duration, steps * args.delta * args.time_factor)
+        print(
+            "replayed %.1f s of %s in %.1f s: %.1fx real time, %d steps"
+            % (replayed, args.recording, wall, replayed / max(wall, 1e-9), steps)
+        )
+    finally:
+        for sensor in sensors:
+            sensor.stop()
+            sensor.destroy()
+        client.stop_replayer(False)
+        world.apply_settings(original_settings)
+        writer.close()
+    for name in ["pose"] + [name for name in SENSORS if name in args.sensors]:
+        print("  %-14s% 10d rows" % (name, writer.rows(name)))
+    print("written to %s" % os.path.abspath(args.output))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "--host", metavar="H", default="127.0.0.1", help="IP of the host server (default: 127.0.0.1)"
+    )
+    argparser.add_argument(
+        "-p", "--port", metavar="P", default=2000, type=int, help="TCP port to listen to (default: 2000)"
+    )
+    argparser.add_argument(
+        "-f", "--recording", metavar="NAME", default="manual_recording.rec", help="recorder file to replay"
+    )
+    argparser.add_argument(
+        "-o", "--output", metavar="DIR", default="_out/replay", help="output directory (default: _out/replay)"
+    )
+    argparser.add_argument(
+        "-s",
+        "--sensors",
+        metavar="LIST",
+        default="imu,gnss,collision",
+        help="comma separated sensors to attach, among %s (default: imu,gnss,collision)" % ",".join(SENSORS),
+    )
+    argparser.add_argument("--start", metavar="S", default=0.0, type=float, help="start time in seconds (default: 0)")
+    argparser.add_argument(
+        "--duration", metavar="S", default=0.0, type=float, help="seconds to replay, 0 for all (default: 0)"
+    )
+    argparser.add_argument(
+        "-x", "--time-factor", metavar="X", default=4.0, type=float, help="replayer time factor (default: 4.0)"
+    )
+    argparser.add_argument(
+        "--delta", metavar="S", default=0.05, type=float, help="fixed delta seconds per step (default: 0.05)"
+    )
+    argparser.add_argument(
+        "--camera-res", metavar="WIDTHxHEIGHT", default="800x600", help="camera resolution (default: 800x600)"
+    )
+    argparser.add_argument("--rolename", metavar="NAME", default="hero", help='hero role name (default: "hero")')
+    args = argparser.parse_args()
+    args.sensors = [name.strip() for name in args.sensors.split(",") if name.strip()]
+    unknown = set(args.sensors).difference(SENSORS)
+    if unknown:
+        argparser.error("unknown sensors: %s" % ", ".join(sorted(unknown)))
+    args.camera_size = [int(x) for x in args.camera_res.split("x")]
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    replay(args, client)
+
+
+if __name__ == "__main__":
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nCancelled by user. Bye!")
@@ -0,0 +1,147 @@
+"""Spatial index of the vehicles and walkers around the player."""
+
+import threading
+import time
+
+import numpy as np
+
+from src.spatial import GridIndex
+from src.utils import get_actor_categories
+
+
+class ActorIndex:
+    """Vehicle and walker positions, updated incrementally from every world snapshot.
+
+    The tick callback only reads the snapshot, new actor ids are categorized by `refresh` on the main thread in
+    one request and ids the server did not return yet are retried. The id and category arrays are rebuilt only
+    when the tracked actors change, the grid on the first query of a new frame. Register `on_world_snapshot` with
+    `world.on_tick` and call `refresh` once per client frame.
+    """
+
+    CATEGORIES = ("vehicle", "walker")
+
+    def __init__(self, carla_world, cell_size=10.0, retry_interval=0.5):
+        self._world = carla_world
+        self._cell_size = cell_size
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        # Category index per categorized id, -1 for the categories that are not tracked.
+        self._categories = {}
+        self._pending = set()
+        self._requested = set()
+        self._last_request = 0.0
+        self._members_changed = False
+        self._rows = {}
+        self.ego_id = None
+        self.frame = 0
+        empty = np.empty((0, 2))
+        # Replaced as a whole so that readers on the main thread always see a consistent set of arrays.
+        self._arrays = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8), empty, empty)
+        self._grid = (self._arrays, GridIndex(empty, cell_size))
+
+    @property
+    def ids(self):
+        return self._arrays[0]
+
+    @property
+    def category(self):
+        return self._arrays[1]
+
+    @property
+    def xy(self):
+        return self._arrays[2]
+
+    @property
+    def velocity(self):
+        return self._arrays[3]
+
+    def refresh(self):
+        """Categorize the new actor ids, retrying the ones the server did not know yet every `retry_interval`."""
+        now = time.time()
+        with self._lock:
+            pending = set(self._pending)
+            retry = now - self._last_request >= self._retry_interval
+            if not pending or (not retry and pending <= self._requested):
+                return
+            self._requested.update(pending)
+        self._last_request = now
+        categories = get_actor_categories(self._world, pending)
+        with self._lock:
+            for actor_id, category in categories.items():
+                if category is None or actor_id not in self._pending:
+                    continue
+                self._pending.discard(actor_id)
+                self._requested.discard(actor_id)
+                index = self.CATEGORIES.index(category) if category in self.CATEGORIES else -1
+                self._categories[actor_id] = index
+                self._members_changed = self._members_changed or index >= 0
+
+    def on_world_snapshot(self, snapshot):
+        actors = list(snapshot)
+        with self._lock:
+            present = set(actor.id for actor in actors)
+            for actor_id in [actor_id for actor_id in self._categories if actor_id not in present]:
+                if self._categories.pop(actor_id) >= 0:
+                    self._members_changed = True
+            self._pending.intersection_update(present)
+            self._requested.intersection_update(present)
+            self._pending.update(present.difference(self._categories))
+            ids, category = self._arrays[:2]
+            if self._members_changed:
+                tracked = [actor_id for actor_id, index in self._categories.items() if index >= 0]
+                ids = np.array(tracked, dtype=np.int64)
+                category = np.array([self._categories[actor_id] for actor_id in tracked], dtype=np.int8)
+                self._rows = {actor_id: row for row, actor_id in enumerate(tracked)}
+                self._members_changed = False
+            rows = self._rows
+            xy = np.empty((len(rows), 2))
+            velocity = np.empty((len(rows), 2))
+            for actor in actors:
+                row = rows.get(actor.id)
+                if row is not None:
+                    location, speed = actor.get_transform().location, actor.get_velocity()
+                    xy[row] = location.x, location.y
+                    velocity[row] = speed.x, speed.y
+            self._arrays = (ids, category, xy, velocity)
+            self.frame = snapshot.frame
+
+    def _query_state(self):
+        arrays = self._arrays
+        grid = self._grid
+        if grid[0] is not arrays:
+            grid = self._grid = (arrays, GridIndex(arrays[2], self._cell_size))
+        return grid[1], arrays[0], arrays[1]
+
+    def count(self, category):
+        return int(np.count_nonzero(self.category == self.CATEGORIES.index(category)))
+
+    def _select(self, indices, category, ids, categories):
+        if category is not None:
+            indices = indices[categories[indices] == self.CATEGORIES.index(category)]
+        if self.ego_id is not None:
+            indices = indices[ids[indices] != self.ego_id]
+        return indices
+
+    def within(self, x, y, radius, category=None):
+        """Return the indices (into ids/xy/velocity) of the actors within `radius` metres of (x, y)."""
+        grid, ids, categories = self._query_state()
+        return self._select(grid.query_radius(x, y, radius), category, ids, categories)
+
+    def corridor(self, path, half_width, category=None):
+        """Return the indices of the actors within `half_width` metres of the polyline `path` of shape (T, 2)."""
+        grid, ids, categories = self._query_state()
+        path = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+        if len(path) < 2:
+            return self._select(grid.query_radius(path[0, 0], path[0, 1], half_width), category, ids, categories)
+        # The cells around every segment give the candidates, the exact point to segment distance filters them.
+        low = np.minimum(path[:-1], path[1:]) - half_width
+        high = np.maximum(path[:-1], path[1:]) + half_width
+        indices = np.unique(np.concatenate([grid.query_box(*box) for box in np.hstack((low, high))]))
+        if len(indices):
+            start, segment = path[:-1], np.diff(path, axis=0)
+            delta = grid.points[indices][:, None, :] - start[None, :, :]
+            norm = np.maximum(np.einsum("jk,jk->j", segment, segment), 1e-12)
+            t = np.clip(np.einsum("ijk,jk->ij", delta, segment) / norm, 0.0, 1.0)
+            offset = delta - t[:, :, None] * segment[None, :, :]
+            indices = indices[np.min(np.einsum("ijk,ijk->ij", offset, offset), axis=1) <= half_width * half_width]
+        return self._select(indices, category, ids, categories)
@@ -0,0 +1,168 @@
+"""Adaptive display sensor quality under client or server load."""
+
+import logging
+import time
+
+# Samples of these sensors are dropped when the client falls behind, IMU and GNSS are never degraded.
+DISPLAY_SENSORS = ("Camera", "Radar", "LiDAR")
+
+
+def presented_sensors(world):
+    """Display sensors whose samples the current view consumes, the others pile up unread by design."""
+    if world.camera_manager.lidar is not None:
+        names = ["LiDAR"]
+    else:
+        names = ["Camera"]
+    if world.radar_sensor is not None:
+        names.append("Radar")
+    return names
+
+
+class AdaptiveQuality:
+    """Lowers the rate and resolution of the display sensors when the client cannot keep up, restores them after.
+
+    Every `interval` seconds the client FPS, the server FPS from `HUD.on_world_tick` and the display samples the
+    client skipped are checked. The client consumes at most one sample per sensor and frame, so the samples of a
+    sensor faster than the `max_client_fps` frame rate limit are overwritten by design, only the drops beyond that
+    budget count. One overloaded
+    window degrades one level. Going back up needs `recover_windows` healthy windows with `margin` headroom, doubled
+    for every time the level above has already been overloaded, so the quality does not cycle. A slow server only
+    counts as overload while degrading the sensors actually raises its FPS. Level `steps` runs the display sensors
+    every `max_sensor_tick` seconds and the camera at `min_render_scale`.
+    """
+
+    def __init__(
+        self,
+        world,
+        target_fps=30.0,
+        min_render_scale=0.5,
+        max_sensor_tick=0.2,
+        steps=4,
+        interval=2.0,
+        max_drop_rate=5.0,
+        recover_windows=3,
+        margin=1.2,
+        max_backoff=5,
+        max_client_fps=60.0,
+    ):
+        self.world = world
+        self.target_fps = target_fps
+        self.interval = interval
+        self.max_drop_rate = max_drop_rate
+        self.recover_windows = recover_windows
+        self.margin = margin
+        self.max_backoff = max_backoff
+        self.max_client_fps = max_client_fps
+        base_scale = world.render_scale
+        min_render_scale = min(min_render_scale, base_scale)
+        # (render scale, camera tick, radar tick, lidar tick) per level, the radar and LiDAR degrade a step ahead
+        # of the camera since they are only drawn on request.
+        self.levels = []
+        for step in range(steps + 1):
+            camera = step / float(steps)
+            others = min(1.0, (step + 1) / float(steps)) if step else 0.0
+            self.levels.append(
+                (
+                    round(base_scale - (base_scale - min_render_scale) * camera, 2),
+                    round(max_sensor_tick * camera, 3),
+                    round(max_sensor_tick * others, 3),
+                    round(max_sensor_tick * others, 3),
+                )
+            )
+        self.level = 0
+        self._healthy = 0
+        self._window_start = None
+        self._counts = {}
+        # Number of windows each level was overloaded in, recovering into it waits twice as long per overload.
+        self._overloads = {}
+        # Server FPS before a step down taken for the server alone, checked against the next window.
+        self._server_probe = None
+        self._server_bound = True
+
+    def _sample_counts(self):
+        latency = self.world.hud.latency
+        return {name: (latency.arrivals([name]), latency.dropped([name])) for name in DISPLAY_SENSORS}
+
+    def _skipped(self, counts, elapsed):
+        """Drops of the sensors on screen beyond those the client frame rate limit makes unavoidable."""
+        frames = self.max_client_fps * elapsed
+        skipped = 0
+        # Only the sensors on screen count, a LiDAR without its top-down view drops every sweep.
+        for name in presented_sensors(self.world):
+            arrived, dropped = counts[name]
+            last_arrived, last_dropped = self._counts.get(name, (arrived, dropped))
+            budget = max(0.0, arrived - last_arrived - frames)
+            skipped += max(0, dropped - last_dropped - budget)
+        return skipped
+
+    def _reset_window(self):
+        self._window_start = time.time()
+        self._counts = self._sample_counts()
+
+    def tick(self, clock):
+        if self._window_start is None:
+            self._reset_window()
+            return
+        now = time.time()
+        elapsed = now - self._window_start
+        if elapsed < self.interval:
+            return
+        drop_rate = self._skipped(self._sample_counts(), elapsed) / elapsed
+        client_fps = clock.get_fps()
+        server_fps = self.world.hud.server_fps
+        self._reset_window()
+
+        if self._server_probe is not None:
+            level, probe_fps = self._server_probe
+            self._server_probe = None
+            if server_fps < probe_fps * 1.05:
+                # The server is not slowed down by the sensors, keep its FPS out of the decision until it recovers.
+                logging.info("adaptive quality: server at %.1f FPS regardless of the sensor quality", server_fps)
+                self._server_bound = False
+                self._overloads[level] -= 1
+                self._set_level(level, client_fps, server_fps, drop_rate)
+                return
+        if not self._server_bound and server_fps >= self.target_fps:
+            self._server_bound = True
+
+        client_overloaded = client_fps < self.target_fps or drop_rate > self.max_drop_rate
+        # The server FPS is 0 until the first world ticks arrive.
+        server_overloaded = self._server_bound and 0 < server_fps < self.target_fps
+        if client_overloaded or server_overloaded:
+            self._healthy = 0
+            self._overloads[self.level] = self._overloads.get(self.level, 0) + 1
+            if self.level < len(self.levels) - 1:
+                if not client_overloaded:
+                    self._server_probe = (self.level, server_fps)
+                self._set_level(self.level + 1, client_fps, server_fps, drop_rate)
+            return
+        headroom = client_fps >= self.target_fps * self.margin
+        if self._server_bound:
+            headroom = headroom and not 0 < server_fps < self.target_fps * self.margin
+        self._healthy = self._healthy + 1 if headroom and drop_rate == 0 else 0
+        if self.level == 0:
+            return
+        backoff = min(self._overloads.get(self.level - 1, 0), self.max_backoff)
+        if self._healthy >= self.recover_windows * 2 ** backoff:
+            self._healthy = 0
+            self._set_level(self.level - 1, client_fps, server_fps, drop_rate)
+
+    def _set_level(self, level, client_fps, server_fps, drop_rate):
+        render_scale, camera_tick, radar_tick, lidar_tick = self.levels[level]
+        logging.info(
+            "adaptive quality: level %d -> %d (client %.1f FPS, server %.1f FPS, %.1f drops/s): "
+            "render scale %.2f, camera tick %.3f s, radar tick %.3f s, LiDAR tick %.3f s",
+            self.level,
+            level,
+            client_fps,
+            server_fps,
+            drop_rate,
+            render_scale,
+            camera_tick,
+            radar_tick,
+            lidar_tick,
+        )
+        self.level = level
+        self.world.set_sensor_quality(render_scale, camera_tick, radar_tick, lidar_tick)
+        # Respawning stalls the client, the next window starts once it is done.
+        self._reset_window()
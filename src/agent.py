@@ -1,4 +1,6 @@
+import contextlib
 import glob
+import logging
 import os
 import sys
 
@@ -13,14 +15,22 @@ sys.path.append(
 
 import carla
 
+from src.adaptive import AdaptiveQuality
 from src.controller import KeyboardControl
+from src.inputs import create_vehicle_input
 from src.interface import HUD
+from src.profiles import apply_profile, measure_server_fps
+from src.telemetry import Telemetry
+from src.traffic import Traffic, TrafficRamp
 from src.world import World
 
 
 class Agent:
     """Player class."""
 
+    # Frame rate limit of the client loop.
+    MAX_FPS = 60
+
     def __init__(self, args):
         pygame.init()
         pygame.font.init()
@@ -28,27 +38,75 @@ class Agent:
         self.client = carla.Client(args.host, args.port)
         self.client.set_timeout(2.0)
 
-        self.display = pygame.display.set_mode((args.width, args.height), pygame.HWSURFACE | pygame.DOUBLEBUF)
-
-        self.hud = HUD(args.width, args.height)
-        self.world = World(self.client.get_world(), self.hud, args)
-
-        self.controller = KeyboardControl(self.world, args.autopilot)
+        # Partial updates need a single-buffered software surface, a flipped buffer is always presented whole.
+        self.dirty_rects = args.dirty_rects
+        flags = 0 if self.dirty_rects else pygame.HWSURFACE | pygame.DOUBLEBUF
+        self.display = pygame.display.set_mode((args.width, args.height), flags)
+
+        carla_world = self.client.get_world()
+        if args.profile is not None:
+            apply_profile(carla_world, args.profile)
+            fps, real_time_factor = measure_server_fps(carla_world, args.profile_seconds)
+            logging.info("profile %s: server at %.1f FPS, %.2fx real time", args.profile, fps, real_time_factor)
+
+        self.hud = HUD(args.width, args.height, args.plot_seconds, args.plot_fps)
+        self.world = World(carla_world, self.hud, args)
+
+        self.traffic_ramp = None
+        if args.traffic or args.walkers or args.traffic_ramp:
+            self.world.traffic = Traffic(self.client, carla_world, args.tm_port, args.seed)
+            exclude = [World.SPAWN_POINT.location, self.world.player.get_location()]
+            if args.traffic_ramp:
+                self.traffic_ramp = TrafficRamp(
+                    self.world.traffic,
+                    args.traffic_ramp,
+                    args.traffic_ramp_seconds,
+                    args.walker_share,
+                    exclude=exclude,
+                )
+            else:
+                self.world.traffic.spawn(args.traffic, args.walkers, exclude)
+
+        self.controller = KeyboardControl(self.world, args.autopilot, create_vehicle_input(args.input, args.joystick))
 
         self.clock = pygame.time.Clock()
+        self.adaptive = (
+            AdaptiveQuality(
+                self.world,
+                target_fps=args.target_fps,
+                min_render_scale=args.min_render_scale,
+                max_sensor_tick=args.max_sensor_tick,
+                max_client_fps=self.MAX_FPS,
+            )
+            if args.adaptive
+            else None
+        )
+        self.telemetry = Telemetry(args.telemetry) if args.telemetry else None
 
     def run(self):
-        while self.controller.end_control is not True:
-            self.clock.tick_busy_loop(60)
-            self.controller.parse_events(self.client, self.world, self.clock)
-            self.world.tick(self.clock)
-            self.world.render(self.display)
-            pygame.display.flip()
-
-        if self.world and self.world.recording_enabled:
-            self.client.stop_recorder()
-
-        if self.world is not None:
-            self.world.destroy()
-
-        pygame.quit()
+        try:
+            with self.telemetry or contextlib.nullcontext():
+                while self.controller.end_control is not True:
+                    self.clock.tick_busy_loop(self.MAX_FPS)
+                    self.controller.parse_events(self.client, self.world, self.clock)
+                    self.world.tick(self.clock)
+                    if self.adaptive is not None:
+                        self.adaptive.tick(self.clock)
+                    if self.traffic_ramp is not None:
+                        self.traffic_ramp.tick(self.clock, self.hud.server_fps, [self.world.player.get_location()])
+                    rects = self.world.render(self.display)
+                    if self.dirty_rects:
+                        pygame.display.update(rects)
+                    else:
+                        pygame.display.flip()
+                    self.hud.latency.presented()
+                    if self.telemetry is not None:
+                        self.telemetry.tick("latency", self.hud.latency.summary, self.hud.frame)
+        finally:
+            if self.world and self.world.recording_enabled:
+                self.world.stop_recorder(self.client)
+
+            if self.world is not None:
+                self.world.destroy()
+
+            pygame.quit()
@@ -1,6 +1,8 @@
+import collections
 import glob
 import os
 import sys
+import time
 import weakref
 
 import numpy as np
@@ -15,11 +17,17 @@ sys.path.append(
 
 import carla
 
+from src.conversion import ImageConverter
+
 
 class CameraManager:
-    def __init__(self, parent_actor, hud, gamma_correction):
+    def __init__(self, parent_actor, hud, gamma_correction, render_scale=1.0, pool_size=0, sensor_tick=0.0):
         self.sensor = None
         self.surface = None
+        self.dirty = False
+        self.lidar = None
+        self._lidar_frame = 0
+        self._lidar_surface = None
         self._parent = parent_actor
         self.hud = hud
         self.recording = False
@@ -33,54 +41,218 @@ class CameraManager:
             (carla.Transform(carla.Location(x=-1, y=-bound_y, z=0.5)), Attachment.Rigid),
         ]
         self.transform_index = 1
-        self._sensor_list = ["sensor.camera.rgb", carla.ColorConverter.Raw, "Camera RGB", {}]
+        # Color conversion happens on the client with lookup tables, see src/conversion.py.
+        self.sensors = [
+            ["sensor.camera.rgb", "raw", "Camera RGB", {}],
+            ["sensor.camera.depth", "raw", "Camera Depth (Raw)", {}],
+            ["sensor.camera.depth", "depth", "Camera Depth (Gray Scale)", {}],
+            ["sensor.camera.depth", "log_depth", "Camera Depth (Logarithmic Gray Scale)", {}],
+            ["sensor.camera.semantic_segmentation", "raw", "Camera Semantic Segmentation (Raw)", {}],
+            ["sensor.camera.semantic_segmentation", "cityscapes", "Camera Semantic Segmentation (CityScapes)", {}],
+        ]
+        self.index = None
+        # Warm standby pool of spawned cameras, (sensor type, transform index) -> [actor, last surface], in least
+        # recently used order. Only the active camera listens, switching to a pooled one needs no spawn.
+        self.pool_size = pool_size
+        self._pool = collections.OrderedDict()
+        self._active_key = None
+        self.converter = ImageConverter()
+        # Per frame color conversion cost in milliseconds.
+        self.convert_ms = collections.deque(maxlen=100)
 
         world = self._parent.get_world()
         bp_library = world.get_blueprint_library()
 
-        self.bp = bp_library.find(self._sensor_list[0])
-        self.bp.set_attribute("image_size_x", str(hud.dim[0]))
-        self.bp.set_attribute("image_size_y", str(hud.dim[1]))
-        if self.bp.has_attribute("gamma"):
-            self.bp.set_attribute("gamma", str(gamma_correction))
+        for item in self.sensors:
+            bp = bp_library.find(item[0])
+            if bp.has_attribute("gamma"):
+                bp.set_attribute("gamma", str(gamma_correction))
+            for attr_name, attr_value in item[3].items():
+                bp.set_attribute(attr_name, attr_value)
+            item.append(bp)
+        self._configure_blueprints(render_scale, sensor_tick)
+
+    def _configure_blueprints(self, render_scale, sensor_tick):
+        # The camera renders at a fraction of the window size, its frames are scaled up once on arrival.
+        self.render_scale = render_scale
+        self.sensor_tick = sensor_tick
+        for item in self.sensors:
+            item[-1].set_attribute("image_size_x", str(max(1, int(self.hud.dim[0] * render_scale))))
+            item[-1].set_attribute("image_size_y", str(max(1, int(self.hud.dim[1] * render_scale))))
+            item[-1].set_attribute("sensor_tick", str(sensor_tick))
+
+    def reconfigure(self, render_scale, sensor_tick):
+        """Respawn the cameras with a new render scale and sensor tick, both are fixed when a sensor is spawned."""
+        self._configure_blueprints(render_scale, sensor_tick)
+        if self.index is None:
+            return
+        index = self.index
+        self.destroy()
+        self.set_sensor(index, notify=False)
+        self.warm_pool()
+
+    @property
+    def depth(self):
+        """Latest depth frame in metres as a float32 array, None unless a depth mode is active."""
+        if self.index is None or self.sensors[self.index][0] != "sensor.camera.depth":
+            return None
+        return self.converter.depth
 
     def toggle_camera(self):
         self.transform_index = (self.transform_index + 1) % len(self._camera_transforms)
-        self.set_sensor()
-
-    def set_sensor(self):
-        if self.sensor is not None:
-            self.sensor.destroy()
-            self.surface = None
-        self.sensor = self._parent.get_world().spawn_actor(
-            self.bp,
-            self._camera_transforms[self.transform_index][0],
+        self.set_sensor(self.index, notify=False, force_respawn=True)
+
+    def _spawn(self, sensor_type, transform_index):
+        bp = next(item[-1] for item in self.sensors if item[0] == sensor_type)
+        return self._parent.get_world().spawn_actor(
+            bp,
+            self._camera_transforms[transform_index][0],
             attach_to=self._parent,
-            attachment_type=self._camera_transforms[self.transform_index][1],
+            attachment_type=self._camera_transforms[transform_index][1],
         )
+
+    def _listen(self):
         # We need to pass the lambda a weak reference to self to avoid
         # circular reference.
         weak_self = weakref.ref(self)
         self.sensor.listen(lambda image: CameraManager._parse_image(weak_self, image))
 
+    def set_sensor(self, index, notify=True, force_respawn=False):
+        index = index % len(self.sensors)
+        needs_respawn = (
+            True if self.index is None else (force_respawn or (self.sensors[index][0] != self.sensors[self.index][0]))
+        )
+        if needs_respawn:
+            if self.sensor is not None:
+                self.sensor.stop()
+            self.converter.clear_depth()
+        # Set before the new listener starts, its first frame converts with the mode of this index.
+        self.index = index
+        if needs_respawn and self.pool_size > 0:
+            self._switch_pooled(self.sensors[index][0])
+        elif needs_respawn:
+            if self.sensor is not None:
+                self.sensor.destroy()
+                self.surface = None
+            self.sensor = self._spawn(self.sensors[index][0], self.transform_index)
+            self._listen()
+        if notify:
+            self.hud.notification(self.sensors[index][2])
+
+    def _switch_pooled(self, sensor_type):
+        key = (sensor_type, self.transform_index)
+        if self.sensor is not None and self._active_key in self._pool:
+            self.sensor.stop()
+            self._pool[self._active_key][1] = self.surface
+        entry = self._pool.pop(key, None)
+        if entry is None:
+            entry = [self._spawn(*key), None]
+        self._pool[key] = entry
+        self._active_key = key
+        # Show the last frame of the pooled camera until its first new one arrives.
+        self.sensor, self.surface = entry
+        self.dirty = self.surface is not None
+        self._listen()
+        while len(self._pool) > self.pool_size:
+            _, (sensor, _) = self._pool.popitem(last=False)
+            sensor.destroy()
+
+    def warm_pool(self):
+        """Pre-spawn idle cameras up to the pool size, other positions of the current type first."""
+        if self.pool_size <= 0:
+            return
+        types = []
+        for item in self.sensors:
+            if item[0] not in types:
+                types.append(item[0])
+        if self.index is not None:
+            types.remove(self.sensors[self.index][0])
+            types.insert(0, self.sensors[self.index][0])
+        for sensor_type in types:
+            for transform_index in range(len(self._camera_transforms)):
+                if len(self._pool) >= self.pool_size:
+                    return
+                key = (sensor_type, transform_index)
+                if key not in self._pool:
+                    self._pool[key] = [self._spawn(*key), None]
+                    # Pre-spawned cameras are the first candidates for eviction.
+                    self._pool.move_to_end(key, last=False)
+
+    def destroy(self):
+        """Destroy the active camera and every pooled one."""
+        sensors = [entry[0] for entry in self._pool.values()]
+        if self.sensor is not None and self.sensor not in sensors:
+            sensors.append(self.sensor)
+        for sensor in sensors:
+            sensor.stop()
+            sensor.destroy()
+        self._pool.clear()
+        self._active_key = None
+        self.sensor = None
+        self.index = None
+
+    def next_sensor(self):
+        self.set_sensor(self.index + 1)
+
     def toggle_recording(self):
         self.recording = not self.recording
         self.hud.notification("Recording %s" % ("On" if self.recording else "Off"))
 
+    def toggle_lidar_view(self, lidar_sensor):
+        """Show the top-down view of `lidar_sensor` instead of the camera, or go back to the camera."""
+        if self.lidar is not None:
+            self.lidar.set_image_size(None)
+            self.lidar = None
+            self.dirty = True
+        elif lidar_sensor is not None:
+            lidar_sensor.set_image_size(self.hud.dim)
+            self.lidar = lidar_sensor
+            self._lidar_frame = 0
+        # The view that was on screen stops consuming, its last sample must not count as dropped later.
+        self.hud.latency.discard("Camera")
+        self.hud.latency.discard("LiDAR")
+        self.hud.notification("LiDAR top-down view %s" % ("On" if self.lidar is not None else "Off"))
+
+    def _render_lidar(self, display):
+        self.hud.latency.consumed("LiDAR")
+        if self.lidar.image_frame != self._lidar_frame:
+            self._lidar_frame = self.lidar.image_frame
+            self._lidar_surface = pygame.surfarray.make_surface(self.lidar.image)
+            display.blit(self._lidar_surface, (0, 0))
+            return [self._lidar_surface.get_rect()]
+        if self._lidar_frame:
+            display.blit(self._lidar_surface, (0, 0))
+        return []
+
     def render(self, display):
-        if self.surface is not None:
-            display.blit(self.surface, (0, 0))
+        """Blit the latest frame, return the dirty rectangles of the display."""
+        if self.lidar is not None and self.lidar.image is not None:
+            return self._render_lidar(display)
+        if self.surface is None:
+            return []
+        self.hud.latency.consumed("Camera")
+        display.blit(self.surface, (0, 0))
+        if not self.dirty:
+            return []
+        self.dirty = False
+        return [self.surface.get_rect()]
 
     @staticmethod
     def _parse_image(weak_self, image):
         self = weak_self()
         if not self:
             return
-        image.convert(self._sensor_list[1])
+        start = time.perf_counter()
         array = np.frombuffer(image.raw_data, dtype=np.dtype("uint8"))
         array = np.reshape(array, (image.height, image.width, 4))
-        array = array[:, :, :3]
-        array = array[:, :, ::-1]
-        self.surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+        sensor_type, mode = self.sensors[self.index][:2]
+        array = self.converter.convert(array, mode, depth=sensor_type == "sensor.camera.depth")
+        self.convert_ms.append(1e3 * (time.perf_counter() - start))
+        surface = pygame.surfarray.make_surface(array.swapaxes(0, 1))
+        if surface.get_size() != self.hud.dim:
+            surface = pygame.transform.scale(surface, self.hud.dim)
+        self.surface = surface
+        self.dirty = True
+        self.hud.latency.arrived("Camera", image.frame)
         if self.recording:
             image.save_to_disk("_out/%08d" % image.frame)
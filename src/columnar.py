@@ -0,0 +1,69 @@
+"""Streaming columnar output for bulk sensor extraction."""
+
+import contextlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class ColumnarWriter:
+    """Tables of fixed-width columns, each column streamed to its own raw little-endian file.
+
+    `schema.json` in the output directory lists every table with its row count and, per column, the file, dtype
+    and per-row shape, so a column loads with `np.fromfile(path, dtype).reshape((-1,) + shape)`.
+    """
+
+    def __init__(self, directory, buffer_size=1 << 20):
+        self.directory = directory
+        self._buffer_size = buffer_size
+        self._tables = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def table(self, name, columns):
+        """Declare table `name` with columns given as (name, dtype) or (name, dtype, shape)."""
+        specs = []
+        # The files opened so far are closed if a later column fails, they stay open until close() otherwise.
+        with contextlib.ExitStack() as files:
+            for column in columns:
+                column_name, dtype = column[0], np.dtype(column[1]).newbyteorder("<")
+                shape = tuple(column[2]) if len(column) > 2 else ()
+                path = "%s.%s.bin" % (name, column_name)
+                out = files.enter_context(open(os.path.join(self.directory, path), "wb", buffering=self._buffer_size))
+                specs.append((column_name, dtype, shape, path, out))
+            files.pop_all()
+        self._tables[name] = {"columns": specs, "rows": 0, "lock": threading.Lock()}
+
+    def append(self, name, rows=1, **values):
+        """Append `rows` rows, every column value is one entry of the column shape, repeated for every row, or an
+        array of `rows` entries."""
+        table = self._tables[name]
+        with table["lock"]:
+            for column_name, dtype, shape, _, out in table["columns"]:
+                array = np.asarray(values[column_name], dtype=dtype)
+                if rows != 1 and array.size == int(np.prod(shape)):
+                    array = np.broadcast_to(array.reshape(shape), (rows,) + shape)
+                if array.size != rows * int(np.prod(shape)):
+                    raise ValueError("column %s.%s: expected %d rows of shape %s" % (name, column_name, rows, shape))
+                out.write(array.tobytes())
+            table["rows"] += rows
+
+    def rows(self, name):
+        return self._tables[name]["rows"]
+
+    def close(self):
+        schema = {}
+        for name, table in self._tables.items():
+            with table["lock"]:
+                for _, _, _, _, out in table["columns"]:
+                    out.close()
+                schema[name] = {
+                    "rows": table["rows"],
+                    "columns": [
+                        {"name": column_name, "dtype": dtype.str, "shape": list(shape), "file": path}
+                        for column_name, dtype, shape, path, _ in table["columns"]
+                    ],
+                }
+        with open(os.path.join(self.directory, "schema.json"), "w", encoding="utf-8") as out:
+            json.dump(schema, out, indent=2)
@@ -22,6 +22,7 @@ Use ARROWS or WASD keys for control.
     ` or N       : next sensor
     [1-9]        : change to sensor [1-9]
     G            : toggle radar visualization
+    O            : toggle LiDAR (Shift+O toggles its top-down view)
     Backspace    : restart
 
     V            : Select next map layer (Shift+V reverse)
@@ -33,12 +34,14 @@ Use ARROWS or WASD keys for control.
     CTRL + P     : start replaying last recorded simulation
     CTRL + +     : increments the start time of the replay by 1 second (+SHIFT = 10 seconds)
     CTRL + -     : decrements the start time of the replay by 1 second (+SHIFT = 10 seconds)
+    CTRL + [/]   : moves the start time of the replay to the previous/next collision
 
     F1           : toggle HUD
-    H/?          : toggle help
+    F2           : toggle speed, yaw rate, acceleration and control plots
     ESC          : quit
 """
 
+import functools
 import glob
 import os
 import sys
@@ -56,11 +59,13 @@ sys.path.append(
 
 import carla
 
+from src.inputs import KeyBindings, KeyboardInput
+
 
 class KeyboardControl:
     """Class that handles keyboard input."""
 
-    def __init__(self, world, start_in_autopilot):
+    def __init__(self, world, start_in_autopilot, vehicle_input=None):
         self.end_control = False
         self._carsim_enabled = False
         self._carsim_road = False
@@ -69,7 +74,51 @@ class KeyboardControl:
         self._lights = carla.VehicleLightState.NONE
         world.player.set_autopilot(self._autopilot_enabled)
         world.player.set_light_state(self._lights)
-        self._steer_cache = 0.0
+        self._input = vehicle_input if vehicle_input is not None else KeyboardInput()
+        shift, ctrl = locals.KMOD_SHIFT, locals.KMOD_CTRL
+        sensor_keys = [
+            (key, 0, functools.partial(self._set_sensor, index))
+            for index, key in enumerate(range(locals.K_1, locals.K_9 + 1))
+        ]
+        # Every action is called with (client, world), actions that do not need one of them name it with a leading
+        # underscore.
+        self._bindings = KeyBindings(
+            [
+                (locals.K_ESCAPE, 0, self._quit),
+                (locals.K_q, ctrl, self._quit),
+                (locals.K_BACKSPACE, 0, self._restart),
+                (locals.K_F1, 0, lambda client, world: world.hud.toggle_info()),
+                (locals.K_F2, 0, lambda client, world: world.hud.toggle_plots()),
+                (locals.K_v, 0, lambda client, world: world.next_map_layer()),
+                (locals.K_v, shift, lambda client, world: world.next_map_layer(reverse=True)),
+                (locals.K_b, 0, lambda client, world: world.load_map_layer()),
+                (locals.K_b, shift, lambda client, world: world.load_map_layer(unload=True)),
+                (locals.K_TAB, 0, lambda client, world: world.camera_manager.toggle_camera()),
+                (locals.K_BACKQUOTE, 0, lambda client, world: world.camera_manager.next_sensor()),
+                (locals.K_n, 0, lambda client, world: world.camera_manager.next_sensor()),
+                (locals.K_g, 0, lambda client, world: world.toggle_radar()),
+                (locals.K_o, 0, lambda client, world: world.toggle_lidar()),
+                (locals.K_o, shift, lambda client, world: world.toggle_lidar_view()),
+                (locals.K_w, 0, functools.partial(self._shift_gear, 1)),
+                (locals.K_w, ctrl, self._toggle_constant_velocity),
+                (locals.K_s, 0, functools.partial(self._shift_gear, -1)),
+                (locals.K_r, 0, lambda client, world: world.camera_manager.toggle_recording()),
+                (locals.K_r, ctrl, self._toggle_recorder),
+                (locals.K_p, 0, self._toggle_autopilot),
+                (locals.K_p, ctrl, self._replay),
+                (locals.K_k, ctrl, self._enable_carsim),
+                (locals.K_j, ctrl, self._toggle_carsim_road),
+                (locals.K_LEFTBRACKET, ctrl, lambda client, world: world.seek_collision(client, forward=False)),
+                (locals.K_RIGHTBRACKET, ctrl, lambda client, world: world.seek_collision(client)),
+                (locals.K_MINUS, ctrl, functools.partial(self._shift_recording_start, -1)),
+                (locals.K_MINUS, ctrl | shift, functools.partial(self._shift_recording_start, -10)),
+                (locals.K_EQUALS, ctrl, functools.partial(self._shift_recording_start, 1)),
+                (locals.K_EQUALS, ctrl | shift, functools.partial(self._shift_recording_start, 10)),
+                (locals.K_q, 0, self._toggle_reverse),
+                (locals.K_m, 0, self._toggle_manual_gear_shift),
+            ]
+            + sensor_keys
+        )
 
         self._restart_brake(world)
 
@@ -86,110 +135,15 @@ class KeyboardControl:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self.end_control = True
-            if event.type == pygame.KEYUP:
-                if self._is_quit_shortcut(event.key):
-                    self.end_control = True
-                if event.key == locals.K_BACKSPACE:
-                    if self._autopilot_enabled:
-                        world.player.set_autopilot(False)
-                        world.restart()
-                        world.player.set_autopilot(True)
-                    else:
-                        world.restart()
-                    self._restart_brake(world)
-                if event.key == locals.K_F1:
-                    world.hud.toggle_info()
-                if event.key == locals.K_v and pygame.key.get_mods() & locals.KMOD_SHIFT:
-                    world.next_map_layer(reverse=True)
-                if event.key == locals.K_v:
-                    world.next_map_layer()
-                if event.key == locals.K_b and pygame.key.get_mods() & locals.KMOD_SHIFT:
-                    world.load_map_layer(unload=True)
-                if event.key == locals.K_b:
-                    world.load_map_layer()
-                if event.key == locals.K_h or (
-                    event.key == locals.K_SLASH and pygame.key.get_mods() & locals.KMOD_SHIFT
-                ):
-                    world.hud.help.toggle()
-                if event.key == locals.K_TAB:
-                    world.camera_manager.toggle_camera()
-                if event.key == locals.K_g:
-                    world.toggle_radar()
-                if event.key == locals.K_w and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    if world.constant_velocity_enabled:
-                        world.player.disable_constant_velocity()
-                        world.constant_velocity_enabled = False
-                        world.hud.notification("Disabled Constant Velocity Mode")
-                    else:
-                        world.player.enable_constant_velocity(carla.Vector3D(17, 0, 0))
-                        world.constant_velocity_enabled = True
-                        world.hud.notification("Enabled Constant Velocity Mode at 60 km/h")
-                if event.key == locals.K_r and not pygame.key.get_mods() & locals.KMOD_CTRL:
-                    world.camera_manager.toggle_recording()
-                if event.key == locals.K_r and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    if world.recording_enabled:
-                        client.stop_recorder()
-                        world.recording_enabled = False
-                        world.hud.notification("Recorder is OFF")
-                    else:
-                        client.start_recorder("manual_recording.rec")
-                        world.recording_enabled = True
-                        world.hud.notification("Recorder is ON")
-                if event.key == locals.K_p and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    # stop recorder
-                    client.stop_recorder()
-                    world.recording_enabled = False
-                    # work around to fix camera at start of replaying
-                    world.destroy_sensors()
-                    # disable autopilot
-                    self._autopilot_enabled = False
-                    world.player.set_autopilot(self._autopilot_enabled)
-                    world.hud.notification("Replaying file 'manual_recording.rec'")
-                    # replayer
-                    client.replay_file("manual_recording.rec", world.recording_start, 0, 0)
-                    world.camera_manager.set_sensor()
-                if event.key == locals.K_k and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    print("k pressed")
-                    world.player.enable_carsim("d:/CVC/carsim/DataUE4/ue4simfile.sim")
-                if event.key == locals.K_j and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    self._carsim_road = not self._carsim_road
-                    world.player.use_carsim_road(self._carsim_road)
-                    print("j pressed, using carsim road =", self._carsim_road)
-                # elif event.key == K_i and (pygame.key.get_mods() & KMOD_CTRL):
-                #     print("i pressed")
-                #     imp = carla.Location(z=50000)
-                #     world.player.add_impulse(imp)
-                if event.key == locals.K_MINUS and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    if pygame.key.get_mods() & locals.KMOD_SHIFT:
-                        world.recording_start -= 10
-                    else:
-                        world.recording_start -= 1
-                    world.hud.notification("Recording start time is %d" % (world.recording_start))
-                if event.key == locals.K_EQUALS and (pygame.key.get_mods() & locals.KMOD_CTRL):
-                    if pygame.key.get_mods() & locals.KMOD_SHIFT:
-                        world.recording_start += 10
-                    else:
-                        world.recording_start += 1
-                    world.hud.notification("Recording start time is %d" % (world.recording_start))
-                if event.key == locals.K_q:
-                    self._control.gear = 1 if self._control.reverse else -1
-                if event.key == locals.K_m:
-                    self._control.manual_gear_shift = not self._control.manual_gear_shift
-                    self._control.gear = world.player.get_control().gear
-                    world.hud.notification(
-                        "%s Transmission" % ("Manual" if self._control.manual_gear_shift else "Automatic")
-                    )
-                if self._control.manual_gear_shift and event.key == locals.K_s:
-                    self._control.gear = max(-1, self._control.gear - 1)
-                if self._control.manual_gear_shift and event.key == locals.K_w:
-                    self._control.gear = self._control.gear + 1
-                if event.key == locals.K_p and not pygame.key.get_mods() & locals.KMOD_CTRL:
-                    self._autopilot_enabled = not self._autopilot_enabled
-                    world.player.set_autopilot(self._autopilot_enabled)
-                    world.hud.notification("Autopilot %s" % ("On" if self._autopilot_enabled else "Off"))
+            elif event.type == pygame.KEYUP:
+                action = self._bindings.lookup(event.key, event.mod)
+                if action is not None:
+                    action(client, world)
+            else:
+                self._input.on_event(event, self._control)
 
         if not self._autopilot_enabled:
-            self._parse_vehicle_keys(pygame.key.get_pressed(), clock.get_time())
+            self._input.update(self._control, 1e-3 * clock.get_time())
             self._control.reverse = self._control.gear < 0
             # Set automatic control-related vehicle lights
             if self._control.brake:
@@ -205,34 +159,83 @@ class KeyboardControl:
                 world.player.set_light_state(carla.VehicleLightState(self._lights))
             world.player.apply_control(self._control)
 
-    def _parse_vehicle_keys(self, keys, milliseconds):
-        if keys[locals.K_UP]:
-            self._control.throttle = min(self._control.throttle + 0.01, 1)
+    def _quit(self, _client, _world):
+        self.end_control = True
+
+    def _restart(self, _client, world):
+        if self._autopilot_enabled:
+            world.player.set_autopilot(False)
+            world.restart()
+            world.player.set_autopilot(True)
         else:
-            self._control.throttle = 0.0
+            world.restart()
+        self._restart_brake(world)
+
+    def _set_sensor(self, index, _client, world):
+        world.camera_manager.set_sensor(index)
 
-        if keys[locals.K_DOWN]:
-            self._control.brake = min(self._control.brake + 0.2, 1)
+    def _toggle_constant_velocity(self, _client, world):
+        if world.constant_velocity_enabled:
+            world.player.disable_constant_velocity()
+            world.constant_velocity_enabled = False
+            world.hud.notification("Disabled Constant Velocity Mode")
         else:
-            self._control.brake = 0
+            world.player.enable_constant_velocity(carla.Vector3D(17, 0, 0))
+            world.constant_velocity_enabled = True
+            world.hud.notification("Enabled Constant Velocity Mode at 60 km/h")
+
+    def _toggle_recorder(self, client, world):
+        if world.recording_enabled:
+            world.stop_recorder(client)
+            world.hud.notification("Recorder is OFF")
+        else:
+            world.start_recorder(client)
+            world.hud.notification("Recorder is ON")
 
-        steer_increment = 5e-4 * milliseconds
-        if keys[locals.K_LEFT] or keys[locals.K_a]:
-            if self._steer_cache > 0:
-                self._steer_cache = 0
-            else:
-                self._steer_cache -= steer_increment
-        elif keys[locals.K_RIGHT] or keys[locals.K_d]:
-            if self._steer_cache < 0:
-                self._steer_cache = 0
-            else:
-                self._steer_cache += steer_increment
+    def _replay(self, client, world):
+        # stop recorder
+        if world.recording_enabled:
+            world.stop_recorder(client)
         else:
-            self._steer_cache = 0.0
-        self._steer_cache = min(0.7, max(-0.7, self._steer_cache))
-        self._control.steer = round(self._steer_cache, 1)
-        self._control.hand_brake = keys[locals.K_SPACE]
-
-    @staticmethod
-    def _is_quit_shortcut(key):
-        return (key == locals.K_ESCAPE) or (key == locals.K_q and pygame.key.get_mods() & locals.KMOD_CTRL)
+            client.stop_recorder()
+        # work around to fix camera at start of replaying
+        current_index = world.camera_manager.index
+        world.destroy_sensors()
+        # disable autopilot
+        self._autopilot_enabled = False
+        world.player.set_autopilot(self._autopilot_enabled)
+        world.hud.notification("Replaying file '%s'" % world.recording_name)
+        # replayer
+        client.replay_file(world.recording_name, world.recording_start, 0, 0)
+        world.camera_manager.set_sensor(current_index)
+
+    def _enable_carsim(self, _client, world):
+        world.hud.notification("Enabling CarSim")
+        world.player.enable_carsim("d:/CVC/carsim/DataUE4/ue4simfile.sim")
+
+    def _toggle_carsim_road(self, _client, world):
+        self._carsim_road = not self._carsim_road
+        world.player.use_carsim_road(self._carsim_road)
+        world.hud.notification("CarSim road %s" % ("On" if self._carsim_road else "Off"))
+
+    def _shift_recording_start(self, seconds, _client, world):
+        world.recording_collision = None
+        world.recording_start += seconds
+        world.hud.notification("Recording start time is %.1f" % (world.recording_start))
+
+    def _toggle_reverse(self, _client, _world):
+        self._control.gear = 1 if self._control.reverse else -1
+
+    def _toggle_manual_gear_shift(self, _client, world):
+        self._control.manual_gear_shift = not self._control.manual_gear_shift
+        self._control.gear = world.player.get_control().gear
+        world.hud.notification("%s Transmission" % ("Manual" if self._control.manual_gear_shift else "Automatic"))
+
+    def _shift_gear(self, step, _client, _world):
+        if self._control.manual_gear_shift:
+            self._control.gear = max(-1, self._control.gear + step)
+
+    def _toggle_autopilot(self, _client, world):
+        self._autopilot_enabled = not self._autopilot_enabled
+        world.player.set_autopilot(self._autopilot_enabled)
+        world.hud.notification("Autopilot %s" % ("On" if self._autopilot_enabled else "Off"))
@@ -0,0 +1,134 @@
+"""Client-side conversion of raw camera images with lookup tables."""
+
+import threading
+
+import numpy as np
+
+# CityScapes palette of the CARLA semantic tags, indexed by the tag stored in the red channel.
+CITYSCAPES_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+CITYSCAPES_PALETTE[:23] = [
+    (0, 0, 0),
+    (70, 70, 70),
+    (100, 40, 40),
+    (55, 90, 80),
+    (220, 20, 60),
+    (153, 153, 153),
+    (157, 234, 50),
+    (128, 64, 128),
+    (244, 35, 232),
+    (107, 142, 35),
+    (0, 0, 142),
+    (102, 102, 156),
+    (220, 220, 0),
+    (70, 130, 180),
+    (81, 0, 81),
+    (150, 100, 100),
+    (230, 150, 140),
+    (180, 165, 180),
+    (250, 170, 30),
+    (110, 190, 160),
+    (170, 120, 50),
+    (45, 60, 150),
+    (145, 170, 100),
+]
+
+# Depth is encoded as (R + G * 256 + B * 256 ** 2) / (256 ** 3 - 1) * 1000 metres, one table per channel.
+_DEPTH_SCALE = 1000.0 / (256 ** 3 - 1)
+DEPTH_LUT_R = (np.arange(256) * _DEPTH_SCALE).astype(np.float32)
+DEPTH_LUT_G = (np.arange(256) * 256 * _DEPTH_SCALE).astype(np.float32)
+DEPTH_LUT_B = (np.arange(256) * 256 ** 2 * _DEPTH_SCALE).astype(np.float32)
+
+
+def _gray_lut(curve):
+    """Return a (65536, 3) uint8 table indexed by the B and G bytes read as one little-endian uint16.
+
+    R only adds less than 1 / 65536 of the depth range, below one gray level, so it is ignored for display.
+    """
+    index = np.arange(256 ** 2)
+    normalized = ((index & 255) * 256 ** 2 + (index >> 8) * 256) / (256 ** 3 - 1.0)
+    gray = np.clip(curve(normalized), 0.0, 1.0) * 255.0
+    return np.repeat(gray.astype(np.uint8)[:, None], 3, axis=1)
+
+
+DEPTH_GRAY_LUT = _gray_lut(lambda normalized: normalized)
+# Same curve as carla.ColorConverter.LogarithmicDepth.
+LOG_DEPTH_GRAY_LUT = _gray_lut(
+    lambda normalized: np.clip(1.0 + np.log(np.maximum(normalized, 1e-7)) / 5.70378, 0.005, 1.0)
+)
+GRAY_LUTS = {"depth": DEPTH_GRAY_LUT, "log_depth": LOG_DEPTH_GRAY_LUT}
+
+
+class ImageConverter:
+    """Converts BGRA camera buffers to RGB display arrays with lookup tables, without allocating per frame.
+
+    Modes are "raw", "depth", "log_depth" and "cityscapes". The metric depth of the latest frame converted with
+    `depth=True`, or in a gray-scale depth mode, is decoded on first access of `depth`, into one of two float32
+    buffers so the previous frame stays readable meanwhile. Frames are converted on the sensor thread and `depth`
+    is read on the main thread, the lock keeps a resize from replacing the buffers during a decode.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._shape = None
+        self.rgb = None
+        self._depth = None
+        self._depth_source = None
+        self._depth_buffers = None
+        self._scratch = None
+
+    def _allocate(self, height, width):
+        self._shape = (height, width)
+        self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+        self._depth_buffers = [np.empty((height, width), dtype=np.float32) for _ in range(2)]
+        self._scratch = np.empty((height, width), dtype=np.float32)
+        self._depth = None
+        self._depth_source = None
+
+    @property
+    def depth(self):
+        """Depth in metres of the latest depth frame, None before the first one."""
+        with self._lock:
+            bgra = self._depth_source
+            if bgra is not None:
+                self._depth_source = None
+                self._depth = self._decode_depth(bgra)
+            return self._depth
+
+    def clear_depth(self):
+        """Forget the depth of the previous sensor, `depth` is None until the next depth frame."""
+        with self._lock:
+            self._depth = None
+            self._depth_source = None
+
+    def decode_depth(self, bgra):
+        with self._lock:
+            return self._decode_depth(bgra)
+
+    def _decode_depth(self, bgra):
+        if bgra.shape[:2] != self._shape:
+            self._allocate(*bgra.shape[:2])
+        depth = self._depth_buffers[0] if self._depth is not self._depth_buffers[0] else self._depth_buffers[1]
+        np.take(DEPTH_LUT_B, bgra[:, :, 0], out=depth)
+        np.take(DEPTH_LUT_G, bgra[:, :, 1], out=self._scratch)
+        depth += self._scratch
+        np.take(DEPTH_LUT_R, bgra[:, :, 2], out=self._scratch)
+        depth += self._scratch
+        return depth
+
+    def convert(self, bgra, mode, depth=False):
+        """Return an (H, W, 3) RGB view of the (H, W, 4) BGRA image `bgra` converted for display.
+
+        `depth` marks the frame of a depth camera, it feeds `depth` whatever the display mode.
+        """
+        if bgra.shape[:2] != self._shape:
+            with self._lock:
+                self._allocate(*bgra.shape[:2])
+        if depth or mode in GRAY_LUTS:
+            self._depth_source = bgra
+        if mode == "raw":
+            return bgra[:, :, 2::-1]
+        if mode == "cityscapes":
+            return np.take(CITYSCAPES_PALETTE, bgra[:, :, 2], axis=0, out=self.rgb)
+        if mode not in GRAY_LUTS:
+            raise ValueError("unknown conversion mode %r" % mode)
+        return np.take(GRAY_LUTS[mode], bgra.view(np.uint16)[:, :, 0], axis=0, out=self.rgb)
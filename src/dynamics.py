@@ -0,0 +1,269 @@
+"""Precomputed linearized vehicle dynamics for linear time-varying MPC."""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from src.utils import cache_path
+
+GRAVITY = 9.81
+STATES = ("vx", "vy", "yaw_rate")
+INPUTS = ("acceleration", "steer")
+
+
+class VehicleParameters:
+    """Dynamic bicycle model parameters, read once from the physics control of a spawned vehicle."""
+
+    # Tesla Model 3 wheelbase, used while CARLA still reports the wheels at the origin right after spawning.
+    DEFAULT_WHEELBASE = 2.875
+
+    def __init__(self, type_id, mass, front, rear, max_steer, lateral_stiffness, tire_friction):
+        self.type_id = type_id
+        self.mass = mass
+        # Distances from the center of mass to the front and rear axles in metres.
+        self.front = front
+        self.rear = rear
+        self.max_steer = max_steer
+        # Cornering stiffness per unit of axle load and per radian of slip.
+        self.lateral_stiffness = lateral_stiffness
+        self.tire_friction = tire_friction
+        self.yaw_inertia = mass * front * rear
+
+    @classmethod
+    def from_actor(cls, vehicle):
+        physics = vehicle.get_physics_control()
+        transform = vehicle.get_transform()
+        wheels = physics.wheels
+        # Wheel positions are world coordinates in centimetres, the center of mass is local in metres.
+        front_axle = np.mean([(w.position.x, w.position.y) for w in wheels[:2]], axis=0) / 100.0
+        rear_axle = np.mean([(w.position.x, w.position.y) for w in wheels[2:]], axis=0) / 100.0
+        axis = front_axle - rear_axle
+        wheelbase = float(np.hypot(*axis))
+        if wheelbase > 0.5:
+            yaw = math.radians(transform.rotation.yaw)
+            com = physics.center_of_mass
+            center = np.array(
+                (
+                    transform.location.x + com.x * math.cos(yaw) - com.y * math.sin(yaw),
+                    transform.location.y + com.x * math.sin(yaw) + com.y * math.cos(yaw),
+                )
+            )
+            rear = float(np.clip(np.dot(center - rear_axle, axis) / wheelbase, 0.1, wheelbase - 0.1))
+        else:
+            logging.warning("vehicle dynamics: wheel positions not available yet, using the default wheelbase")
+            wheelbase, rear = cls.DEFAULT_WHEELBASE, cls.DEFAULT_WHEELBASE / 2.0
+        return cls(
+            vehicle.type_id,
+            physics.mass,
+            wheelbase - rear,
+            rear,
+            math.radians(wheels[0].max_steer_angle),
+            getattr(wheels[0], "lat_stiff_value", 17.0),
+            wheels[0].tire_friction,
+        )
+
+    def key(self):
+        # Friction is an axis of the tables, changing it must not invalidate them.
+        values = [self.type_id] + [round(v, 4) for v in (self.mass, self.front, self.rear, self.max_steer)]
+        values.append(round(self.lateral_stiffness, 4))
+        return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()[:16]
+
+    def derivatives(self, state, control, friction):
+        """Time derivative of [vx, vy, yaw rate] for [acceleration, steer] with saturating lateral tire forces."""
+        vx, vy, yaw_rate = state
+        acceleration, steer = control
+        vx = max(vx, 0.5)
+        wheelbase = self.front + self.rear
+        load_front = self.mass * GRAVITY * self.rear / wheelbase
+        load_rear = self.mass * GRAVITY * self.front / wheelbase
+        slip_front = steer - math.atan2(vy + self.front * yaw_rate, vx)
+        slip_rear = -math.atan2(vy - self.rear * yaw_rate, vx)
+        limit_front, limit_rear = friction * load_front, friction * load_rear
+        force_front = limit_front * math.tanh(self.lateral_stiffness * load_front * slip_front / limit_front)
+        force_rear = limit_rear * math.tanh(self.lateral_stiffness * load_rear * slip_rear / limit_rear)
+        return np.array(
+            (
+                acceleration + vy * yaw_rate - force_front * math.sin(steer) / self.mass,
+                -vx * yaw_rate + (force_front * math.cos(steer) + force_rear) / self.mass,
+                (self.front * force_front * math.cos(steer) - self.rear * force_rear) / self.yaw_inertia,
+            )
+        )
+
+    def operating_point(self, speed, steer, friction):
+        """Steady cornering state at `speed` and `steer`, with the yaw rate limited by the friction."""
+        wheelbase = self.front + self.rear
+        yaw_rate = speed * math.tan(steer) / wheelbase
+        limit = friction * GRAVITY / max(speed, 0.5)
+        yaw_rate = max(-limit, min(limit, yaw_rate))
+        slip = math.atan(self.rear * math.tan(steer) / wheelbase)
+        return np.array((speed, speed * math.tan(slip), yaw_rate))
+
+
+def _expm(matrix):
+    """Matrix exponential by scaling and squaring of a Taylor series, for the small offline matrices."""
+    norm = np.linalg.norm(matrix, ord=np.inf)
+    squarings = max(0, int(math.ceil(math.log2(norm))) + 1) if norm > 0.5 else 0
+    scaled = matrix / (2 ** squarings)
+    result = np.eye(len(matrix))
+    term = np.eye(len(matrix))
+    for order in range(1, 16):
+        term = term @ scaled / order
+        result += term
+    for _ in range(squarings):
+        result = result @ result
+    return result
+
+
+def linearize(parameters, speed, steer, friction, dt, epsilon=1e-4):
+    """Return the zero-order-hold discretized (A, B) of the model around its operating point."""
+    state = parameters.operating_point(speed, steer, friction)
+    control = np.array((0.0, steer))
+    n, m = len(STATES), len(INPUTS)
+    augmented = np.zeros((n + m, n + m))
+    for i in range(n):
+        delta = np.zeros(n)
+        delta[i] = epsilon
+        augmented[:n, i] = (
+            parameters.derivatives(state + delta, control, friction)
+            - parameters.derivatives(state - delta, control, friction)
+        ) / (2.0 * epsilon)
+    for i in range(m):
+        delta = np.zeros(m)
+        delta[i] = epsilon
+        augmented[:n, n + i] = (
+            parameters.derivatives(state, control + delta, friction)
+            - parameters.derivatives(state, control - delta, friction)
+        ) / (2.0 * epsilon)
+    discrete = _expm(augmented * dt)
+    return discrete[:n, :n], discrete[:n, n:]
+
+
+def _require_axes(*axes):
+    # Interpolation needs a cell, a single point has no step to interpolate over.
+    if min(len(axis) for axis in axes) < 2:
+        raise ValueError("dynamics tables need at least 2 points per axis")
+
+
+class DynamicsTables:
+    """Discretized A (3x3) and B (3x2) matrices on a regular grid of speed, steering and friction.
+
+    Both are stored flattened side by side in one float32 array of shape (speeds, steers, frictions, 15), and
+    `lookup` interpolates them trilinearly, clamped to the grid.
+    """
+
+    def __init__(self, speeds, steers, frictions, dt, table):
+        _require_axes(speeds, steers, frictions)
+        self.speeds = speeds
+        self.steers = steers
+        self.frictions = frictions
+        self.dt = dt
+        self.table = table
+        self._flat = table.reshape(-1, table.shape[-1])
+        self._shape = table.shape[:3]
+        self._axes = [(float(axis[0]), float(axis[1] - axis[0]), len(axis) - 1) for axis in (speeds, steers, frictions)]
+        self._strides = np.array((self._shape[1] * self._shape[2], self._shape[2], 1))
+        # Flat offsets of the 8 corners of a grid cell and the interpolation output buffer.
+        self._corners = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)]) @ self._strides
+        self._weights = np.zeros(8)
+        self._index = np.zeros(8, dtype=np.intp)
+        self._row = self._shape[1] * self._shape[2]
+        self._out = np.zeros(table.shape[-1])
+
+    @classmethod
+    def build(cls, parameters, dt=0.05, speeds=None, steers=None, frictions=None):
+        speeds = np.linspace(0.5, 40.0, 40) if speeds is None else np.asarray(speeds, dtype=float)
+        if steers is None:
+            steers = np.linspace(-parameters.max_steer, parameters.max_steer, 31)
+        frictions = np.linspace(0.05, 1.2, 16) if frictions is None else np.asarray(frictions, dtype=float)
+        _require_axes(speeds, steers, frictions)
+        table = np.empty((len(speeds), len(steers), len(frictions), 15), dtype=np.float32)
+        for i, speed in enumerate(speeds):
+            for j, steer in enumerate(steers):
+                for k, friction in enumerate(frictions):
+                    A, B = linearize(parameters, speed, steer, friction, dt)
+                    table[i, j, k, :9] = A.ravel()
+                    table[i, j, k, 9:] = B.ravel()
+        return cls(speeds, np.asarray(steers, dtype=float), frictions, dt, table)
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as out:
+            np.savez(
+                out, speeds=self.speeds, steers=self.steers, frictions=self.frictions, dt=self.dt, table=self.table
+            )
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["speeds"], data["steers"], data["frictions"], float(data["dt"]), data["table"])
+
+    @classmethod
+    def load_or_build(cls, parameters, dt=0.05):
+        path = cache_path("dynamics", "%s-%.3f.npz" % (parameters.key(), dt))
+        start = time.time()
+        if os.path.exists(path):
+            tables = cls.load(path)
+            logging.info("vehicle dynamics: loaded tables in %.3f s", time.time() - start)
+            return tables
+        tables = cls.build(parameters, dt)
+        tables.save(path)
+        logging.info(
+            "vehicle dynamics: built %d linearizations in %.1f s",
+            int(np.prod(tables.table.shape[:3])),
+            time.time() - start,
+        )
+        return tables
+
+    def _cell(self, value, axis):
+        origin, step, last = self._axes[axis]
+        position = min(max((value - origin) / step, 0.0), last)
+        index = min(int(position), last - 1)
+        return index, position - index
+
+    def lookup(self, speed, steer, friction):
+        """Return views (A, B) interpolated at one grid point, valid until the next call."""
+        i, u = self._cell(speed, 0)
+        j, v = self._cell(steer, 1)
+        k, w = self._cell(friction, 2)
+        uv = ((1.0 - u) * (1.0 - v), (1.0 - u) * v, u * (1.0 - v), u * v)
+        self._weights[:] = (
+            uv[0] * (1.0 - w),
+            uv[0] * w,
+            uv[1] * (1.0 - w),
+            uv[1] * w,
+            uv[2] * (1.0 - w),
+            uv[2] * w,
+            uv[3] * (1.0 - w),
+            uv[3] * w,
+        )
+        np.add(self._corners, i * self._row + j * self._shape[2] + k, out=self._index)
+        np.dot(self._weights, self._flat.take(self._index, axis=0), out=self._out)
+        return self._out[:9].reshape(3, 3), self._out[9:].reshape(3, 2)
+
+    def lookup_batch(self, speeds, steers, frictions):
+        """Return (A, B) of shapes (T, 3, 3) and (T, 3, 2) for a horizon of T operating points."""
+        cells, fractions = [], []
+        for axis, values in enumerate((speeds, steers, frictions)):
+            origin, step, last = self._axes[axis]
+            position = np.clip((np.asarray(values, dtype=float) - origin) / step, 0.0, last)
+            index = np.minimum(position.astype(np.intp), last - 1)
+            cells.append(index)
+            fractions.append(position - index)
+        base = cells[0] * self._strides[0] + cells[1] * self._strides[1] + cells[2]
+        u, v, w = fractions
+        weights = np.stack(
+            [
+                (u if a else 1.0 - u) * (v if b else 1.0 - v) * (w if c else 1.0 - w)
+                for a in (0, 1)
+                for b in (0, 1)
+                for c in (0, 1)
+            ],
+            axis=1,
+        )
+        values = np.einsum("tc,tck->tk", weights, self._flat[base[:, None] + self._corners])
+        return values[:, :9].reshape(-1, 3, 3), values[:, 9:].reshape(-1, 3, 2)
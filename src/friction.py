@@ -0,0 +1,85 @@
+"""Tire friction and damping setup, per wheel or through friction trigger volumes."""
+
+import glob
+import math
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import carla
+
+
+class PhysicsTemplate:
+    """Physics control of a vehicle type, fetched from the server once and reused for every friction change."""
+
+    _templates = {}
+
+    def __init__(self, physics_control):
+        self.physics_control = physics_control
+        self.wheels = [(wheel.tire_friction, wheel.damping_rate) for wheel in physics_control.wheels]
+
+    @classmethod
+    def for_vehicle(cls, vehicle):
+        template = cls._templates.get(vehicle.type_id)
+        if template is None:
+            template = cls._templates[vehicle.type_id] = cls(vehicle.get_physics_control())
+        return template
+
+    def apply(self, vehicle, friction=None, damping=None):
+        """Apply one friction and damping to every wheel, None keeps the value of the template."""
+        wheels = self.physics_control.wheels
+        for wheel, (tire_friction, damping_rate) in zip(wheels, self.wheels):
+            wheel.tire_friction = tire_friction if friction is None else friction
+            wheel.damping_rate = damping_rate if damping is None else damping
+        self.physics_control.wheels = wheels
+        vehicle.apply_physics_control(self.physics_control)
+
+
+def spawn_friction_triggers(client, world, route, friction, length, width=8.0, tolerance=1.0, gap=6.0):
+    """Cover the first `length` metres of `route` (an (N, 2+) array of x, y, ...) with friction trigger boxes.
+
+    A trigger restores the friction when the vehicle leaves it, so boxes must not overlap: every box spans one
+    straight piece of the route, as long as the route stays within `tolerance` metres of its axis, and is oriented
+    along it. Consecutive boxes are `gap` metres apart, longer than the vehicle, which rolls at the template friction
+    in between. Box heights come from the road under each box centre, or 0 off the road network.
+    """
+    blueprint = world.get_blueprint_library().find("static.trigger.friction")
+    blueprint.set_attribute("friction", str(friction))
+    carla_map = world.get_map()
+    points = route[:, :2]
+    distance = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))))
+    end = min(length, distance[-1])
+    batch = []
+    start = 0
+    while start < len(points) - 1 and distance[start] < end:
+        stop = start + 1
+        while stop + 1 < len(points) and distance[stop + 1] <= end:
+            axis = points[stop + 1] - points[start]
+            normal = np.array((-axis[1], axis[0])) / max(np.hypot(*axis), 1e-9)
+            if np.abs((points[start : stop + 2] - points[start]) @ normal).max() > tolerance:
+                break
+            stop += 1
+        axis = points[stop] - points[start]
+        center = (points[start] + points[stop]) / 2.0
+        ground = carla_map.get_waypoint(carla.Location(x=float(center[0]), y=float(center[1])))
+        z = ground.transform.location.z if ground is not None else 0.0
+        # Extents are half sizes in centimetres.
+        blueprint.set_attribute("extent_x", str(50.0 * float(np.hypot(*axis))))
+        blueprint.set_attribute("extent_y", str(50.0 * width))
+        blueprint.set_attribute("extent_z", str(500.0))
+        transform = carla.Transform(
+            carla.Location(x=float(center[0]), y=float(center[1]), z=z + 0.5),
+            carla.Rotation(yaw=math.degrees(math.atan2(axis[1], axis[0]))),
+        )
+        batch.append(carla.command.SpawnActor(blueprint, transform))
+        start = int(np.searchsorted(distance, distance[stop] + gap))
+    responses = client.apply_batch_sync(batch, False)
+    return list(world.get_actors([response.actor_id for response in responses if not response.error]))
@@ -0,0 +1,192 @@
+"""Keyboard dispatch and vehicle input devices."""
+
+import logging
+
+import pygame
+from pygame import locals
+
+# Modifier combinations the key bindings distinguish, left and right keys are not told apart.
+MODIFIER_COMBINATIONS = (0, locals.KMOD_SHIFT, locals.KMOD_CTRL, locals.KMOD_CTRL | locals.KMOD_SHIFT)
+
+
+def modifiers(mod):
+    """Reduce a pygame modifier bitmask to its shift and control bits, ignoring Alt, Num Lock and Caps Lock."""
+    return (locals.KMOD_SHIFT if mod & locals.KMOD_SHIFT else 0) | (locals.KMOD_CTRL if mod & locals.KMOD_CTRL else 0)
+
+
+class KeyBindings:
+    """Precomputed (key, modifiers) to action table.
+
+    A binding without shift also answers when shift is held, and a binding without modifiers answers for every
+    combination without a binding of its own, so SHIFT+TAB still changes the camera while SHIFT+V and V are
+    different actions. The fallbacks are resolved once here, a key press is then a single dictionary lookup.
+    """
+
+    def __init__(self, bindings):
+        declared = {}
+        for key, mods, action in bindings:
+            declared[(key, mods)] = action
+        self._table = {}
+        for key in set(key for key, _ in declared):
+            for mods in MODIFIER_COMBINATIONS:
+                for fallback in (mods, mods & ~locals.KMOD_SHIFT, 0):
+                    action = declared.get((key, fallback))
+                    if action is not None:
+                        self._table[(key, mods)] = action
+                        break
+
+    def lookup(self, key, mod):
+        return self._table.get((key, modifiers(mod)))
+
+
+class VehicleInput:
+    """Vehicle control from an input device, integrated in fixed steps of 1 / `rate` seconds.
+
+    The device is sampled once per frame and the elapsed frame time is consumed by an accumulator in fixed steps,
+    so ramps are defined per second and reach the same values at 30 or 144 FPS. At most `max_lag` seconds are
+    integrated after a stall.
+    """
+
+    def __init__(self, rate=200.0, max_lag=0.25):
+        self._step = 1.0 / rate
+        self._max_lag = max_lag
+        self._accumulator = 0.0
+
+    def on_event(self, event, control):
+        pass
+
+    def sample(self):
+        raise NotImplementedError
+
+    def integrate(self, control, dt):
+        raise NotImplementedError
+
+    def finish(self, control):
+        pass
+
+    def update(self, control, seconds):
+        """Sample the device and advance `control` by `seconds` of frame time."""
+        self.sample()
+        self._accumulator = min(self._accumulator + seconds, self._max_lag)
+        while self._accumulator >= self._step:
+            self.integrate(control, self._step)
+            self._accumulator -= self._step
+        self.finish(control)
+
+
+class KeyboardInput(VehicleInput):
+    """Arrow keys and A/D, with ramps in units per second. Releasing a key drops its control to zero."""
+
+    def __init__(self, throttle_rate=0.6, brake_rate=12.0, steer_rate=0.5, max_steer=0.7, rate=200.0):
+        super().__init__(rate)
+        self.throttle_rate = throttle_rate
+        self.brake_rate = brake_rate
+        self.steer_rate = steer_rate
+        self.max_steer = max_steer
+        self._steer_cache = 0.0
+        self._keys = None
+
+    def sample(self):
+        self._keys = pygame.key.get_pressed()
+
+    def integrate(self, control, dt):
+        keys = self._keys
+        control.throttle = min(control.throttle + self.throttle_rate * dt, 1.0) if keys[locals.K_UP] else 0.0
+        control.brake = min(control.brake + self.brake_rate * dt, 1.0) if keys[locals.K_DOWN] else 0.0
+
+        steer_increment = self.steer_rate * dt
+        if keys[locals.K_LEFT] or keys[locals.K_a]:
+            if self._steer_cache > 0:
+                self._steer_cache = 0
+            else:
+                self._steer_cache -= steer_increment
+        elif keys[locals.K_RIGHT] or keys[locals.K_d]:
+            if self._steer_cache < 0:
+                self._steer_cache = 0
+            else:
+                self._steer_cache += steer_increment
+        else:
+            self._steer_cache = 0.0
+        self._steer_cache = min(self.max_steer, max(-self.max_steer, self._steer_cache))
+
+    def finish(self, control):
+        control.steer = round(self._steer_cache, 1)
+        control.hand_brake = bool(self._keys[locals.K_SPACE])
+
+
+class JoystickInput(VehicleInput):
+    """Steering wheel or gamepad axes.
+
+    Wheel pedals rest at +1 and read -1 fully pressed, gamepad triggers rest at -1, `wheel` selects the mapping.
+    Many wheels report 0 on a pedal until it first moves, so a pedal counts as released until its first motion
+    event. Axis values are applied as they are, the reverse button toggles the gear.
+    """
+
+    def __init__(
+        self,
+        joystick,
+        wheel=True,
+        steer_axis=0,
+        throttle_axis=2,
+        brake_axis=3,
+        hand_brake_button=4,
+        reverse_button=5,
+        deadzone=0.02,
+        rate=200.0,
+    ):
+        super().__init__(rate)
+        self.joystick = joystick
+        self.wheel = wheel
+        self.steer_axis = steer_axis
+        self.throttle_axis = throttle_axis
+        self.brake_axis = brake_axis
+        self.hand_brake_button = hand_brake_button
+        self.reverse_button = reverse_button
+        self.deadzone = deadzone
+        self._axes = (0.0, 0.0, 0.0)
+        self._hand_brake = False
+        self._moved = set()
+
+    def _pedal(self, axis):
+        if axis not in self._moved:
+            return 0.0
+        value = self.joystick.get_axis(axis)
+        pressed = (1.0 - value) / 2.0 if self.wheel else (value + 1.0) / 2.0
+        return min(1.0, max(0.0, pressed)) if pressed > self.deadzone else 0.0
+
+    def on_event(self, event, control):
+        if getattr(event, "instance_id", None) != self.joystick.get_instance_id():
+            return
+        if event.type == pygame.JOYAXISMOTION:
+            self._moved.add(event.axis)
+        elif event.type == pygame.JOYBUTTONDOWN and event.button == self.reverse_button:
+            control.gear = 1 if control.reverse else -1
+
+    def sample(self):
+        steer = self.joystick.get_axis(self.steer_axis)
+        self._axes = (
+            steer if abs(steer) > self.deadzone else 0.0,
+            self._pedal(self.throttle_axis),
+            self._pedal(self.brake_axis),
+        )
+        self._hand_brake = bool(self.joystick.get_button(self.hand_brake_button))
+
+    def integrate(self, control, dt):
+        control.steer, control.throttle, control.brake = self._axes
+
+    def finish(self, control):
+        control.hand_brake = self._hand_brake
+
+
+def create_vehicle_input(device="keyboard", index=0):
+    """Return the vehicle input of `device`, falling back to the keyboard when no joystick is connected."""
+    if device == "keyboard":
+        return KeyboardInput()
+    pygame.joystick.init()
+    if pygame.joystick.get_count() <= index:
+        logging.warning("no joystick %d connected, using the keyboard", index)
+        return KeyboardInput()
+    joystick = pygame.joystick.Joystick(index)
+    joystick.init()
+    logging.info("%s input: %s", device, joystick.get_name())
+    return JoystickInput(joystick, wheel=device == "wheel")
@@ -1,14 +1,29 @@
+import collections
 import datetime
 import math
 import os
 
+import numpy as np
 import pygame
 
+from src.latency import LatencyTracker
 from src.utils import get_actor_display_name
 
+# Columns of the plot ring buffer after the simulation time.
+PLOT_COLUMNS = ("speed", "yaw_rate", "kinematic_yaw_rate", "lateral_acceleration", "steer", "throttle", "brake")
+# Label, value format, default range and (column, color) traces of every strip. Ranges grow with the data, the
+# kinematic yaw rate of the steering angle is drawn under the measured one so that slip shows as a gap.
+PLOT_STRIPS = (
+    ("Speed", "%5.1f km/h", 0.0, 30.0, ((0, (255, 255, 255)),)),
+    ("Yaw rate", "%5.1f deg/s", -20.0, 20.0, ((2, (110, 110, 110)), (1, (255, 136, 0)))),
+    ("Lateral acc.", "%5.1f m/s2", -4.0, 4.0, ((3, (80, 200, 255)),)),
+    ("Steer", "%5.2f", -1.0, 1.0, ((4, (120, 255, 120)),)),
+    ("Throttle", "%5.2f", 0.0, 1.0, ((6, (255, 80, 80)), (5, (255, 255, 255)))),
+)
+
 
 class HUD:
-    def __init__(self, width, height):
+    def __init__(self, width, height, plot_seconds=10.0, plot_fps=15.0):
         self.dim = (width, height)
         font = pygame.font.Font(pygame.font.get_default_font(), 20)
         font_name = "courier" if os.name == "nt" else "mono"
@@ -18,26 +33,56 @@ class HUD:
         mono = pygame.font.match_font(mono)
         self._font_mono = pygame.font.Font(mono, 12 if os.name == "nt" else 14)
         self._notifications = FadingText(font, (width, 40), (0, height - 40))
+        # Sensor callbacks only queue notifications, they are rendered on the main thread in tick().
+        self._notification_queue = collections.deque()
         self.server_fps = 0
         self.frame = 0
         self.simulation_time = 0
         self._show_info = True
         self._info_text = []
+        self._rendered_text = []
+        self._info_shown = False
         self._server_clock = pygame.time.Clock()
+        self.latency = LatencyTracker()
+        # The percentiles run over the whole latency history, they are recomputed every `_latency_interval` seconds.
+        self._latency_interval = 0.5
+        self._latency_age = self._latency_interval
+        self._latency_text = []
+        plot_dim = (320, 300)
+        self.plots = PlotPanel(
+            self._font_mono,
+            plot_dim,
+            (width - plot_dim[0] - 8, height - plot_dim[1] - 48),
+            PLOT_STRIPS,
+            len(PLOT_COLUMNS),
+            plot_seconds,
+            plot_fps,
+        )
 
     def on_world_tick(self, timestamp):
+        self.latency.on_world_tick(timestamp)
         self._server_clock.tick()
         self.server_fps = self._server_clock.get_fps()
         self.frame = timestamp.frame
         self.simulation_time = timestamp.elapsed_seconds
 
     def tick(self, world, clock):
+        while self._notification_queue:
+            self._notifications.set_text(*self._notification_queue.popleft())
         self._notifications.tick(world, clock)
-        if not self._show_info:
+        # IMU and GNSS samples are read every frame, whether the info panel shows them or not.
+        self.latency.consumed("IMU")
+        self.latency.consumed("GNSS")
+        if not self._show_info and not self.plots.visible:
             return
-        t = world.player.get_transform()
         v = world.player.get_velocity()
         c = world.player.get_control()
+        self._sample_plots(world, v, c)
+        if self.plots.visible:
+            self.plots.tick(clock)
+        if not self._show_info:
+            return
+        t = world.player.get_transform()
         compass = world.imu_sensor.compass
         heading = "N" if compass > 270.5 or compass < 89.5 else ""
         heading += "S" if 90.5 < compass < 269.5 else ""
@@ -47,7 +92,6 @@ class HUD:
         collision = [colhist[x + self.frame - 200] for x in range(0, 200)]
         max_col = max(1.0, max(collision))
         collision = [x / max_col for x in collision]
-        vehicles = world.world.get_actors().filter("vehicle.*")
         self._info_text = [
             "Server:  % 16.0f FPS" % self.server_fps,
             "Client:  % 16.0f FPS" % clock.get_fps(),
@@ -77,18 +121,85 @@ class HUD:
             "Gear:        %s" % {-1: "R", 0: "N"}.get(c.gear, c.gear),
         ]
 
-        self._info_text += ["", "Collision:", collision, "", "Number of vehicles: % 8d" % len(vehicles)]
+        self._info_text += [
+            "",
+            "Collision:",
+            collision,
+            "",
+            "Number of vehicles: % 8d" % world.actor_index.count("vehicle"),
+        ]
+
+        localizer = world.localizer
+        pose = localizer.pose() if localizer is not None else None
+        if pose is not None:
+            predict_ms, update_ms, imu_period_ms = localizer.report()
+            self._info_text += [
+                "",
+                "EKF:     % 20s" % ("(% 5.1f, % 5.1f, % 4.0f)" % pose),
+                "EKF p99 (ms): %5.3f / %5.3f" % (predict_ms, update_ms),
+                "IMU period: % 14.1f ms" % imu_period_ms,
+            ]
+
+        camera = world.camera_manager
+        if camera.convert_ms:
+            self._info_text += ["", "Camera conversion: % 7.1f ms" % (sum(camera.convert_ms) / len(camera.convert_ms))]
+        lidar = world.lidar_sensor
+        if lidar is not None and lidar.process_ms:
+            self._info_text += [
+                "",
+                "LiDAR: %6d -> %6d pts" % (len(lidar.points), len(lidar.obstacles)),
+                "LiDAR sweep: % 12.1f ms" % (sum(lidar.process_ms) / len(lidar.process_ms)),
+            ]
+
+        self._latency_age += 1e-3 * clock.get_time()
+        if self._latency_age >= self._latency_interval:
+            self._latency_age = 0.0
+            latency = self.latency.summary(q=(50, 95))
+            self._latency_text = ["", "Latency p50/p95 (ms):"] if latency else []
+            for name, stages in latency.items():
+                if "presented" in stages:
+                    self._latency_text.append("  %-13s%6.1f /%6.1f" % ((name,) + tuple(stages["presented"])))
+        self._info_text += self._latency_text
+
+    def _sample_plots(self, world, v, c):
+        speed = math.sqrt(v.x ** 2 + v.y ** 2)
+        parameters = world.vehicle_parameters
+        kinematic = 0.0
+        if parameters is not None:
+            angle = c.steer * parameters.max_steer
+            kinematic = math.degrees(speed * math.tan(angle) / (parameters.front + parameters.rear))
+        self.plots.append(
+            self.simulation_time,
+            (
+                3.6 * speed,
+                world.imu_sensor.gyroscope[2],
+                kinematic,
+                world.imu_sensor.accelerometer[1],
+                c.steer,
+                c.throttle,
+                c.brake,
+            ),
+        )
 
     def toggle_info(self):
         self._show_info = not self._show_info
 
+    def toggle_plots(self):
+        self.plots.visible = not self.plots.visible
+
     def notification(self, text, seconds=2.0):
-        self._notifications.set_text(text, seconds=seconds)
+        self._notification_queue.append((text, (255, 255, 255), seconds))
 
     def error(self, text):
-        self._notifications.set_text("Error: %s" % text, (255, 0, 0))
+        self._notification_queue.append(("Error: %s" % text, (255, 0, 0), 2.0))
 
     def render(self, display):
+        """Draw the HUD, return the dirty rectangles of the display."""
+        rects = []
+        full_redraw = self._show_info != self._info_shown or len(self._info_text) != len(self._rendered_text)
+        if full_redraw:
+            rects.append(pygame.Rect((0, 0), (220, self.dim[1])))
+            self._info_shown = self._show_info
         if self._show_info:
             info_surface = pygame.Surface((220, self.dim[1]))
             info_surface.set_alpha(100)
@@ -96,9 +207,11 @@ class HUD:
             v_offset = 4
             bar_h_offset = 100
             bar_width = 106
-            for item in self._info_text:
+            for index, item in enumerate(self._info_text):
                 if v_offset + 18 > self.dim[1]:
                     break
+                if not full_redraw and item != self._rendered_text[index]:
+                    rects.append(pygame.Rect((0, v_offset), (220, 36 if isinstance(item, list) else 18)))
                 if isinstance(item, list):
                     if len(item) > 1:
                         points = [(x + 8, v_offset + 8 + (1.0 - y) * 30) for x, y in enumerate(item)]
@@ -123,28 +236,198 @@ class HUD:
                     surface = self._font_mono.render(item, True, (255, 255, 255))
                     display.blit(surface, (8, v_offset))
                 v_offset += 18
-        self._notifications.render(display)
+            self._rendered_text = list(self._info_text)
+        rects += self.plots.render(display)
+        rects += self._notifications.render(display)
+        return rects
+
+
+class RingBuffer:
+    """Fixed-size ring of float rows, read back oldest first."""
+
+    def __init__(self, capacity, columns):
+        self.data = np.zeros((capacity, columns))
+        self.index = 0
+        self.size = 0
+
+    def append(self, row):
+        self.data[self.index] = row
+        self.index = (self.index + 1) % len(self.data)
+        self.size = min(self.size + 1, len(self.data))
+
+    def clear(self):
+        self.index = 0
+        self.size = 0
+
+    def last(self):
+        return self.data[self.index - 1] if self.size else None
+
+    def ordered(self):
+        if self.size < len(self.data):
+            return self.data[: self.size]
+        return np.concatenate((self.data[self.index :], self.data[: self.index]))
+
+
+class PlotPanel:
+    """Strip charts of the last `seconds` of simulation time.
+
+    Samples go to a ring buffer of one row per pixel column, the traces are computed for all samples at once and
+    drawn into a cached surface at most `max_fps` times per second, the surface is blitted every frame.
+    """
+
+    def __init__(self, font, dim, pos, strips, columns, seconds=10.0, max_fps=15.0):
+        self.font = font
+        self.dim = dim
+        self.pos = pos
+        self.strips = strips
+        self.seconds = seconds
+        self.visible = False
+        self.surface = pygame.Surface(dim)
+        self.surface.set_alpha(180)
+        self._buffer = RingBuffer(dim[0], columns + 1)
+        self._step = seconds / dim[0]
+        self._min_interval = 1.0 / max_fps
+        self._since_draw = self._min_interval
+        self._dirty = False
+        self._redrawn = False
+        self._shown = False
+        self._labels = {}
+
+    def append(self, timestamp, values):
+        last = self._buffer.last()
+        if last is not None:
+            if timestamp < last[0]:
+                # The simulation was restarted or a recording replayed.
+                self._buffer.clear()
+            elif timestamp - last[0] < self._step:
+                return
+        self._buffer.append((timestamp,) + tuple(values))
+        self._dirty = True
+
+    def tick(self, clock):
+        self._since_draw += 1e-3 * clock.get_time()
+        if self._dirty and self._since_draw >= self._min_interval:
+            self._draw()
+            self._dirty = False
+            self._redrawn = True
+            self._since_draw = 0.0
+
+    def _label(self, text):
+        texture = self._labels.get(text)
+        if texture is None:
+            if len(self._labels) > 512:
+                self._labels.clear()
+            texture = self._labels[text] = self.font.render(text, True, (255, 255, 255))
+        return texture
+
+    def _draw(self):
+        self.surface.fill((0, 0, 0))
+        samples = self._buffer.ordered()
+        if not len(samples):
+            return
+        width, height = self.dim
+        strip_height = height // len(self.strips)
+        plot_height = strip_height - 20
+        xs = (width - 1) - (samples[-1, 0] - samples[:, 0]) * ((width - 1) / self.seconds)
+        for index, (label, fmt, low, high, traces) in enumerate(self.strips):
+            top = index * strip_height + 16
+            columns = [column + 1 for column, _ in traces]
+            values = samples[:, columns]
+            if low < 0.0:
+                high = max(high, float(np.abs(values).max()))
+                low = -high
+            else:
+                low, high = min(low, float(values.min())), max(high, float(values.max()))
+            scale = (plot_height - 1) / (high - low)
+            text = "%s %s" % (label, fmt % samples[-1, columns[-1]])
+            self.surface.blit(self._label(text), (4, top - 16))
+            if low < 0.0 < high:
+                zero = top + (high * scale)
+                pygame.draw.line(self.surface, (70, 70, 70), (0, zero), (width - 1, zero))
+            if len(samples) < 2:
+                continue
+            ys = top + (high - values) * scale
+            for (_, color), trace in zip(traces, ys.T):
+                pygame.draw.lines(self.surface, color, False, np.column_stack((xs, trace)).tolist(), 1)
+
+    def render(self, display):
+        """Blit the plots, return the dirty rectangles of the display."""
+        changed = self.visible != self._shown
+        self._shown = self.visible
+        if not self.visible:
+            return [pygame.Rect(self.pos, self.dim)] if changed else []
+        display.blit(self.surface, self.pos)
+        redrawn, self._redrawn = self._redrawn, False
+        return [pygame.Rect(self.pos, self.dim)] if changed or redrawn else []
 
 
 class FadingText:
-    def __init__(self, font, dim, pos):
+    """Fading notification strip.
+
+    Repeated messages are merged into one line with a count, the strip is redrawn into the same surface at most
+    every `min_interval` seconds and rendered text is cached.
+    """
+
+    def __init__(self, font, dim, pos, min_interval=0.1, cache_size=64):
         self.font = font
         self.dim = dim
         self.pos = pos
         self.seconds_left = 0
         self.surface = pygame.Surface(self.dim)
+        self._visible = False
+        self._text = None
+        self._color = None
+        self._count = 0
+        self._dirty = False
+        self._min_interval = min_interval
+        self._since_draw = min_interval
+        self._cache_size = cache_size
+        self._textures = collections.OrderedDict()
 
     def set_text(self, text, color=(255, 255, 255), seconds=2.0):
-        text_texture = self.font.render(text, True, color)
-        self.surface = pygame.Surface(self.dim)
+        if self.seconds_left > 0.0 and text == self._text and color == self._color:
+            self._count += 1
+        else:
+            self._text = text
+            self._color = color
+            self._count = 1
         self.seconds_left = seconds
-        self.surface.fill((0, 0, 0, 0))
+        self._dirty = True
+
+    def _texture(self, text, color):
+        key = (text, color)
+        texture = self._textures.get(key)
+        if texture is None:
+            texture = self._textures[key] = self.font.render(text, True, color)
+            if len(self._textures) > self._cache_size:
+                self._textures.popitem(last=False)
+        else:
+            self._textures.move_to_end(key)
+        return texture
+
+    def _draw(self):
+        self.surface.fill((0, 0, 0))
+        text_texture = self._texture(self._text, self._color)
         self.surface.blit(text_texture, (10, 11))
+        if self._count > 1:
+            count_texture = self._texture(u" \u00d7%d" % self._count, self._color)
+            self.surface.blit(count_texture, (10 + text_texture.get_width(), 11))
 
     def tick(self, _, clock):
         delta_seconds = 1e-3 * clock.get_time()
         self.seconds_left = max(0.0, self.seconds_left - delta_seconds)
+        self._since_draw += delta_seconds
+        if self._dirty and self._since_draw >= self._min_interval:
+            self._draw()
+            self._dirty = False
+            self._since_draw = 0.0
         self.surface.set_alpha(500.0 * self.seconds_left)
 
     def render(self, display):
+        """Blit the text, return the dirty rectangles of the display."""
         display.blit(self.surface, self.pos)
+        visible = self.seconds_left > 0.0
+        if not visible and not self._visible:
+            return []
+        self._visible = visible
+        return [pygame.Rect(self.pos, self.dim)]
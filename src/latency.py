@@ -0,0 +1,99 @@
+"""Sensor latency tracking from simulation frame to display."""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class LatencyTracker:
+    """Rolling per-sensor latency percentiles.
+
+    Every sample is measured against the wall-clock time at which the client received the world tick of the
+    simulation frame the sample belongs to, through three stages: arrival in the sensor callback, consumption by
+    the client loop and presentation on screen.
+    """
+
+    STAGES = ("arrival", "consumed", "presented")
+
+    def __init__(self, window=300, max_frames=600):
+        self._window = window
+        self._max_frames = max_frames
+        self._lock = threading.Lock()
+        self._frame_times = collections.OrderedDict()
+        self._pending = {}
+        self._consumed = []
+        self._samples = {}
+        self._dropped = collections.defaultdict(int)
+        self._arrived = collections.defaultdict(int)
+
+    def on_world_tick(self, timestamp):
+        with self._lock:
+            self._frame_times[timestamp.frame] = time.time()
+            while len(self._frame_times) > self._max_frames:
+                self._frame_times.popitem(last=False)
+
+    def arrived(self, name, frame):
+        with self._lock:
+            self._arrived[name] += 1
+            if name in self._pending:
+                self._dropped[name] += 1
+            self._pending[name] = (frame, time.time())
+
+    def consumed(self, name):
+        with self._lock:
+            sample = self._pending.pop(name, None)
+            if sample is not None:
+                self._consumed.append((name, sample[0], sample[1], time.time()))
+
+    def discard(self, name):
+        """Forget the pending sample of `name`, when it goes off screen without being consumed."""
+        with self._lock:
+            self._pending.pop(name, None)
+
+    def presented(self):
+        now = time.time()
+        with self._lock:
+            for name, frame, arrival, consumed in self._consumed:
+                origin = self._frame_times.get(frame, arrival)
+                stages = self._samples.get(name)
+                if stages is None:
+                    stages = self._samples[name] = [collections.deque(maxlen=self._window) for _ in self.STAGES]
+                stages[0].append(1e3 * max(0.0, arrival - origin))
+                stages[1].append(1e3 * max(0.0, consumed - origin))
+                stages[2].append(1e3 * max(0.0, now - origin))
+            self._consumed = []
+
+    def dropped(self, names=None):
+        """Return the number of samples replaced before being consumed, summed over `names` or all sensors."""
+        with self._lock:
+            return sum(count for name, count in self._dropped.items() if names is None or name in names)
+
+    def arrivals(self, names=None):
+        """Return the number of samples received, summed over `names` or all sensors."""
+        with self._lock:
+            return sum(count for name, count in self._arrived.items() if names is None or name in names)
+
+    def percentiles(self, name, stage="presented", q=(50, 95, 99)):
+        with self._lock:
+            stages = self._samples.get(name)
+            if stages is None or not stages[self.STAGES.index(stage)]:
+                return None
+            values = np.array(stages[self.STAGES.index(stage)])
+        return np.percentile(values, q)
+
+    def summary(self, q=(50, 95, 99)):
+        """Return {sensor: {stage: [p..], "dropped": n}} in milliseconds."""
+        with self._lock:
+            names = sorted(self._samples)
+        result = {}
+        for name in names:
+            entry = {}
+            for stage in self.STAGES:
+                values = self.percentiles(name, stage, q)
+                if values is not None:
+                    entry[stage] = [round(float(x), 2) for x in values]
+            entry["dropped"] = self._dropped[name]
+            result[name] = entry
+        return result
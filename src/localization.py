@@ -0,0 +1,207 @@
+"""GNSS and IMU fusion into a filtered planar pose."""
+
+import glob
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import carla
+
+EARTH_RADIUS = 6378137.0
+
+
+class GeoReference:
+    """Converts latitude and longitude to east/north metres with the Mercator projection CARLA uses for GNSS.
+
+    East is the map x axis and north is the map -y axis, so the conversion is exact for the simulated GNSS.
+    """
+
+    _cache = {}
+
+    def __init__(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self._scale = math.cos(math.radians(latitude)) * EARTH_RADIUS
+        self._east0 = self._scale * math.radians(longitude)
+        self._north0 = self._scale * math.log(math.tan(math.pi / 4.0 + math.radians(latitude) / 2.0))
+
+    @classmethod
+    def from_map(cls, carla_map):
+        """Return the geo-reference of the map origin, computed once per map."""
+        reference = cls._cache.get(carla_map.name)
+        if reference is None:
+            origin = carla_map.transform_to_geolocation(carla.Location())
+            reference = cls._cache[carla_map.name] = cls(origin.latitude, origin.longitude)
+        return reference
+
+    def to_enu(self, latitude, longitude):
+        east = self._scale * math.radians(longitude) - self._east0
+        north = self._scale * math.log(math.tan(math.pi / 4.0 + math.radians(latitude) / 2.0)) - self._north0
+        return east, north
+
+
+class _Timings:
+    """Fixed-size ring buffer of durations in milliseconds."""
+
+    def __init__(self, size=1000):
+        self.values = np.zeros(size)
+        self.count = 0
+
+    def add(self, milliseconds):
+        self.values[self.count % len(self.values)] = milliseconds
+        self.count += 1
+
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        return float(np.percentile(self.values[: min(self.count, len(self.values))], q))
+
+
+class Localizer:
+    """Extended Kalman filter over [east, north, east velocity, north velocity, yaw] in the local ENU frame.
+
+    The IMU drives the prediction at full rate with its planar acceleration and yaw rate, GNSS fixes correct the
+    position and the compass corrects the yaw. Sensor callbacks run on different threads and share the state
+    under a lock. Every matrix is allocated once, an update only writes into existing arrays.
+    """
+
+    def __init__(
+        self,
+        reference,
+        acceleration_noise=0.5,
+        yaw_rate_noise=0.02,
+        gnss_noise=0.5,
+        compass_noise=0.05,
+    ):
+        self.reference = reference
+        self._lock = threading.Lock()
+        self.x = np.zeros(5)
+        self.P = np.eye(5) * 100.0
+        self._F = np.eye(5)
+        self._F_T = self._F.T
+        # Continuous process noise on the velocities and the yaw, scaled by the time step.
+        self._Q = np.diag([0.0, 0.0, acceleration_noise ** 2, acceleration_noise ** 2, yaw_rate_noise ** 2])
+        self._Q_dt = np.zeros((5, 5))
+        self._R = np.eye(2) * gnss_noise ** 2
+        self._compass_variance = compass_noise ** 2
+        self._FP = np.zeros((5, 5))
+        self._KHP = np.zeros((5, 5))
+        self._S = np.zeros((2, 2))
+        self._S_inv = np.zeros((2, 2))
+        self._K = np.zeros((5, 2))
+        self._innovation = np.zeros(2)
+        self._correction = np.zeros(5)
+        self._P_xy = self.P[:, :2]
+        self._P_top = self.P[:2, :]
+        self._P_xy_block = self.P[:2, :2]
+        self._P_yaw = self.P[:, 4]
+        self._P_yaw_row = self.P[4:5, :]
+        self._K_yaw = np.zeros(5)
+        self._K_yaw_column = self._K_yaw[:, None]
+        self._timestamp = None
+        self.initialized = False
+        self.imu_period = 0.0
+        self.predict_ms = _Timings()
+        self.update_ms = _Timings()
+
+    def predict(self, timestamp, forward_acceleration, left_acceleration, yaw_rate):
+        """Propagate the state to `timestamp` with body frame accelerations in m/s^2 and the yaw rate in rad/s."""
+        start = time.perf_counter()
+        with self._lock:
+            if self._timestamp is None or not self.initialized:
+                self._timestamp = timestamp
+                return
+            dt = timestamp - self._timestamp
+            self._timestamp = timestamp
+            if dt <= 0.0:
+                return
+            self.imu_period += 0.05 * (dt - self.imu_period)
+            x = self.x
+            cos_yaw, sin_yaw = math.cos(x[4]), math.sin(x[4])
+            east_acceleration = cos_yaw * forward_acceleration - sin_yaw * left_acceleration
+            north_acceleration = sin_yaw * forward_acceleration + cos_yaw * left_acceleration
+            # Derivatives of the world frame acceleration with respect to the yaw.
+            d_east = -sin_yaw * forward_acceleration - cos_yaw * left_acceleration
+            d_north = cos_yaw * forward_acceleration - sin_yaw * left_acceleration
+            half_dt2 = 0.5 * dt * dt
+            x[0] += x[2] * dt + east_acceleration * half_dt2
+            x[1] += x[3] * dt + north_acceleration * half_dt2
+            x[2] += east_acceleration * dt
+            x[3] += north_acceleration * dt
+            x[4] = math.remainder(x[4] + yaw_rate * dt, 2.0 * math.pi)
+
+            F = self._F
+            F[0, 2] = F[1, 3] = dt
+            F[0, 4] = d_east * half_dt2
+            F[1, 4] = d_north * half_dt2
+            F[2, 4] = d_east * dt
+            F[3, 4] = d_north * dt
+            np.matmul(F, self.P, out=self._FP)
+            np.matmul(self._FP, self._F_T, out=self.P)
+            np.multiply(self._Q, dt, out=self._Q_dt)
+            self.P += self._Q_dt
+        self.predict_ms.add(1e3 * (time.perf_counter() - start))
+
+    def update_gnss(self, latitude, longitude):
+        start = time.perf_counter()
+        east, north = self.reference.to_enu(latitude, longitude)
+        with self._lock:
+            if not self.initialized:
+                self.x[0], self.x[1] = east, north
+                self.P[0, 0] = self.P[1, 1] = self._R[0, 0]
+                self.initialized = True
+                return
+            # H selects the position, so H P H^T and P H^T are slices of P.
+            np.add(self._P_xy_block, self._R, out=self._S)
+            determinant = self._S[0, 0] * self._S[1, 1] - self._S[0, 1] * self._S[1, 0]
+            self._S_inv[0, 0] = self._S[1, 1] / determinant
+            self._S_inv[1, 1] = self._S[0, 0] / determinant
+            self._S_inv[0, 1] = -self._S[0, 1] / determinant
+            self._S_inv[1, 0] = -self._S[1, 0] / determinant
+            np.matmul(self._P_xy, self._S_inv, out=self._K)
+            self._innovation[0] = east - self.x[0]
+            self._innovation[1] = north - self.x[1]
+            np.matmul(self._K, self._innovation, out=self._correction)
+            self.x += self._correction
+            np.matmul(self._K, self._P_top, out=self._KHP)
+            self.P -= self._KHP
+        self.update_ms.add(1e3 * (time.perf_counter() - start))
+
+    def update_yaw(self, yaw):
+        """Correct the yaw with an absolute heading in radians, counterclockwise from east."""
+        start = time.perf_counter()
+        with self._lock:
+            if not self.initialized:
+                self.x[4] = yaw
+                self.P[4, 4] = self._compass_variance
+                return
+            innovation = math.remainder(yaw - self.x[4], 2.0 * math.pi)
+            np.divide(self._P_yaw, self.P[4, 4] + self._compass_variance, out=self._K_yaw)
+            np.multiply(self._K_yaw, innovation, out=self._correction)
+            self.x += self._correction
+            self.x[4] = math.remainder(self.x[4], 2.0 * math.pi)
+            np.multiply(self._K_yaw_column, self._P_yaw_row, out=self._KHP)
+            self.P -= self._KHP
+        self.update_ms.add(1e3 * (time.perf_counter() - start))
+
+    def pose(self):
+        """Return the filtered (x, y, yaw) in map coordinates, metres and degrees, None before the first fix."""
+        with self._lock:
+            if not self.initialized:
+                return None
+            return float(self.x[0]), -float(self.x[1]), -math.degrees(self.x[4])
+
+    def report(self):
+        """Return the p99 prediction and correction times in milliseconds and the IMU period in milliseconds."""
+        return self.predict_ms.percentile(99), self.update_ms.percentile(99), 1e3 * self.imu_period
@@ -0,0 +1,97 @@
+"""Waypoint index of a map for reference point and curvature lookups."""
+
+import logging
+import math
+import os
+import time
+
+import numpy as np
+
+from src.spatial import GridIndex
+from src.utils import cache_path, map_cache_key
+
+
+def wrap_angle(angle):
+    """Wrap angles in radians to [-pi, pi)."""
+    return (angle + np.pi) % (2.0 * np.pi) - np.pi
+
+
+class MapIndex:
+    """Waypoints generated at a fixed spacing with heading, curvature and lane width arrays.
+
+    The arrays are cached on disk, keyed by map name, OpenDRIVE hash and spacing.
+    """
+
+    FIELDS = ("xy", "z", "yaw", "curvature", "lane_width", "road_id", "lane_id")
+
+    def __init__(self, spacing, xy, z, yaw, curvature, lane_width, road_id, lane_id, cell_size=10.0):
+        self.spacing = spacing
+        self.xy = xy
+        self.z = z
+        self.yaw = yaw
+        self.curvature = curvature
+        self.lane_width = lane_width
+        self.road_id = road_id
+        self.lane_id = lane_id
+        self.grid = GridIndex(xy, cell_size)
+
+    def __len__(self):
+        return len(self.xy)
+
+    @classmethod
+    def build(cls, carla_map, spacing=2.0):
+        waypoints = carla_map.generate_waypoints(spacing)
+        n = len(waypoints)
+        xy = np.zeros((n, 2))
+        z = np.zeros(n)
+        yaw = np.zeros(n)
+        curvature = np.zeros(n)
+        lane_width = np.zeros(n, dtype=np.float32)
+        road_id = np.zeros(n, dtype=np.int32)
+        lane_id = np.zeros(n, dtype=np.int32)
+        for i, waypoint in enumerate(waypoints):
+            transform = waypoint.transform
+            xy[i] = transform.location.x, transform.location.y
+            z[i] = transform.location.z
+            yaw[i] = math.radians(transform.rotation.yaw)
+            lane_width[i] = waypoint.lane_width
+            road_id[i] = waypoint.road_id
+            lane_id[i] = waypoint.lane_id
+            successors = waypoint.next(spacing)
+            if successors:
+                following = successors[0].transform
+                distance = transform.location.distance(following.location)
+                if distance > 1e-3:
+                    curvature[i] = wrap_angle(math.radians(following.rotation.yaw) - yaw[i]) / distance
+        return cls(spacing, xy, z, yaw, curvature, lane_width, road_id, lane_id)
+
+    def save(self, path):
+        with open(path + ".tmp", "wb") as out:
+            np.savez(out, spacing=self.spacing, **{name: getattr(self, name) for name in self.FIELDS})
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(float(data["spacing"]), *(data[name] for name in cls.FIELDS))
+
+    @classmethod
+    def load_or_build(cls, carla_map, spacing=2.0):
+        path = cache_path("map_index", "%s-%.2f.npz" % (map_cache_key(carla_map), spacing))
+        start = time.time()
+        if os.path.exists(path):
+            index = cls.load(path)
+            logging.info("map index: loaded %d waypoints in %.3f s", len(index), time.time() - start)
+            return index
+        index = cls.build(carla_map, spacing)
+        index.save(path)
+        logging.info("map index: built %d waypoints in %.3f s (%s)", len(index), time.time() - start, path)
+        return index
+
+    def nearest(self, x, y):
+        """Return (index, distance) of the waypoint closest to (x, y)."""
+        return self.grid.nearest(x, y)
+
+    def within(self, x, y, radius):
+        """Return the indices of the waypoints within `radius` metres of (x, y)."""
+        return self.grid.query_radius(x, y, radius)
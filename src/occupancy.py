@@ -0,0 +1,107 @@
+"""Vehicle-centric rolling occupancy grid fused from radar sweeps."""
+
+import numpy as np
+
+
+class OccupancyGrid:
+    """Fixed-size log-odds occupancy and radial velocity grid centred on the ego vehicle.
+
+    Cells are world aligned and addressed modulo the grid size, so following the vehicle only clears the rows and
+    columns that scroll into view instead of shifting or reallocating the arrays.
+    """
+
+    def __init__(self, cells=256, resolution=0.5, hit=0.85, decay=0.9, limit=5.0):
+        self.cells = cells
+        self.resolution = resolution
+        self.hit = hit
+        self.decay = decay
+        self.limit = limit
+        self.log_odds = np.zeros((cells, cells), dtype=np.float32)
+        self.velocity = np.zeros((cells, cells), dtype=np.float32)
+        self.occupancy = np.zeros((cells, cells), dtype=np.float32)
+        self.center = None
+        self.frame = 0
+
+    def _global_cells(self, xy):
+        return np.floor(np.asarray(xy) / self.resolution).astype(np.int64)
+
+    def _clear(self, axis, old, new):
+        """Clear the slices of `axis` whose global index is in the new window but not in the old one."""
+        half = self.cells // 2
+        if abs(new - old) >= self.cells:
+            entered = range(self.cells)
+        elif new > old:
+            entered = range(old + self.cells - half, new + self.cells - half)
+        else:
+            entered = range(new - half, old - half)
+        rows = np.fromiter((index % self.cells for index in entered), dtype=np.int64)
+        for grid in (self.log_odds, self.velocity, self.occupancy):
+            if axis == 0:
+                grid[rows, :] = 0.0
+            else:
+                grid[:, rows] = 0.0
+
+    def recenter(self, x, y):
+        center = self._global_cells((x, y))
+        if self.center is None:
+            self.center = center
+            return
+        for axis in (0, 1):
+            if center[axis] != self.center[axis]:
+                self._clear(axis, self.center[axis], center[axis])
+        self.center = center
+
+    def _window(self, cells):
+        """Return (mask, storage indices) of the global cells inside the current window."""
+        half = self.cells // 2
+        offset = cells - self.center
+        mask = np.all((offset >= -half) & (offset < self.cells - half), axis=-1)
+        return mask, cells % self.cells
+
+    def fuse(self, xy, velocity, frame=0):
+        """Fuse world-frame detections of shape (N, 2) with their radial velocities."""
+        np.multiply(self.log_odds, self.decay, out=self.log_odds)
+        mask, index = self._window(self._global_cells(xy))
+        index = index[mask]
+        np.add.at(self.log_odds, (index[:, 0], index[:, 1]), self.hit)
+        np.clip(self.log_odds, 0.0, self.limit, out=self.log_odds)
+        self.velocity[index[:, 0], index[:, 1]] = np.asarray(velocity)[mask]
+        # Occupancy in [0, 1) with 0 for unobserved cells, tanh(l / 2) = 2 * sigmoid(l) - 1.
+        np.multiply(self.log_odds, 0.5, out=self.occupancy)
+        np.tanh(self.occupancy, out=self.occupancy)
+        self.frame = frame
+
+    def fuse_radar(self, points, sensor_matrix, frame=0):
+        """Fuse a radar sweep given as raw (N, 4) [velocity, altitude, azimuth, depth] and the sensor 4x4 matrix."""
+        velocity, altitude, azimuth, depth = points.T
+        horizontal = depth * np.cos(altitude)
+        local = np.stack((horizontal * np.cos(azimuth), horizontal * np.sin(azimuth), depth * np.sin(altitude)))
+        world = sensor_matrix[:3, :3] @ local + sensor_matrix[:3, 3:4]
+        self.recenter(sensor_matrix[0, 3], sensor_matrix[1, 3])
+        self.fuse(world[:2].T, velocity, frame)
+
+    def sample(self, xy):
+        """Return the occupancy at world points of shape (..., 2), unobserved and out of window points are 0."""
+        xy = np.asarray(xy)
+        if self.center is None:
+            return np.zeros(xy.shape[:-1], dtype=np.float32)
+        half = self.cells // 2
+        ix = np.floor(xy[..., 0] / self.resolution).astype(np.intp)
+        iy = np.floor(xy[..., 1] / self.resolution).astype(np.intp)
+        inside = (ix - (self.center[0] - half)).astype(np.uintp) < self.cells
+        inside &= (iy - (self.center[1] - half)).astype(np.uintp) < self.cells
+        ix %= self.cells
+        iy %= self.cells
+        ix *= self.cells
+        ix += iy
+        values = self.occupancy.ravel().take(ix)
+        values *= inside
+        return values
+
+    def cost(self, trajectories):
+        """Return the summed occupancy along each trajectory of shape (K, T, 2)."""
+        return self.sample(trajectories).sum(axis=-1)
+
+    def is_free(self, trajectories, threshold=0.5):
+        """Return whether the occupancy stays below `threshold` along each trajectory of shape (K, T, 2)."""
+        return ~np.any(self.sample(trajectories) >= threshold, axis=-1)
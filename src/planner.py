@@ -0,0 +1,211 @@
+"""Global route planning over the lane graph of a map."""
+
+import heapq
+import logging
+import math
+import os
+import pickle
+import time
+
+import numpy as np
+
+from src.spatial import GridIndex
+from src.utils import cache_path, map_cache_key
+
+
+def _pose(value):
+    """Return (location, yaw in degrees or None) of a carla.Location or carla.Transform."""
+    rotation = getattr(value, "rotation", None)
+    return getattr(value, "location", value), None if rotation is None else rotation.yaw
+
+
+def _pose_key(value):
+    location, yaw = _pose(value)
+    return ("%.1f" % location.x, "%.1f" % location.y) + (() if yaw is None else ("%.0f" % yaw,))
+
+
+class LaneGraph:
+    """Directed graph of the lane segments returned by `map.get_topology()`.
+
+    Every edge is one topology segment densified to `resolution` metres, stored as an (M, 3) array of x, y and yaw
+    in radians. Nodes are the segment end points, merged when they are closer than 10 cm.
+    """
+
+    def __init__(self, nodes, adjacency, edges, edge_nodes, resolution):
+        self.nodes = nodes
+        self.adjacency = adjacency
+        self.edges = edges
+        self.edge_nodes = edge_nodes
+        self.resolution = resolution
+        points = np.concatenate([edge[:, :2] for edge in edges]) if edges else np.empty((0, 2))
+        self._point_edge = np.repeat(np.arange(len(edges)), [len(edge) for edge in edges])
+        self._point_offset = np.concatenate([np.arange(len(edge)) for edge in edges]) if edges else np.empty(0)
+        self._grid = GridIndex(points)
+
+    @classmethod
+    def build(cls, carla_map, resolution=2.0):
+        merge = 0.1
+        # Node ids per cube of `merge` metres, a node closer than `merge` to a point is in a neighbouring cube.
+        cells = {}
+        positions = []
+        nodes = []
+
+        def node(location):
+            point = (location.x, location.y, location.z)
+            cell = tuple(int(math.floor(value / merge)) for value in point)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        for index in cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz), ()):
+                            if math.dist(positions[index], point) < merge:
+                                return index
+            cells.setdefault(cell, []).append(len(nodes))
+            positions.append(point)
+            nodes.append(point[:2])
+            return len(nodes) - 1
+
+        adjacency = {}
+        edges = []
+        edge_nodes = []
+        for entry, exit_ in carla_map.get_topology():
+            waypoints = [entry] + entry.next_until_lane_end(resolution)
+            points = np.array(
+                [
+                    (w.transform.location.x, w.transform.location.y, math.radians(w.transform.rotation.yaw))
+                    for w in waypoints
+                ]
+            )
+            start, end = node(entry.transform.location), node(exit_.transform.location)
+            length = float(np.sum(np.hypot(*np.diff(points[:, :2], axis=0).T))) if len(points) > 1 else 0.0
+            adjacency.setdefault(start, []).append((end, length, len(edges)))
+            edges.append(points)
+            edge_nodes.append((start, end))
+        return cls(np.array(nodes), adjacency, edges, edge_nodes, resolution)
+
+    def locate(self, location, yaw=None, radius=5.0):
+        """Return (edge, offset) of the densified point closest to `location`, None if the graph is empty.
+
+        With a `yaw` in degrees, the closest point within `radius` metres of the nearest one whose lane heads less
+        than 90 degrees away from `yaw` is preferred, so a two-way road does not snap to the opposite lane.
+        """
+        index, distance = self._grid.nearest(location.x, location.y)
+        if index < 0:
+            return None
+        if yaw is not None:
+            candidates = self._grid.query_radius(location.x, location.y, distance + radius)
+            headings = np.array(
+                [self.edges[self._point_edge[c]][int(self._point_offset[c]), 2] for c in candidates], dtype=float
+            )
+            aligned = candidates[np.cos(headings - math.radians(yaw)) > 0.0]
+            if len(aligned):
+                delta = self._grid.points[aligned] - (location.x, location.y)
+                index = int(aligned[np.argmin(np.einsum("ij,ij->i", delta, delta))])
+        return int(self._point_edge[index]), int(self._point_offset[index])
+
+    def shortest_path(self, source, target):
+        """A* from node `source` to node `target`, return the list of edges or None."""
+        goal = self.nodes[target]
+
+        def heuristic(n):
+            return math.hypot(self.nodes[n][0] - goal[0], self.nodes[n][1] - goal[1])
+
+        best = {source: 0.0}
+        came_from = {}
+        queue = [(heuristic(source), 0.0, source)]
+        while queue:
+            _, cost, current = heapq.heappop(queue)
+            if current == target:
+                path = []
+                while current in came_from:
+                    current, edge = came_from[current]
+                    path.append(edge)
+                return path[::-1]
+            if cost > best.get(current, math.inf):
+                continue
+            for following, length, edge in self.adjacency.get(current, ()):
+                new_cost = cost + length
+                if new_cost < best.get(following, math.inf):
+                    best[following] = new_cost
+                    came_from[following] = (current, edge)
+                    heapq.heappush(queue, (new_cost + heuristic(following), new_cost, following))
+        return None
+
+
+class RoutePlanner:
+    """Plans dense reference trajectories between two locations.
+
+    Lane graphs and routes are memoized in memory and on disk, keyed by map name, OpenDRIVE hash and resolution.
+    """
+
+    _graphs = {}
+    _routes = {}
+
+    def __init__(self, carla_map, resolution=2.0):
+        self.map_key = "%s-%.2f" % (map_cache_key(carla_map), resolution)
+        self.build_time = 0.0
+        self.plan_time = 0.0
+        start = time.time()
+        self.graph = self._graphs.get(self.map_key)
+        if self.graph is None:
+            path = cache_path("routes", self.map_key, "graph.pkl")
+            if os.path.exists(path):
+                with open(path, "rb") as cached:
+                    self.graph = pickle.load(cached)
+                logging.info("route planner: loaded lane graph in %.3f s", time.time() - start)
+            else:
+                self.graph = LaneGraph.build(carla_map, resolution)
+                with open(path + ".tmp", "wb") as out:
+                    pickle.dump(self.graph, out, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(path + ".tmp", path)
+                logging.info(
+                    "route planner: built lane graph of %d edges in %.3f s", len(self.graph.edges), time.time() - start
+                )
+            self._graphs[self.map_key] = self.graph
+        self.build_time = time.time() - start
+
+    def plan(self, origin, destination):
+        """Return an (N, 3) array of x, y and yaw from `origin` to `destination`, None if unreachable.
+
+        Both ends are locations or transforms, the lane of a transform must head the same way as its rotation.
+        """
+        start = time.time()
+        key = (self.map_key,) + _pose_key(origin) + _pose_key(destination)
+        route = self._routes.get(key)
+        source = "memory"
+        if route is None:
+            path = cache_path("routes", self.map_key, "%s.npy" % "_".join(key[1:]))
+            if os.path.exists(path):
+                route = np.load(path)
+                source = "disk"
+            else:
+                route = self._search(origin, destination)
+                source = "search"
+                if route is not None:
+                    np.save(path, route)
+            self._routes[key] = route
+        self.plan_time = time.time() - start
+        logging.info(
+            "route planner: %s route of %d points in %.2f ms (%s)",
+            "found" if route is not None else "no",
+            0 if route is None else len(route),
+            1e3 * self.plan_time,
+            source,
+        )
+        return route
+
+    def _search(self, origin, destination):
+        graph = self.graph
+        start = graph.locate(*_pose(origin))
+        goal = graph.locate(*_pose(destination))
+        if start is None or goal is None:
+            return None
+        (start_edge, start_offset), (goal_edge, goal_offset) = start, goal
+        if start_edge == goal_edge and start_offset <= goal_offset:
+            return graph.edges[start_edge][start_offset : goal_offset + 1]
+        edges = graph.shortest_path(graph.edge_nodes[start_edge][1], graph.edge_nodes[goal_edge][0])
+        if edges is None:
+            return None
+        pieces = [graph.edges[start_edge][start_offset:]]
+        pieces += [graph.edges[edge][1:] for edge in edges]
+        pieces.append(graph.edges[goal_edge][1 : goal_offset + 1])
+        return np.concatenate(pieces)
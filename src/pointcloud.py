@@ -0,0 +1,56 @@
+"""Vectorized point cloud processing for LiDAR sweeps."""
+
+import numpy as np
+
+
+def decode_lidar(raw_data):
+    """Return a zero-copy (N, 4) float32 view of x, y, z and intensity over a LiDAR measurement buffer."""
+    points = np.frombuffer(raw_data, dtype=np.dtype("f4"))
+    return np.reshape(points, (len(points) // 4, 4))
+
+
+def _voxel_inverse(xyz, voxel_size):
+    """Return (inverse, counts) grouping the points by voxel."""
+    cells = np.floor(xyz / voxel_size).astype(np.int64)
+    cells -= cells.min(axis=0)
+    extent = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * extent[1] + cells[:, 1]) * extent[2] + cells[:, 2]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    return inverse.reshape(-1), counts
+
+
+def voxel_downsample(points, voxel_size=0.2):
+    """Replace the points of every voxel by their centroid, intensity included."""
+    if len(points) == 0:
+        return points
+    inverse, counts = _voxel_inverse(points[:, :3], voxel_size)
+    result = np.empty((len(counts), points.shape[1]), dtype=points.dtype)
+    for column in range(points.shape[1]):
+        result[:, column] = np.bincount(inverse, weights=points[:, column], minlength=len(counts)) / counts
+    return result
+
+
+def remove_ground(points, cell_size=2.0, tolerance=0.2, max_ground_z=-1.5):
+    """Drop the points close to the lowest point of their column, when that point can be ground.
+
+    Heights are in the sensor frame, `max_ground_z` rejects columns whose lowest point is too high to be the road.
+    """
+    if len(points) == 0:
+        return points
+    inverse, counts = _voxel_inverse(np.column_stack((points[:, :2], np.zeros(len(points)))), cell_size)
+    lowest = np.full(len(counts), np.inf, dtype=points.dtype)
+    np.minimum.at(lowest, inverse, points[:, 2])
+    floor = lowest[inverse]
+    return points[(points[:, 2] > floor + tolerance) | (floor > max_ground_z)]
+
+
+def topdown_image(points, lidar_range, out):
+    """Draw the points seen from above into the preallocated (W, H, 3) uint8 array `out`."""
+    out.fill(0)
+    width, height = out.shape[:2]
+    xy = points[:, :2] * (min(width, height) / (2.0 * lidar_range))
+    xy += (0.5 * width, 0.5 * height)
+    xy = xy.astype(np.int32)
+    inside = (xy[:, 0] >= 0) & (xy[:, 0] < width) & (xy[:, 1] >= 0) & (xy[:, 1] < height)
+    out[xy[inside, 0], xy[inside, 1]] = 255
+    return out
@@ -0,0 +1,96 @@
+"""Named server performance profiles combining map layers and render settings."""
+
+import functools
+import glob
+import operator
+import os
+import sys
+import threading
+import time
+
+try:
+    sys.path.append(
+        glob.glob(
+            "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+            % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+        )[0]
+    )
+except IndexError:
+    pass
+
+import carla
+
+LAYERS = (
+    "Buildings",
+    "Decals",
+    "Foliage",
+    "Ground",
+    "ParkedVehicles",
+    "Particles",
+    "Props",
+    "StreetLights",
+    "Walls",
+)
+
+# Unloaded layers, rendering and fixed delta seconds (None keeps the current frame rate) of every profile. Roads,
+# sidewalks, traffic lights and signs are not layers and always stay loaded.
+PROFILES = {
+    "full": {"unload": (), "no_rendering": False, "delta": None},
+    "reduced": {"unload": ("Decals", "Foliage", "Particles", "StreetLights"), "no_rendering": False, "delta": None},
+    "sensor-minimal": {
+        "unload": ("Buildings", "Decals", "Foliage", "ParkedVehicles", "Particles", "Props", "StreetLights", "Walls"),
+        "no_rendering": False,
+        "delta": 0.05,
+    },
+    "control-only": {"unload": LAYERS, "no_rendering": True, "delta": 0.05},
+}
+
+
+def _layers(names):
+    return functools.reduce(operator.or_, [getattr(carla.MapLayer, name) for name in names], carla.MapLayer.NONE)
+
+
+def apply_profile(world, name):
+    """Apply the layers and settings of profile `name`, each in a single call."""
+    profile = PROFILES[name]
+    kept = [layer for layer in LAYERS if layer not in profile["unload"]]
+    if kept:
+        world.load_map_layer(_layers(kept))
+    if profile["unload"]:
+        world.unload_map_layer(_layers(profile["unload"]))
+    settings = world.get_settings()
+    settings.no_rendering_mode = profile["no_rendering"]
+    if profile["delta"] is not None:
+        settings.fixed_delta_seconds = profile["delta"]
+    world.apply_settings(settings)
+    return profile
+
+
+def measure_server_fps(world, seconds=3.0):
+    """Return (server FPS, simulated seconds per wall-clock second) measured over `seconds` of world ticks.
+
+    In synchronous mode the world is ticked by this function, otherwise the ticks are observed with `on_tick`.
+    """
+    ticks = []
+    lock = threading.Lock()
+
+    def on_tick(snapshot):
+        with lock:
+            ticks.append((time.time(), snapshot.timestamp.elapsed_seconds))
+
+    callback_id = world.on_tick(on_tick)
+    try:
+        end = time.time() + seconds
+        if world.get_settings().synchronous_mode:
+            while time.time() < end:
+                world.tick()
+        else:
+            time.sleep(seconds)
+    finally:
+        world.remove_on_tick(callback_id)
+    with lock:
+        if len(ticks) < 2:
+            return 0.0, 0.0
+        wall = max(ticks[-1][0] - ticks[0][0], 1e-9)
+        simulated = ticks[-1][1] - ticks[0][1]
+        return (len(ticks) - 1) / wall, simulated / wall
@@ -0,0 +1,168 @@
+"""Index of CARLA recorder files for instant replay seeking."""
+
+import bisect
+import json
+import logging
+import os
+import re
+import time
+
+from src.utils import cache_path
+
+_FRAME = re.compile(r"^Frame (\d+) at ([\d.eE+-]+) seconds")
+_CREATE = re.compile(r"^\s+Create (\d+): (\S+)")
+_DESTROY = re.compile(r"^\s+Destroy (\d+)")
+_COLLISION = re.compile(r"^\s*([\d.]+)\s+(\w)\s+(\w)\s+(\d+)\s+(\S+)\s+(\d+)\s*(\S*)")
+
+
+class RecordingIndex:
+    """Frame, time, actor and collision index of one recorder file.
+
+    The recorder is queried once through `show_recorder_file_info` and `show_recorder_collisions`, the parsed index
+    is cached as JSON next to the .rec file when it is on this machine, in the cache directory otherwise.
+    """
+
+    VERSION = 1
+
+    def __init__(self, name, map_name="", date="", frames=0, duration=0.0, events=None, collisions=None):
+        self.name = name
+        self.map_name = map_name
+        self.date = date
+        self.frames = frames
+        self.duration = duration
+        # (frame, time, "create" | "destroy", actor id, type id) in recording order.
+        self.events = events or []
+        # (time, type 1, id 1, actor 1, type 2, id 2, actor 2) sorted by time.
+        self.collisions = collisions or []
+        self.collision_times = [collision[0] for collision in self.collisions]
+
+    @classmethod
+    def parse(cls, name, info, collisions):
+        """Build the index from the text returned by the two recorder queries."""
+        index = cls(name)
+        frame, elapsed = 0, 0.0
+        for line in info.splitlines():
+            match = _FRAME.match(line)
+            if match:
+                frame, elapsed = int(match.group(1)), float(match.group(2))
+                continue
+            match = _CREATE.match(line)
+            if match:
+                index.events.append((frame, elapsed, "create", int(match.group(1)), match.group(2)))
+                continue
+            match = _DESTROY.match(line)
+            if match:
+                index.events.append((frame, elapsed, "destroy", int(match.group(1)), ""))
+                continue
+            index._parse_header(line)
+        for line in collisions.splitlines():
+            match = _COLLISION.match(line)
+            if match:
+                time_, type1, type2, id1, actor1, id2, actor2 = match.groups()
+                index.collisions.append((float(time_), type1, int(id1), actor1, type2, int(id2), actor2))
+        index.collisions.sort()
+        index.collision_times = [collision[0] for collision in index.collisions]
+        return index
+
+    def _parse_header(self, line):
+        key, _, value = line.partition(": ")
+        if key == "Map":
+            self.map_name = value.strip()
+        elif key == "Date":
+            self.date = value.strip()
+        elif key == "Frames":
+            self.frames = int(value)
+        elif key == "Duration":
+            self.duration = float(value.split()[0])
+
+    @staticmethod
+    def path(name):
+        if os.path.isfile(name):
+            return name + ".index.json"
+        return cache_path("recordings", os.path.basename(name) + ".index.json")
+
+    @staticmethod
+    def _source_stamp(name):
+        """Size and modification time of a local recording, None when the file is only on the server."""
+        if not os.path.isfile(name):
+            return None
+        stat = os.stat(name)
+        return [stat.st_size, stat.st_mtime]
+
+    def save(self):
+        data = {
+            "version": self.VERSION,
+            "source": self._source_stamp(self.name),
+            "name": self.name,
+            "map": self.map_name,
+            "date": self.date,
+            "frames": self.frames,
+            "duration": self.duration,
+            "events": self.events,
+            "collisions": self.collisions,
+        }
+        path = self.path(self.name)
+        with open(path + ".tmp", "w", encoding="utf-8") as out:
+            json.dump(data, out)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, name):
+        """Return the cached index of `name`, None when missing or stale."""
+        path = cls.path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as cached:
+            data = json.load(cached)
+        if data.get("version") != cls.VERSION or data.get("source") != cls._source_stamp(name):
+            return None
+        return cls(
+            name,
+            data["map"],
+            data["date"],
+            data["frames"],
+            data["duration"],
+            [tuple(event) for event in data["events"]],
+            [tuple(collision) for collision in data["collisions"]],
+        )
+
+    @classmethod
+    def load_or_build(cls, client, name):
+        start = time.time()
+        index = cls.load(name)
+        if index is not None:
+            logging.info("recording index: loaded %s in %.3f s", name, time.time() - start)
+            return index
+        info = client.show_recorder_file_info(name, False)
+        collisions = client.show_recorder_collisions(name, "a", "a")
+        index = cls.parse(name, info, collisions)
+        index.save()
+        logging.info(
+            "recording index: indexed %s (%d frames, %d events, %d collisions) in %.3f s",
+            name,
+            index.frames,
+            len(index.events),
+            len(index.collisions),
+            time.time() - start,
+        )
+        return index
+
+    @classmethod
+    def invalidate(cls, name):
+        """Drop the cached index of a recording that is being overwritten."""
+        path = cls.path(name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def next_collision(self, after):
+        """Return the time of the first collision strictly after `after` seconds, None if there is none."""
+        position = bisect.bisect_right(self.collision_times, after)
+        return self.collision_times[position] if position < len(self.collision_times) else None
+
+    def previous_collision(self, before):
+        """Return the time of the last collision strictly before `before` seconds, None if there is none."""
+        position = bisect.bisect_left(self.collision_times, before)
+        return self.collision_times[position - 1] if position > 0 else None
+
+    def clamp(self, seconds):
+        return max(0.0, min(seconds, self.duration)) if self.duration else max(0.0, seconds)
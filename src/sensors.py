@@ -3,8 +3,11 @@ import glob
 import math
 import os
 import sys
+import time
 import weakref
 
+import numpy as np
+
 sys.path.append(
     glob.glob(
         "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
@@ -14,6 +17,7 @@ sys.path.append(
 
 import carla
 
+from src.pointcloud import decode_lidar, remove_ground, topdown_image, voxel_downsample
 from src.utils import get_actor_display_name
 
 
@@ -32,6 +36,7 @@ class CollisionSensor:
         self.sensor.listen(lambda event: CollisionSensor._on_collision(weak_self, event))
 
     def get_collision_history(self):
+        self.hud.latency.consumed("Collision")
         history = collections.defaultdict(int)
         for frame, intensity in self.history:
             history[frame] += intensity
@@ -42,6 +47,7 @@ class CollisionSensor:
         self = weak_self()
         if not self:
             return
+        self.hud.latency.arrived("Collision", event.frame)
         actor_type = get_actor_display_name(event.other_actor)
         self.hud.notification("Collision with %r" % actor_type)
         impulse = event.normal_impulse
@@ -69,15 +75,19 @@ class LaneInvasionSensor:
         self = weak_self()
         if not self:
             return
+        self.hud.latency.arrived("Lane invasion", event.frame)
+        self.hud.latency.consumed("Lane invasion")
         lane_types = set(x.type for x in event.crossed_lane_markings)
         text = ["%r" % str(x).split()[-1] for x in lane_types]
         self.hud.notification("Crossed line %s" % " and ".join(text))
 
 
 class GnssSensor:
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, latency=None, localizer=None):
         self.sensor = None
         self._parent = parent_actor
+        self._latency = latency
+        self._localizer = localizer
         self.lat = 0.0
         self.lon = 0.0
         world = self._parent.get_world()
@@ -95,12 +105,18 @@ class GnssSensor:
             return
         self.lat = event.latitude
         self.lon = event.longitude
+        if self._localizer is not None:
+            self._localizer.update_gnss(event.latitude, event.longitude)
+        if self._latency is not None:
+            self._latency.arrived("GNSS", event.frame)
 
 
 class IMUSensor:
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, latency=None, localizer=None):
         self.sensor = None
         self._parent = parent_actor
+        self._latency = latency
+        self._localizer = localizer
         self.accelerometer = (0.0, 0.0, 0.0)
         self.gyroscope = (0.0, 0.0, 0.0)
         self.compass = 0.0
@@ -129,18 +145,32 @@ class IMUSensor:
             max(limits[0], min(limits[1], math.degrees(sensor_data.gyroscope.z))),
         )
         self.compass = math.degrees(sensor_data.compass)
+        if self._localizer is not None:
+            # CARLA axes are left-handed with y to the right, the compass is clockwise from north.
+            self._localizer.predict(
+                sensor_data.timestamp,
+                sensor_data.accelerometer.x,
+                -sensor_data.accelerometer.y,
+                -sensor_data.gyroscope.z,
+            )
+            self._localizer.update_yaw(math.pi / 2.0 - sensor_data.compass)
+        if self._latency is not None:
+            self._latency.arrived("IMU", sensor_data.frame)
 
 
 class RadarSensor:
-    def __init__(self, parent_actor):
+    def __init__(self, parent_actor, latency=None, occupancy=None, sensor_tick=0.0):
         self.sensor = None
         self._parent = parent_actor
+        self._latency = latency
+        self.occupancy = occupancy
         self.velocity_range = 7.5  # m/s
         world = self._parent.get_world()
         self.debug = world.debug
         bp = world.get_blueprint_library().find("sensor.other.radar")
         bp.set_attribute("horizontal_fov", str(35))
         bp.set_attribute("vertical_fov", str(20))
+        bp.set_attribute("sensor_tick", str(sensor_tick))
         self.sensor = world.spawn_actor(
             bp, carla.Transform(carla.Location(x=2.8, z=1.0), carla.Rotation(pitch=5)), attach_to=self._parent
         )
@@ -153,9 +183,13 @@ class RadarSensor:
         self = weak_self()
         if not self:
             return
-        # To get a numpy [[vel, altitude, azimuth, depth],...[,,,]]:
-        # points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4'))
-        # points = np.reshape(points, (len(radar_data), 4))
+        if self._latency is not None:
+            self._latency.arrived("Radar", radar_data.frame)
+        if self.occupancy is not None:
+            # [[vel, altitude, azimuth, depth],...[,,,]]
+            points = np.frombuffer(radar_data.raw_data, dtype=np.dtype("f4"))
+            points = np.reshape(points, (len(radar_data), 4))
+            self.occupancy.fuse_radar(points, np.array(radar_data.transform.get_matrix()), radar_data.frame)
 
         current_rot = radar_data.transform.rotation
         for detect in radar_data:
@@ -183,3 +217,52 @@ class RadarSensor:
                 persistent_lines=False,
                 color=carla.Color(r, g, b),
             )
+        if self._latency is not None:
+            self._latency.consumed("Radar")
+
+
+class LidarSensor:
+    def __init__(self, parent_actor, latency=None, lidar_range=50.0, channels=32, voxel_size=0.2, sensor_tick=0.0):
+        self.sensor = None
+        self._parent = parent_actor
+        self._latency = latency
+        self.lidar_range = lidar_range
+        self.voxel_size = voxel_size
+        self.points = np.empty((0, 4), dtype=np.float32)
+        self.obstacles = self.points
+        # Per sweep processing cost in milliseconds.
+        self.process_ms = collections.deque(maxlen=100)
+        # Preallocated top-down image, drawn only while a CameraManager displays it.
+        self.image = None
+        self.image_frame = 0
+        world = self._parent.get_world()
+        bp = world.get_blueprint_library().find("sensor.lidar.ray_cast")
+        bp.set_attribute("range", str(lidar_range))
+        bp.set_attribute("channels", str(channels))
+        bp.set_attribute("points_per_second", str(channels * 18000))
+        bp.set_attribute("rotation_frequency", "20")
+        bp.set_attribute("sensor_tick", str(sensor_tick))
+        self.sensor = world.spawn_actor(bp, carla.Transform(carla.Location(z=2.4)), attach_to=self._parent)
+        # We need a weak reference to self to avoid circular reference.
+        weak_self = weakref.ref(self)
+        self.sensor.listen(lambda lidar_data: LidarSensor._Lidar_callback(weak_self, lidar_data))
+
+    def set_image_size(self, dim):
+        self.image = None if dim is None else np.zeros((dim[0], dim[1], 3), dtype=np.uint8)
+
+    @staticmethod
+    def _Lidar_callback(weak_self, lidar_data):
+        self = weak_self()
+        if not self:
+            return
+        if self._latency is not None:
+            self._latency.arrived("LiDAR", lidar_data.frame)
+        start = time.perf_counter()
+        points = decode_lidar(lidar_data.raw_data)
+        self.obstacles = remove_ground(voxel_downsample(points, self.voxel_size))
+        self.points = points
+        image = self.image
+        if image is not None:
+            topdown_image(points, self.lidar_range, image)
+            self.image_frame = lidar_data.frame
+        self.process_ms.append(1e3 * (time.perf_counter() - start))
@@ -0,0 +1,82 @@
+"""Uniform grid index over 2D points."""
+
+import math
+
+import numpy as np
+
+
+class GridIndex:
+    """Static uniform grid over an (N, 2) array of points.
+
+    Points are sorted by cell once, every cell is then a contiguous slice of `order`, so a query only touches the
+    cells overlapping the search area.
+    """
+
+    def __init__(self, points, cell_size=10.0):
+        self.points = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2)
+        self.cell_size = float(cell_size)
+        if len(self.points):
+            self.origin = self.points.min(axis=0) - self.cell_size
+            extent = self.points.max(axis=0) + self.cell_size - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.full(2, self.cell_size)
+        self.shape = (int(extent[0] // self.cell_size) + 1, int(extent[1] // self.cell_size) + 1)
+        cells = ((self.points - self.origin) // self.cell_size).astype(np.int64)
+        keys = cells[:, 0] * self.shape[1] + cells[:, 1]
+        self.order = np.argsort(keys, kind="stable")
+        self.starts = np.searchsorted(keys[self.order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def _cell(self, x, y):
+        return int((x - self.origin[0]) // self.cell_size), int((y - self.origin[1]) // self.cell_size)
+
+    def _gather(self, ix0, ix1, iy0, iy1):
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, self.shape[0] - 1), min(iy1, self.shape[1] - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.empty(0, dtype=np.int64)
+        chunks = []
+        for ix in range(ix0, ix1 + 1):
+            row = ix * self.shape[1]
+            start, stop = self.starts[row + iy0], self.starts[row + iy1 + 1]
+            if stop > start:
+                chunks.append(self.order[start:stop])
+        if not chunks:
+            return np.empty(0, dtype=np.int64)
+        return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+    def query_box(self, x0, y0, x1, y1):
+        """Return the indices of the points in the cells overlapping the box, a superset of the points inside."""
+        ix0, iy0 = self._cell(x0, y0)
+        ix1, iy1 = self._cell(x1, y1)
+        return self._gather(ix0, ix1, iy0, iy1)
+
+    def query_radius(self, x, y, radius):
+        """Return the indices of the points within `radius` of (x, y)."""
+        ix0, iy0 = self._cell(x - radius, y - radius)
+        ix1, iy1 = self._cell(x + radius, y + radius)
+        candidates = self._gather(ix0, ix1, iy0, iy1)
+        delta = self.points[candidates] - (x, y)
+        return candidates[np.einsum("ij,ij->i", delta, delta) <= radius * radius]
+
+    def nearest(self, x, y):
+        """Return (index, distance) of the point closest to (x, y), (-1, inf) if the index is empty."""
+        if not len(self.points):
+            return -1, math.inf
+        cx, cy = self._cell(x, y)
+        ring = 0
+        best, best_d2 = -1, math.inf
+        max_ring = max(self.shape) + max(abs(cx), abs(cy), abs(cx - self.shape[0]), abs(cy - self.shape[1]))
+        while ring <= max_ring:
+            candidates = self._gather(cx - ring, cx + ring, cy - ring, cy + ring)
+            if len(candidates):
+                delta = self.points[candidates] - (x, y)
+                d2 = np.einsum("ij,ij->i", delta, delta)
+                i = int(np.argmin(d2))
+                if d2[i] < best_d2:
+                    best, best_d2 = int(candidates[i]), float(d2[i])
+            # Every point outside the searched rings is at least `ring` cells away.
+            if best >= 0 and best_d2 <= (ring * self.cell_size) ** 2:
+                break
+            ring += 1
+        return best, math.sqrt(best_d2)
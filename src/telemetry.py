@@ -0,0 +1,43 @@
+"""Telemetry output for offline analysis."""
+
+import json
+import time
+
+
+class Telemetry:
+    """Append-only NDJSON telemetry stream, rate limited to one record per kind and interval.
+
+    The file is open while the writer is used as a context manager.
+    """
+
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self._file = None
+        self._interval = interval
+        self._last = {}
+
+    def write(self, kind, payload, frame=None):
+        record = {"time": round(time.time(), 3), "kind": kind, "frame": frame}
+        record.update(payload)
+        self._file.write(json.dumps(record) + "\n")
+
+    def tick(self, kind, payload_fn, frame=None):
+        """Write the record built by payload_fn if the interval for this kind has elapsed."""
+        now = time.time()
+        if now - self._last.get(kind, 0.0) < self._interval:
+            return
+        self._last[kind] = now
+        self.write(kind, payload_fn(), frame)
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,266 @@
+"""Background vehicle and walker traffic for load testing."""
+
+import glob
+import logging
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import carla
+
+
+class Traffic:
+    """Autopilot vehicles and AI walkers, spawned and destroyed with batched commands.
+
+    Vehicles and walkers are spawned by one `apply_batch_sync` call that also hands the vehicles to the traffic
+    manager, the walker controllers need the walker ids and follow in a second one.
+    """
+
+    # Blueprint lists per world id, filtering the library is slow and its content never changes.
+    _blueprints = {}
+
+    def __init__(self, client, world, port=8000, seed=None):
+        self.client = client
+        self.world = world
+        self.traffic_manager = client.get_trafficmanager(port)
+        self.port = self.traffic_manager.get_port()
+        self._random = random.Random(seed)
+        if seed is not None:
+            self.traffic_manager.set_random_device_seed(seed)
+        self.vehicles = []
+        # Parallel lists, the controller of walkers[i] is controllers[i].
+        self.walkers = []
+        self.controllers = []
+        self._spawn_points = None
+        self._used = {}
+
+    def blueprints(self, pattern):
+        key = (self.world.id, pattern)
+        blueprints = self._blueprints.get(key)
+        if blueprints is None:
+            blueprints = list(self.world.get_blueprint_library().filter(pattern))
+            if pattern.startswith("vehicle"):
+                blueprints = [bp for bp in blueprints if int(bp.get_attribute("number_of_wheels")) == 4]
+            self._blueprints[key] = blueprints
+        return blueprints
+
+    def _free_spawn_points(self, exclude, radius):
+        if self._spawn_points is None:
+            self._spawn_points = self.world.get_map().get_spawn_points()
+        used = set(self._used.values())
+        points = []
+        for index, transform in enumerate(self._spawn_points):
+            if index in used:
+                continue
+            if any(transform.location.distance(location) < radius for location in exclude):
+                continue
+            points.append((index, transform))
+        self._random.shuffle(points)
+        return points
+
+    def spawn(self, vehicles=0, walkers=0, exclude=(), radius=10.0):
+        """Add up to `vehicles` vehicles and `walkers` walkers, away from the `exclude` locations."""
+        start = time.time()
+        points = self._free_spawn_points(exclude, radius)[:vehicles]
+        if len(points) < vehicles:
+            logging.warning("traffic: only %d free spawn points for %d vehicles", len(points), vehicles)
+        vehicle_blueprints = self.blueprints("vehicle.*")
+        walker_blueprints = self.blueprints("walker.pedestrian.*")
+        batch = []
+        for _, transform in points:
+            blueprint = self._random.choice(vehicle_blueprints)
+            if blueprint.has_attribute("color"):
+                blueprint.set_attribute(
+                    "color", self._random.choice(blueprint.get_attribute("color").recommended_values)
+                )
+            blueprint.set_attribute("role_name", "autopilot")
+            batch.append(
+                carla.command.SpawnActor(blueprint, transform).then(
+                    carla.command.SetAutopilot(carla.command.FutureActor, True, self.port)
+                )
+            )
+        walker_speeds = []
+        for _ in range(walkers):
+            location = self.world.get_random_location_from_navigation()
+            if location is None:
+                continue
+            blueprint = self._random.choice(walker_blueprints)
+            if blueprint.has_attribute("is_invincible"):
+                blueprint.set_attribute("is_invincible", "false")
+            speeds = blueprint.get_attribute("speed").recommended_values if blueprint.has_attribute("speed") else []
+            walker_speeds.append(float(speeds[1]) if len(speeds) > 1 else 1.4)
+            batch.append(carla.command.SpawnActor(blueprint, carla.Transform(location)))
+        responses = self.client.apply_batch_sync(batch, False)
+
+        for (index, _), response in zip(points, responses[: len(points)]):
+            if not response.error:
+                self.vehicles.append(response.actor_id)
+                self._used[response.actor_id] = index
+        walker_ids, speeds = [], []
+        for speed, response in zip(walker_speeds, responses[len(points) :]):
+            if not response.error:
+                walker_ids.append(response.actor_id)
+                speeds.append(speed)
+        if walker_ids:
+            self._start_walkers(walker_ids, speeds)
+        failed = sum(1 for response in responses if response.error)
+        logging.info(
+            "traffic: %d vehicles and %d walkers after spawning for %.2f s (%d failed)",
+            len(self.vehicles),
+            len(self.walkers),
+            time.time() - start,
+            failed,
+        )
+
+    def _start_walkers(self, walker_ids, speeds):
+        blueprint = self.world.get_blueprint_library().find("controller.ai.walker")
+        responses = self.client.apply_batch_sync(
+            [carla.command.SpawnActor(blueprint, carla.Transform(), walker_id) for walker_id in walker_ids], False
+        )
+        spawned, orphans = [], []
+        for walker_id, speed, response in zip(walker_ids, speeds, responses):
+            if response.error:
+                orphans.append(walker_id)
+            else:
+                spawned.append((walker_id, response.actor_id, speed))
+        if orphans:
+            self.client.apply_batch([carla.command.DestroyActor(walker_id) for walker_id in orphans])
+        if not spawned:
+            return
+        # The controllers only navigate after the server has ticked with them, as in CARLA's traffic generator.
+        if self.world.get_settings().synchronous_mode:
+            self.world.tick()
+        else:
+            self.world.wait_for_tick()
+        controllers = self.world.get_actors([controller_id for _, controller_id, _ in spawned])
+        by_id = {controller.id: controller for controller in controllers}
+        for walker_id, controller_id, speed in spawned:
+            # Walker controllers have no batch command, they are started one by one.
+            controller = by_id[controller_id]
+            controller.start()
+            controller.go_to_location(self.world.get_random_location_from_navigation())
+            controller.set_max_speed(speed)
+            self.walkers.append(walker_id)
+            self.controllers.append(controller)
+
+    def remove(self, vehicles=0, walkers=0):
+        """Destroy the `vehicles` and `walkers` most recently spawned, in one batch."""
+        removed_vehicles = self.vehicles[len(self.vehicles) - vehicles :] if vehicles else []
+        removed_walkers = self.walkers[len(self.walkers) - walkers :] if walkers else []
+        removed_controllers = self.controllers[len(self.controllers) - walkers :] if walkers else []
+        for controller in removed_controllers:
+            controller.stop()
+        ids = removed_vehicles + removed_walkers + [controller.id for controller in removed_controllers]
+        if ids:
+            self.client.apply_batch([carla.command.DestroyActor(actor_id) for actor_id in ids])
+        for actor_id in removed_vehicles:
+            del self._used[actor_id]
+        del self.vehicles[len(self.vehicles) - len(removed_vehicles) :]
+        del self.walkers[len(self.walkers) - len(removed_walkers) :]
+        del self.controllers[len(self.controllers) - len(removed_controllers) :]
+
+    def resize(self, vehicles, walkers, exclude=()):
+        """Spawn or destroy actors to reach `vehicles` vehicles and `walkers` walkers."""
+        self.remove(max(0, len(self.vehicles) - vehicles), max(0, len(self.walkers) - walkers))
+        missing_vehicles = max(0, vehicles - len(self.vehicles))
+        missing_walkers = max(0, walkers - len(self.walkers))
+        if missing_vehicles or missing_walkers:
+            self.spawn(missing_vehicles, missing_walkers, exclude)
+
+    def destroy(self):
+        self.remove(len(self.vehicles), len(self.walkers))
+
+    def __len__(self):
+        return len(self.vehicles) + len(self.walkers)
+
+
+class TrafficRamp:
+    """Steps the traffic through actor counts and measures the client frame time and server FPS at each.
+
+    Each level runs for `seconds`, the first `warmup` seconds after spawning are not measured. The client frame
+    time is the raw pygame frame time, without the frame rate limit, so it shows the cost of control and HUD.
+    Vehicles spawn away from the `exclude` locations and from the locations passed to each `tick`.
+    """
+
+    def __init__(self, traffic, counts, seconds=10.0, walker_share=0.3, warmup=2.0, exclude=()):
+        if seconds <= warmup:
+            raise ValueError("ramp steps of %.1f s leave nothing to measure after %.1f s of warmup" % (seconds, warmup))
+        self.traffic = traffic
+        self.levels = [(int(round(n * (1.0 - walker_share))), int(round(n * walker_share))) for n in counts]
+        self.seconds = seconds
+        self.warmup = warmup
+        self.exclude = list(exclude)
+        self.results = []
+        self._level = -1
+        self._level_start = None
+        self._frame_times = []
+        self._server_fps = []
+
+    @property
+    def done(self):
+        return self._level >= len(self.levels)
+
+    def tick(self, clock, server_fps, exclude=()):
+        if self.done:
+            return
+        now = time.time()
+        if self._level_start is None or now - self._level_start >= self.seconds:
+            if self._level >= 0:
+                self._record()
+            self._level += 1
+            if self.done:
+                self.report()
+                return
+            self.traffic.resize(*self.levels[self._level], exclude=self.exclude + list(exclude))
+            # Spawning blocks the client, the level starts once the actors exist.
+            self._level_start = time.time()
+            self._frame_times, self._server_fps = [], []
+            return
+        if now - self._level_start >= self.warmup:
+            self._frame_times.append(clock.get_rawtime())
+            if server_fps > 0:
+                self._server_fps.append(server_fps)
+
+    def _record(self):
+        vehicles, walkers = self.levels[self._level]
+        # Levels without samples report NaN rather than a measured-looking zero.
+        frame_times = np.array(self._frame_times, dtype=float) if self._frame_times else np.full(1, np.nan)
+        result = {
+            "vehicles": len(self.traffic.vehicles),
+            "walkers": len(self.traffic.walkers),
+            "requested": vehicles + walkers,
+            "frame_ms": float(frame_times.mean()),
+            "frame_p95_ms": float(np.percentile(frame_times, 95)),
+            "server_fps": float(np.mean(self._server_fps)) if self._server_fps else float("nan"),
+        }
+        self.results.append(result)
+        logging.info(
+            "traffic ramp: %(vehicles)d vehicles, %(walkers)d walkers: client frame %(frame_ms).1f ms "
+            "(p95 %(frame_p95_ms).1f ms), server %(server_fps).1f FPS",
+            result,
+        )
+
+    def report(self):
+        lines = ["traffic ramp results:", "  vehicles  walkers  frame ms  p95 ms  server FPS"]
+        for result in self.results:
+            lines.append(
+                "  % 8d % 8d % 9.1f % 7.1f % 11.1f"
+                % (
+                    result["vehicles"],
+                    result["walkers"],
+                    result["frame_ms"],
+                    result["frame_p95_ms"],
+                    result["server_fps"],
+                )
+            )
+        logging.info("\n".join(lines))
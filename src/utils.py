@@ -1,6 +1,37 @@
 """Utility method for Carla."""
 
+import hashlib
+import os
+
+CACHE_DIR = os.environ.get("MPC_BLACK_ICE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mpc_black_ice"))
+
 
 def get_actor_display_name(actor, truncate=250):
     name = " ".join(actor.type_id.replace("_", ".").title().split(".")[1:])
     return (name[: truncate - 1] + u"\u2026") if len(name) > truncate else name
+
+
+def get_actor_category(actor):
+    """Category of an actor, the first part of its type id ("vehicle", "walker", "traffic", ...)."""
+    return actor.type_id.split(".", 1)[0]
+
+
+def get_actor_categories(world, actor_ids):
+    """Return {actor id: category} in one request, None for the ids the server did not return."""
+    categories = dict.fromkeys(actor_ids)
+    for actor in world.get_actors(list(actor_ids)):
+        categories[actor.id] = get_actor_category(actor)
+    return categories
+
+
+def cache_path(*parts):
+    """Return a path below the on-disk cache directory, creating its parent directory."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def map_cache_key(carla_map):
+    """Key identifying a map by name and the hash of its OpenDRIVE description."""
+    digest = hashlib.sha1(carla_map.to_opendrive().encode("utf-8")).hexdigest()[:16]
+    return "%s-%s" % (carla_map.name.split("/")[-1], digest)
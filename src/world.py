@@ -11,12 +11,25 @@ sys.path.append(
 
 import carla
 
+from src.actor_index import ActorIndex
 from src.camera import CameraManager
-from src.sensors import CollisionSensor, GnssSensor, IMUSensor, LaneInvasionSensor, RadarSensor
+from src.dynamics import DynamicsTables, VehicleParameters
+from src.friction import PhysicsTemplate
+from src.localization import GeoReference, Localizer
+from src.map_index import MapIndex
+from src.occupancy import OccupancyGrid
+from src.planner import RoutePlanner
+from src.recording import RecordingIndex
+from src.sensors import CollisionSensor, GnssSensor, IMUSensor, LaneInvasionSensor, LidarSensor, RadarSensor
 from src.utils import get_actor_display_name
 
 
 class World:
+    SPAWN_POINT = carla.Transform(carla.Location(x=12.0, y=-240.0, z=0.3), carla.Rotation(yaw=21.7))
+    GOAL = carla.Location(x=67.5, y=0.0)
+    # Seconds of replay shown before a collision the replay start was moved to.
+    REPLAY_LEAD = 2.0
+
     def __init__(self, carla_world, hud, args):
         self.world = carla_world
         self.actor_role_name = args.rolename
@@ -27,6 +40,9 @@ class World:
             print("  The server could not send the OpenDRIVE (.xodr) file:")
             print("  Make sure it exists, has the same name of your town, and is correct.")
             sys.exit(1)
+        self.map_index = MapIndex.load_or_build(self.map, args.waypoint_spacing)
+        self.planner = RoutePlanner(self.map, args.waypoint_spacing)
+        self.route = self.planner.plan(self.SPAWN_POINT, self.GOAL)
         self.hud = hud
         self.player = None
         self.collision_sensor = None
@@ -34,13 +50,31 @@ class World:
         self.gnss_sensor = None
         self.imu_sensor = None
         self.radar_sensor = None
+        self.lidar_sensor = None
+        self.localizer = None
+        self.vehicle_parameters = None
+        self.dynamics = None
         self.camera_manager = None
+        # Background traffic, set by the agent when requested and destroyed with the world.
+        self.traffic = None
         self._actor_filter = args.filter
         self._gamma = args.gamma
+        self.render_scale = args.render_scale
+        # Display sensors only, IMU and GNSS always run at the server rate. 0.0 ticks every server frame.
+        self.sensor_ticks = {"camera": 0.0, "radar": 0.0, "lidar": 0.0}
+        self._camera_pool = args.camera_pool
+        self._tire_friction = args.tire_friction
+        self._wheel_damping = args.wheel_damping
+        self.actor_index = ActorIndex(self.world)
+        self.occupancy = OccupancyGrid()
         self.restart()
         self.world.on_tick(hud.on_world_tick)
+        self.world.on_tick(self.actor_index.on_world_snapshot)
         self.recording_enabled = False
+        self.recording_name = args.recording
         self.recording_start = 0
+        self.recording_collision = None
+        self._recording_index = None
         self.constant_velocity_enabled = False
         self.current_map_layer = 0
         self.map_layer_names = [
@@ -61,49 +95,42 @@ class World:
         self.player_max_speed = 1.589
         self.player_max_speed_fast = 3.713
         # Keep same camera config if the camera manager exists.
+        cam_index = self.camera_manager.index if self.camera_manager is not None else 0
+        cam_index = cam_index if cam_index is not None else 0
         cam_pos_index = self.camera_manager.transform_index if self.camera_manager is not None else 0
 
         blueprint_library = self.world.get_blueprint_library()
         blueprint = blueprint_library.filter("model3")[0]
 
-        spawn_point = carla.Transform()
-        spawn_point.location.x = 12.0
-        spawn_point.location.y = -240.0
-        spawn_point.location.z = 0.3
-        spawn_point.rotation.yaw = 21.7
-        # Goal: (67.5, 0.0)
-
         # Spawn the player.
         if self.player is not None:
-            self.destroy()
-        self.player = self.world.try_spawn_actor(blueprint, spawn_point)
-
-        # # Set up wheel physics
-        # front_left_wheel  = carla.WheelPhysicsControl(
-        #     tire_friction=5.1, damping_rate=1.0, max_steer_angle=70.0, radius=30.0
-        # )
-        # front_right_wheel = carla.WheelPhysicsControl(
-        #     tire_friction=5.1, damping_rate=1.5, max_steer_angle=70.0, radius=30.0
-        # )
-        # rear_left_wheel   = carla.WheelPhysicsControl(
-        #     tire_friction=5.1, damping_rate=0.2, max_steer_angle=0.0,  radius=30.0
-        # )
-        # rear_right_wheel  = carla.WheelPhysicsControl(
-        #     tire_friction=5.1, damping_rate=1.3, max_steer_angle=0.0,  radius=30.0
-        # )
-        # wheels = [front_left_wheel, front_right_wheel, rear_left_wheel, rear_right_wheel]
-        # physics_control = self.player.get_physics_control()
-        # physics_control.wheels = wheels
-        # self.player.apply_physics_control(physics_control)
+            self.destroy(traffic=False)
+        self.player = self.world.try_spawn_actor(blueprint, self.SPAWN_POINT)
+        self.actor_index.ego_id = self.player.id
+        # Ice conditions, applied from the cached physics control of the vehicle type.
+        if self._tire_friction is not None or self._wheel_damping is not None:
+            PhysicsTemplate.for_vehicle(self.player).apply(self.player, self._tire_friction, self._wheel_damping)
+        # Linearized dynamics for the MPC, built once per vehicle physics and cached on disk.
+        self.vehicle_parameters = VehicleParameters.from_actor(self.player)
+        self.dynamics = DynamicsTables.load_or_build(self.vehicle_parameters)
 
         # Set up the sensors.
         self.collision_sensor = CollisionSensor(self.player, self.hud)
         self.lane_invasion_sensor = LaneInvasionSensor(self.player, self.hud)
-        self.gnss_sensor = GnssSensor(self.player)
-        self.imu_sensor = IMUSensor(self.player)
-        self.camera_manager = CameraManager(self.player, self.hud, self._gamma)
+        self.localizer = Localizer(GeoReference.from_map(self.map))
+        self.gnss_sensor = GnssSensor(self.player, self.hud.latency, self.localizer)
+        self.imu_sensor = IMUSensor(self.player, self.hud.latency, self.localizer)
+        self.camera_manager = CameraManager(
+            self.player,
+            self.hud,
+            self._gamma,
+            self.render_scale,
+            pool_size=self._camera_pool,
+            sensor_tick=self.sensor_ticks["camera"],
+        )
         self.camera_manager.transform_index = cam_pos_index
-        self.camera_manager.set_sensor()
+        self.camera_manager.set_sensor(cam_index, notify=False)
+        self.camera_manager.warm_pool()
         actor_type = get_actor_display_name(self.player)
         self.hud.notification(actor_type)
 
@@ -124,28 +151,112 @@ class World:
 
     def toggle_radar(self):
         if self.radar_sensor is None:
-            self.radar_sensor = RadarSensor(self.player)
+            self.radar_sensor = RadarSensor(
+                self.player, self.hud.latency, self.occupancy, sensor_tick=self.sensor_ticks["radar"]
+            )
         elif self.radar_sensor.sensor is not None:
             self.radar_sensor.sensor.destroy()
             self.radar_sensor = None
 
+    def toggle_lidar(self):
+        if self.lidar_sensor is None:
+            self.lidar_sensor = LidarSensor(self.player, self.hud.latency, sensor_tick=self.sensor_ticks["lidar"])
+        elif self.lidar_sensor.sensor is not None:
+            if self.camera_manager.lidar is not None:
+                self.camera_manager.toggle_lidar_view(None)
+            self.lidar_sensor.sensor.destroy()
+            self.lidar_sensor = None
+
+    def toggle_lidar_view(self):
+        if self.lidar_sensor is None:
+            self.toggle_lidar()
+        self.camera_manager.toggle_lidar_view(self.lidar_sensor)
+
+    def set_sensor_quality(self, render_scale, camera_tick, radar_tick, lidar_tick):
+        """Respawn the display sensors whose render scale or sensor tick changed."""
+        if render_scale != self.render_scale or camera_tick != self.sensor_ticks["camera"]:
+            self.render_scale = render_scale
+            self.sensor_ticks["camera"] = camera_tick
+            self.camera_manager.reconfigure(render_scale, camera_tick)
+        if radar_tick != self.sensor_ticks["radar"]:
+            self.sensor_ticks["radar"] = radar_tick
+            if self.radar_sensor is not None:
+                self.toggle_radar()
+                self.toggle_radar()
+        if lidar_tick != self.sensor_ticks["lidar"]:
+            self.sensor_ticks["lidar"] = lidar_tick
+            if self.lidar_sensor is not None:
+                shown = self.camera_manager.lidar is not None
+                self.lidar_sensor.sensor.destroy()
+                self.lidar_sensor = LidarSensor(self.player, self.hud.latency, sensor_tick=lidar_tick)
+                if shown:
+                    self.lidar_sensor.set_image_size(self.hud.dim)
+                    self.camera_manager.lidar = self.lidar_sensor
+
+    def start_recorder(self, client):
+        client.start_recorder(self.recording_name)
+        RecordingIndex.invalidate(self.recording_name)
+        self._recording_index = None
+        self.recording_enabled = True
+
+    def stop_recorder(self, client):
+        """Stop the recorder and drop any index built while the file was still being written."""
+        client.stop_recorder()
+        RecordingIndex.invalidate(self.recording_name)
+        self._recording_index = None
+        self.recording_enabled = False
+
+    def recording_index(self, client):
+        """Return the index of the current recording, parsed once and then read from its cache."""
+        if self._recording_index is None:
+            self._recording_index = RecordingIndex.load_or_build(client, self.recording_name)
+        return self._recording_index
+
+    def seek_collision(self, client, forward=True):
+        """Move the replay start a few seconds before the next or previous recorded collision."""
+        if self.recording_enabled:
+            self.hud.notification("Stop the recorder before seeking collisions")
+            return
+        index = self.recording_index(client)
+        cursor = self.recording_collision if self.recording_collision is not None else self.recording_start
+        collision = index.next_collision(cursor) if forward else index.previous_collision(cursor)
+        if collision is None:
+            self.hud.notification("No %s collision in '%s'" % ("next" if forward else "previous", self.recording_name))
+            return
+        self.recording_collision = collision
+        self.recording_start = index.clamp(collision - self.REPLAY_LEAD)
+        self.hud.notification(
+            "Recording start time is %.1f (collision %d of %d at %.1f s)"
+            % (
+                self.recording_start,
+                index.collision_times.index(collision) + 1,
+                len(index.collision_times),
+                collision,
+            )
+        )
+
     def tick(self, clock):
+        self.actor_index.refresh()
         self.hud.tick(self, clock)
 
     def render(self, display):
-        self.camera_manager.render(display)
-        self.hud.render(display)
+        """Draw the frame, return the dirty rectangles of the display."""
+        rects = self.camera_manager.render(display)
+        rects += self.hud.render(display)
+        return rects
 
     def destroy_sensors(self):
-        self.camera_manager.sensor.destroy()
-        self.camera_manager.sensor = None
-        self.camera_manager.index = None
+        self.camera_manager.destroy()
 
-    def destroy(self):
+    def destroy(self, traffic=True):
+        if traffic and self.traffic is not None:
+            self.traffic.destroy()
         if self.radar_sensor is not None:
             self.toggle_radar()
+        if self.lidar_sensor is not None:
+            self.toggle_lidar()
+        self.camera_manager.destroy()
         sensors = [
-            self.camera_manager.sensor,
             self.collision_sensor.sensor,
             self.lane_invasion_sensor.sensor,
             self.gnss_sensor.sensor,
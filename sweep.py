@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""
+Sweep tire friction and damping over braking episodes on the route of the manual control client.
+
+Every configuration runs its episodes back to back with the same vehicle in the already loaded world: the
+vehicle is teleported to the spawn point, launched at the test speed and fully braked while a pure pursuit
+controller holds the route. Per-episode metrics are written to a CSV results file.
+"""
+
+import glob
+import os
+import sys
+
+sys.path.append(
+    glob.glob(
+        "/opt/carla-simulator/PythonAPI/carla/dist/carla-*%d.%d-%s.egg"
+        % (sys.version_info.major, sys.version_info.minor, "win-amd64" if os.name == "nt" else "linux-x86_64")
+    )[0]
+)
+
+import argparse
+import csv
+import itertools
+import logging
+import math
+import time
+
+import carla
+import numpy as np
+
+from src.friction import PhysicsTemplate, spawn_friction_triggers
+from src.planner import RoutePlanner
+from src.spatial import GridIndex
+from src.world import World
+
+FIELDS = [
+    "friction",
+    "damping",
+    "triggers",
+    "episode",
+    "speed",
+    "time_to_stop",
+    "stop_distance",
+    "max_lateral_deviation",
+    "collision_intensity",
+    "timed_out",
+    "wall_seconds",
+]
+
+
+class RouteTracker:
+    """Lateral deviation from, and pure pursuit steering along, a dense (N, 3) x, y, yaw route."""
+
+    def __init__(self, route, wheelbase=2.875, lookahead=8.0, max_steer=math.radians(70.0)):
+        self.route = route
+        self.wheelbase = wheelbase
+        self.lookahead = lookahead
+        self.max_steer = max_steer
+        self._grid = GridIndex(route[:, :2], cell_size=5.0)
+        self._spacing = float(np.median(np.hypot(*np.diff(route[:, :2], axis=0).T)))
+
+    def deviation(self, x, y):
+        """Return (nearest route index, distance to the route polyline)."""
+        index, _ = self._grid.nearest(x, y)
+        best = math.inf
+        for start in (index - 1, index):
+            if start < 0 or start + 1 >= len(self.route):
+                continue
+            a, b = self.route[start, :2], self.route[start + 1, :2]
+            segment = b - a
+            t = min(max(np.dot((x, y) - a, segment) / max(np.dot(segment, segment), 1e-12), 0.0), 1.0)
+            best = min(best, math.hypot(*((x, y) - (a + t * segment))))
+        return index, best if best < math.inf else math.hypot(*((x, y) - self.route[index, :2]))
+
+    def steer(self, index, x, y, yaw):
+        """Normalized steering command towards the route point `lookahead` metres ahead of `index`."""
+        target = self.route[min(index + int(self.lookahead / max(self._spacing, 1e-3)), len(self.route) - 1)]
+        alpha = math.atan2(target[1] - y, target[0] - x) - math.radians(yaw)
+        distance = max(math.hypot(target[0] - x, target[1] - y), 1e-3)
+        angle = math.atan2(2.0 * self.wheelbase * math.sin(alpha), distance)
+        return max(-1.0, min(1.0, angle / self.max_steer))
+
+
+def run_episode(world, vehicle, physics, tracker, collisions, args):
+    start_wall = time.time()
+    # Trigger volumes change the wheels and a teleport skips their exit event, every episode starts from the template.
+    template, friction, damping = physics
+    template.apply(vehicle, friction, damping)
+    vehicle.set_transform(World.SPAWN_POINT)
+    vehicle.set_target_velocity(carla.Vector3D())
+    vehicle.set_target_angular_velocity(carla.Vector3D())
+    vehicle.apply_control(carla.VehicleControl(brake=1.0))
+    for _ in range(args.settle_ticks):
+        world.tick()
+    del collisions[:]
+    forward = World.SPAWN_POINT.get_forward_vector()
+    vehicle.set_target_velocity(carla.Vector3D(forward.x * args.speed, forward.y * args.speed, 0.0))
+    world.tick()
+
+    snapshot = world.get_snapshot()
+    start_time = snapshot.timestamp.elapsed_seconds
+    previous = None
+    distance = 0.0
+    max_deviation = 0.0
+    timed_out = True
+    while snapshot.timestamp.elapsed_seconds - start_time < args.timeout:
+        actor = snapshot.find(vehicle.id)
+        transform, velocity = actor.get_transform(), actor.get_velocity()
+        x, y = transform.location.x, transform.location.y
+        if previous is not None:
+            distance += math.hypot(x - previous[0], y - previous[1])
+        previous = (x, y)
+        index, deviation = tracker.deviation(x, y)
+        max_deviation = max(max_deviation, deviation)
+        if math.hypot(velocity.x, velocity.y) < 0.1:
+            timed_out = False
+            break
+        vehicle.apply_control(carla.VehicleControl(brake=1.0, steer=tracker.steer(index, x, y, transform.rotation.yaw)))
+        world.tick()
+        snapshot = world.get_snapshot()
+    return {
+        "time_to_stop": round(snapshot.timestamp.elapsed_seconds - start_time, 3),
+        "stop_distance": round(distance, 3),
+        "max_lateral_deviation": round(max_deviation, 3),
+        "collision_intensity": round(sum(collisions), 3),
+        "timed_out": int(timed_out),
+        "wall_seconds": round(time.time() - start_wall, 3),
+    }
+
+
+def sweep(args, client):
+    world = client.get_world()
+    route = RoutePlanner(world.get_map(), 2.0).plan(World.SPAWN_POINT, World.GOAL)
+    if route is None:
+        logging.error("no route from the spawn point to the goal")
+        return
+    tracker = RouteTracker(route)
+    original_settings = world.get_settings()
+    settings = world.get_settings()
+    settings.synchronous_mode = True
+    settings.fixed_delta_seconds = args.delta
+    settings.no_rendering_mode = not args.rendering
+    world.apply_settings(settings)
+
+    blueprint = world.get_blueprint_library().filter("model3")[0]
+    blueprint.set_attribute("role_name", "sweep")
+    vehicle = None
+    sensor = None
+    triggers = []
+    collisions = []
+    episodes = 0
+    start = time.time()
+    try:
+        vehicle = world.spawn_actor(blueprint, World.SPAWN_POINT)
+        sensor = world.spawn_actor(
+            world.get_blueprint_library().find("sensor.other.collision"), carla.Transform(), attach_to=vehicle
+        )
+        sensor.listen(
+            lambda event: collisions.append(
+                math.sqrt(event.normal_impulse.x ** 2 + event.normal_impulse.y ** 2 + event.normal_impulse.z ** 2)
+            )
+        )
+        world.tick()
+        template = PhysicsTemplate.for_vehicle(vehicle)
+        with open(args.output, "w", newline="", encoding="utf-8") as out:
+            writer = csv.DictWriter(out, FIELDS)
+            writer.writeheader()
+            for friction, damping in itertools.product(args.frictions, args.dampings):
+                if args.trigger_length > 0.0:
+                    # Friction comes from the volumes, the wheels keep the friction of the template.
+                    physics = (template, None, damping)
+                    triggers = spawn_friction_triggers(client, world, route, friction, args.trigger_length)
+                else:
+                    physics = (template, friction, damping)
+                for episode in range(args.episodes):
+                    metrics = run_episode(world, vehicle, physics, tracker, collisions, args)
+                    row = {
+                        "friction": friction,
+                        "damping": damping,
+                        "triggers": int(bool(triggers)),
+                        "episode": episode,
+                        "speed": args.speed,
+                    }
+                    row.update(metrics)
+                    writer.writerow(row)
+                    out.flush()
+                    episodes += 1
+                    logging.info(
+                        "friction %.2f damping %.2f episode %d: stopped in %.2f s over %.1f m, deviation %.2f m",
+                        friction,
+                        damping,
+                        episode,
+                        metrics["time_to_stop"],
+                        metrics["stop_distance"],
+                        metrics["max_lateral_deviation"],
+                    )
+                client.apply_batch([carla.command.DestroyActor(actor.id) for actor in triggers])
+                triggers = []
+    finally:
+        actors = triggers + [actor for actor in (sensor, vehicle) if actor is not None]
+        if sensor is not None:
+            sensor.stop()
+        client.apply_batch([carla.command.DestroyActor(actor.id) for actor in actors])
+        world.apply_settings(original_settings)
+    hours = (time.time() - start) / 3600.0
+    print("%d episodes in %.1f s: %.0f episodes per hour" % (episodes, 3600.0 * hours, episodes / max(hours, 1e-9)))
+    print("results written to %s" % os.path.abspath(args.output))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__)
+    argparser.add_argument(
+        "--host", metavar="H", default="127.0.0.1", help="IP of the host server (default: 127.0.0.1)"
+    )
+    argparser.add_argument(
+        "-p", "--port", metavar="P", default=2000, type=int, help="TCP port to listen to (default: 2000)"
+    )
+    argparser.add_argument(
+        "-f",
+        "--frictions",
+        metavar="LIST",
+        default="0.5,1.0,2.0,3.5",
+        help="comma separated tire frictions to sweep (default: 0.5,1.0,2.0,3.5)",
+    )
+    argparser.add_argument(
+        "-d",
+        "--dampings",
+        metavar="LIST",
+        default="0.25",
+        help="comma separated wheel damping rates to sweep (default: 0.25)",
+    )
+    argparser.add_argument(
+        "-n", "--episodes", metavar="N", default=5, type=int, help="episodes per configuration (default: 5)"
+    )
+    argparser.add_argument(
+        "--speed", metavar="V", default=15.0, type=float, help="speed at the start of braking in m/s (default: 15)"
+    )
+    argparser.add_argument(
+        "--trigger-length",
+        metavar="M",
+        default=0.0,
+        type=float,
+        help="apply the friction with trigger volumes over the first M metres of the route instead of the wheels",
+    )
+    argparser.add_argument(
+        "--delta", metavar="S", default=0.05, type=float, help="fixed delta seconds per step (default: 0.05)"
+    )
+    argparser.add_argument(
+        "--timeout", metavar="S", default=30.0, type=float, help="simulated seconds before an episode is abandoned"
+    )
+    argparser.add_argument(
+        "--settle-ticks", metavar="N", default=5, type=int, help="ticks to settle after a reset (default: 5)"
+    )
+    argparser.add_argument("--rendering", action="store_true", help="keep server rendering enabled")
+    argparser.add_argument(
+        "-o", "--output", metavar="PATH", default="sweep_results.csv", help="results file (default: sweep_results.csv)"
+    )
+    args = argparser.parse_args()
+    args.frictions = [float(x) for x in args.frictions.split(",")]
+    args.dampings = [float(x) for x in args.dampings.split(",")]
+
+    logging.basicConfig(format="%(levelname)s: %(message)s", level=logging.INFO)
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    sweep(args, client)
+
+
+if __name__ == "__main__":
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("\nCancelled by user. Bye!")